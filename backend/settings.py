@@ -45,7 +45,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'marketplace.middleware.MetricsMiddleware',  # Первым, чтобы мерить весь ответ
+    'marketplace.middleware.PerformanceMiddleware',  # Сразу за метриками: замер всех остальных слоев
+    'marketplace.middleware.ReplicaRoutingMiddleware',  # До сессий: их чтение тоже маршрутизируется
     'django.middleware.security.SecurityMiddleware',
+    'marketplace.staticfiles.StaticFilesMiddleware',  # Собранная статика без похода в представления
+    'marketplace.feeds.FeedFilesMiddleware',  # sitemap.xml и фид - файлы с диска, без ORM
+    'marketplace.throttling.ThrottleMiddleware',  # До кеша страниц и сессий: отказ 429 без запросов к БД
+    'marketplace.compression.CompressionMiddleware',  # До кеша страниц: сжатые варианты кешируются рядом
+    'marketplace.page_cache.PageCacheMiddleware',  # До сессий: анонимные попадания не трогают БД
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Добавить перед CommonMiddleware
     'django.middleware.common.CommonMiddleware',
@@ -61,13 +69,20 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
+        # Шаблоны разбираются один раз на процесс; в DEBUG кеш сбрасывается автоперезагрузкой
         'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'marketplace.context_processors.static_assets',
             ],
         },
     },
@@ -94,14 +109,307 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Живые обновления остатков и цен (SSE, см. marketplace/live.py)
+# Для нескольких воркеров укажите межпроцессный бэкенд:
+# 'BACKEND': 'marketplace.live.RedisBroadcast',
+# 'OPTIONS': {'url': 'redis://localhost:6379/0'},
+LIVE_UPDATES = {
+    'BACKEND': 'marketplace.live.LocalBroadcast',
+    'OPTIONS': {},
+    'HEARTBEAT': 15,
+    'MAX_PRODUCTS': 100,
+}
+
+# Инструментирование запросов (см. marketplace/instrumentation.py)
+# SAMPLE_RATE - доля запросов, для которых собираются SQL/шаблоны/время;
+# в production достаточно 0.01-0.05
+PERF_INSTRUMENTATION = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0 if DEBUG else 0.05,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'SERVER_TIMING': DEBUG,
+}
+
+# Метрики Prometheus (см. marketplace/metrics.py)
+# DIR - общий для всех воркеров каталог mmap-файлов (по файлу на живой процесс,
+# файлы завершившихся процессов подхватываются новыми).
+# /metrics отдается только с ALLOWED_IPS или по заголовку "Authorization: Bearer <TOKEN>"
+MARKETPLACE_METRICS = {
+    'DIR': os.environ.get('METRICS_DIR', BASE_DIR / 'var' / 'metrics'),
+    'ALLOWED_IPS': [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip],
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedLocMemCache',
+        'LOCATION': 'default',
+    },
+    # Кеш страниц витрины (см. marketplace/page_cache.py) общий для всех
+    # процессов, иначе сброс и прогрев из run_workers не дойдут до веб-процессов:
+    # файлы на локальном диске, с REDIS_URL - Redis (нужно для нескольких хостов).
+    # Кеш страниц в LocMem вне DEBUG отключается
+    'pages': {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedRedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {'METRICS_NAME': 'pages'},
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedFileBasedCache',
+        'LOCATION': os.environ.get('PAGE_CACHE_DIR', BASE_DIR / 'var' / 'page_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 2000, 'METRICS_NAME': 'pages'},
+    },
+    # Кеш сессий (см. marketplace/sessions.py): с REDIS_URL - общий Redis,
+    # иначе LocMem, и тогда сессии читаются и пишутся напрямую в БД
+    'sessions': {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedRedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {'METRICS_NAME': 'sessions'},
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedLocMemCache',
+        'LOCATION': 'sessions',
+    },
+    # Корзины токенов ограничения частоты (см. marketplace/throttling.py): с REDIS_URL -
+    # общий Redis, иначе LocMem, и тогда каждый процесс считает лимиты отдельно
+    'throttling': {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedRedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {'METRICS_NAME': 'throttling'},
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'marketplace.cache_backends.InstrumentedLocMemCache',
+        'LOCATION': 'throttling',
+    },
+}
+
+# Кеш страниц для анонимных посетителей и его прогрев (manage.py warm_page_cache после деплоя)
+# WARM_CONCURRENCY - сколько страниц рендерится одновременно при прогреве
+PAGE_CACHE = {
+    'ENABLED': True,
+    'CACHE': 'pages',
+    'TIMEOUT': 600,
+    'TOP_K': 100,
+    'FLUSH_INTERVAL': 30,
+    'HALF_LIFE_HOURS': 24,
+    'WARM_LIMIT': 100,
+    'WARM_CONCURRENCY': 2,
+    'WARM_DELAY': 10,
+}
+
+# Фоновые задачи (см. marketplace/task_queue.py, воркеры - manage.py run_workers)
+# LEASE_SECONDS - аренда задачи воркером: должна превышать время самой долгой задачи
+TASK_QUEUE = {
+    'LEASE_SECONDS': 300,
+    'POLL_INTERVAL': 1.0,
+    'RETRY_BACKOFF': 5,
+    'RETRY_BACKOFF_MAX': 3600,
+    'KEEP_FINISHED_HOURS': 24,
+}
+
+# Загруженные изображения продуктов уменьшаются в фоне до этого размера по большей стороне
+PRODUCT_IMAGE_MAX_SIZE = 1600
+
+# Подсказки поиска (см. marketplace/suggest.py): снимок индекса открывается
+# каждым процессом через mmap; собирается manage.py build_search_suggest
+SEARCH_SUGGEST = {
+    'PATH': os.environ.get('SEARCH_SUGGEST_PATH', BASE_DIR / 'var' / 'search_suggest.idx'),
+    'TOP_K': 10,
+    'SCAN_LIMIT': 256,
+    'REBUILD_DELAY': 15,
+}
+
+# Ограничение частоты запросов (см. marketplace/throttling.py): корзины токенов
+# в кеше 'throttling'; при нескольких процессах нужен общий кеш (REDIS_URL)
+THROTTLING = {
+    'ENABLED': os.environ.get('THROTTLING_ENABLED', '1') == '1',
+    'CACHE': 'throttling',
+    'IP_HEADER': os.environ.get('THROTTLING_IP_HEADER') or None,
+}
+
+# Сессии (см. marketplace/sessions.py): чтение из общего кеша, запись в БД пачкой
+# после ответа и только при изменении содержимого
+SESSION_ENGINE = 'marketplace.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_STORE = {
+    'WRITE_BEHIND_SECONDS': float(os.environ.get('SESSION_WRITE_BEHIND_SECONDS', 0)),
+    'CLEAR_CHUNK_SIZE': 1000,
+}
+
+# Архив брошенных корзин (см. marketplace/cart_archive.py, manage.py archive_carts)
+CART_ARCHIVE = {
+    'STALE_DAYS': 30,
+    'CHUNK_SIZE': 1000,
+    'PAUSE': 0.05,
+}
+
+# Sitemap и товарный фид (см. marketplace/feeds.py): файлы в ROOT, раздаются
+# FeedFilesMiddleware; собираются manage.py build_feeds и фоновой задачей
+FEEDS = {
+    'ROOT': os.environ.get('FEEDS_ROOT', BASE_DIR / 'var' / 'feeds'),
+    'BASE_URL': os.environ.get('SITE_URL', 'http://127.0.0.1:8000'),
+    'CHUNK_SIZE': 10000,
+    'REBUILD_DELAY': 600,
+}
+
+# Вебхуки продавцов (см. marketplace/webhooks.py): события пишутся в outbox
+# вместе с изменением и отправляются задачей deliver_webhooks пачками по адресу
+WEBHOOKS = {
+    'DELIVERY_DELAY': 5,
+    'BATCH_SIZE': 100,
+    'TIMEOUT': 10,
+    'MAX_ATTEMPTS': 12,
+    'RETRY_BACKOFF': 30,
+    'KEEP_DELIVERED_HOURS': 72,
+}
+
+# Доменные события (см. marketplace/events.py): изменения каталога и корзин
+# пишутся в outbox в той же транзакции и раздаются подписчикам пачками
+DOMAIN_EVENTS = {
+    'BATCH_SIZE': 1000,
+    'DISPATCH_DELAY': 2,
+    'LEASE_SECONDS': 300,
+    'KEEP_HOURS': 24,
+}
+
+# Рекомендации "с этим товаром также добавляют" (см. marketplace/recommendations.py):
+# матрица совместных добавлений в корзины хранится в STATE_PATH и дополняется фоновой задачей
+RECOMMENDATIONS = {
+    'STATE_PATH': os.environ.get('RECOMMENDATIONS_STATE_PATH', BASE_DIR / 'var' / 'recommendations.bin'),
+    'TOP_K': 10,
+    'HALF_LIFE_DAYS': 30,
+    'REBUILD_DELAY': 300,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'marketplace.perf': {
+            'handlers': ['console'],
+            'level': 'WARNING',  # INFO - логировать каждый замеренный запрос
+            'propagate': False,
+        },
+        'marketplace.page_cache': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'marketplace.tasks': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Списки админки для таблиц больше этого порога показывают оценку числа строк
+# из статистики СУБД вместо полного COUNT(*) (marketplace.paginators)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 10000
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite настраивается при подключении: WAL позволяет читателям не ждать писателя,
+# synchronous=NORMAL в режиме WAL безопасен при падении процесса, mmap ускоряет чтение,
+# timeout - ожидание блокировки вместо немедленного "database is locked",
+# IMMEDIATE - транзакция сразу берет блокировку записи и не падает при ее повышении
+SQLITE_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA temp_store=MEMORY'
+    ),
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+}
+
+# Профиль БД выбирается переменной окружения DATABASE_ENGINE: sqlite (по умолчанию) или postgresql
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    # POSTGRES_POOL: psycopg - пул psycopg3 внутри процесса (Django 5.1+),
+    # pgbouncer - внешний PgBouncer в режиме transaction,
+    # none - постоянные соединения (CONN_MAX_AGE) без пула
+    POSTGRES_POOL = os.environ.get('POSTGRES_POOL', 'psycopg')
+    # Миграции на больших таблицах запускайте с POSTGRES_STATEMENT_TIMEOUT_MS=0
+    POSTGRES_STATEMENT_TIMEOUT_MS = int(os.environ.get('POSTGRES_STATEMENT_TIMEOUT_MS', '5000'))
+
+    def postgres_database(host):
+        options = {}
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'bigmarket'),
+            'USER': os.environ.get('POSTGRES_USER', 'bigmarket'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'OPTIONS': options,
+        }
+        if POSTGRES_POOL == 'pgbouncer':
+            # PgBouncer не пропускает параметры запуска и не сохраняет серверные курсоры
+            # между транзакциями: statement_timeout задается на роль
+            # (ALTER ROLE bigmarket SET statement_timeout = '5s')
+            database['DISABLE_SERVER_SIDE_CURSORS'] = True
+            database['CONN_MAX_AGE'] = 60
+            database['CONN_HEALTH_CHECKS'] = True
+            return database
+
+        options['options'] = f'-c statement_timeout={POSTGRES_STATEMENT_TIMEOUT_MS}'
+        if POSTGRES_POOL == 'psycopg':
+            from psycopg_pool import ConnectionPool
+
+            # Пул несовместим с CONN_MAX_AGE; check проверяет соединение при выдаче из пула
+            options['pool'] = {
+                'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', '10')),
+                'timeout': 10,
+                'max_idle': 300,
+                'check': ConnectionPool.check_connection,
+            }
+        else:
+            database['CONN_MAX_AGE'] = 600
+            database['CONN_HEALTH_CHECKS'] = True
+        return database
+
+    DATABASES = {'default': postgres_database(os.environ.get('POSTGRES_HOST', 'localhost'))}
+    # Реплики потоковой репликации: хосты через запятую
+    for _index, _host in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica_{_index}'] = dict(postgres_database(_host.strip()), TEST={'MIRROR': 'default'})
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': SQLITE_OPTIONS,
+        }
     }
+
+    # Реплики только для чтения (например, копии LiteFS/Litestream): пути через запятую.
+    # Каждая подключается как алиас replica_N в режиме только чтения
+    for _index, _path in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(','))):
+        DATABASES[f'replica_{_index}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f'file:{_path.strip()}?mode=ro',
+            'OPTIONS': {'timeout': 20},
+            'TEST': {'MIRROR': 'default'},
+        }
+
+DATABASE_ROUTERS = ['marketplace.db_router.PrimaryReplicaRouter']
+
+# Маршрутизация чтений (см. marketplace/db_router.py)
+# STICKY_SECONDS - сколько после записи клиент читает из основной базы;
+# должно превышать отставание реплик
+DATABASE_ROUTING = {
+    'REPLICAS': [alias for alias in DATABASES if alias.startswith('replica_')],
+    'READ_ONLY_VIEWS': [
+        'index', 'catalog', 'product_detail',
+        'product-list', 'product-detail', 'product-similar',
+        'tag-list', 'tag-detail',
+    ],
+    'STICKY_SECONDS': 5,
+    'STICKY_COOKIE': 'db_primary',
 }
 
 
@@ -123,6 +431,23 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Хеширование паролей (см. marketplace/passwords.py): первый хешер - основной,
+# остальные проверяют старые хеши, которые перехешируются при входе.
+# argon2 требует argon2-cffi из requirements-auth.txt
+PASSWORD_HASHERS = [
+    'marketplace.passwords.ScryptPasswordHasher',
+    'marketplace.passwords.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+]
+if os.environ.get('PASSWORD_HASHER') == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+PASSWORD_HASHING = {
+    'POOL_SIZE': int(os.environ.get('PASSWORD_HASH_POOL_SIZE', 4)),
+    'SCRYPT': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    'ARGON2': {'time_cost': 2, 'memory_cost': 19 * 1024, 'parallelism': 1},
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -161,6 +486,38 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
+# collectstatic пишет сюда файлы с хешем в имени и .gz/.br-варианты
+# (см. marketplace/staticfiles.py); при DEBUG = False их раздает StaticFilesMiddleware
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'marketplace.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Сжатие ответов (см. marketplace/compression.py); br и zstd - при установленных
+# пакетах Brotli и zstandard (requirements-compression.txt)
+COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    'ENCODINGS': ['br', 'zstd', 'gzip'],
+    'LEVELS': {'br': 5, 'zstd': 6, 'gzip': 6},
+}
+
+# Сборка Tailwind CSS (manage.py build_tailwind); OUTPUT - путь внутри STATICFILES_DIRS[0]
+TAILWIND = {
+    'CLI': os.environ.get('TAILWIND_CLI', 'tailwindcss'),
+    'INPUT': BASE_DIR / 'assets' / 'tailwind.input.css',
+    'OUTPUT': 'css/tailwind.css',
+    'CONTENT': [
+        BASE_DIR / 'marketplace' / 'templates' / '**' / '*.html',
+        BASE_DIR / 'marketplace' / '**' / '*.py',
+    ],
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
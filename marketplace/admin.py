@@ -1,8 +1,20 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
-from .models import Product, Tag, Seller, Client, ProductPhoto, CartItem
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F
+from django.utils import timezone
+from . import moderation, webhooks
+from .models import (
+    Product, Tag, Seller, Client, ProductPhoto, CartItem, ModerationDecision, AbandonedCartStats,
+    WebhookEndpoint, WebhookEvent,
+)
+from .paginators import EstimatedCountPaginator
 
 
 @admin.register(Tag)
@@ -12,10 +24,15 @@ class TagAdmin(admin.ModelAdmin):
     list_filter = ['created_at']
     ordering = ['tagtitle']
     
+    def get_queryset(self, request):
+        """Количество продуктов считается одним запросом для всей страницы"""
+        return super().get_queryset(request).annotate(_products_count=Count('products'))
+    
     def products_count(self, obj):
         """Количество продуктов с этим тегом"""
-        return obj.products.count()
+        return obj._products_count
     products_count.short_description = 'Количество продуктов'
+    products_count.admin_order_field = '_products_count'
 
 
 @admin.register(Seller)
@@ -50,12 +67,14 @@ class SellerAdmin(BaseUserAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_products_count=Count('products'))
+    
     def products_count(self, obj):
         """Количество продуктов продавца"""
-        if obj.pk:
-            return obj.products.count()
-        return 0
+        return getattr(obj, '_products_count', 0)
     products_count.short_description = 'Продуктов'
+    products_count.admin_order_field = '_products_count'
 
 
 @admin.register(Client)
@@ -111,6 +130,11 @@ class ProductAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at', 'thumbnail_preview', 'photos_count']
     filter_horizontal = ['tags']
     inlines = [ProductPhotoInline]
+    list_select_related = ['seller']
+    # На больших таблицах точный COUNT(*) заменяется оценкой из статистики СУБД
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['approve_selected', 'reject_selected']
     fieldsets = (
         ('Основная информация', {
             'fields': ('title', 'description', 'seller'),
@@ -146,14 +170,76 @@ class ProductAdmin(admin.ModelAdmin):
     
     def photos_count(self, obj):
         """Количество фотографий"""
-        if obj.pk:
-            return obj.product_photos.count()
-        return 0
+        return getattr(obj, '_photos_count', 0)
     photos_count.short_description = 'Фотографий'
+    photos_count.admin_order_field = '_photos_count'
     
     def get_queryset(self, request):
-        """Оптимизация запросов"""
-        return super().get_queryset(request).select_related('seller').prefetch_related('tags', 'product_photos')
+        """Оптимизация запросов: счетчик фотографий - аннотацией, без prefetch по строкам"""
+        return super().get_queryset(request).annotate(_photos_count=Count('product_photos'))
+    
+    def get_urls(self):
+        return [
+            path(
+                'moderation/',
+                self.admin_site.admin_view(self.moderation_view),
+                name='marketplace_product_moderation',
+            ),
+        ] + super().get_urls()
+    
+    def moderation_view(self, request):
+        """
+        Пакетная модерация с клавиатуры. Пачка закрепляется за модератором
+        только по POST (кнопка "Взять пачку" или применение решений), чтобы
+        перезагрузка и предзагрузка страницы не забирали продукты из очереди.
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        
+        if request.method == 'POST':
+            if 'release' in request.POST:
+                released = moderation.release_claims(request.user)
+                self.message_user(request, f'Возвращено в очередь: {released}')
+                return redirect('admin:marketplace_product_changelist')
+            
+            if 'claim' in request.POST:
+                moderation.claim_batch(request.user)
+                return redirect('admin:marketplace_product_moderation')
+            
+            counts = {}
+            for decision in (ModerationDecision.APPROVED, ModerationDecision.REJECTED):
+                ids = [int(value) for value in request.POST.getlist(decision) if value.isdigit()]
+                counts[decision] = len(moderation.decide(request.user, ids, decision)) if ids else 0
+            self.message_user(
+                request,
+                f"Одобрено: {counts[ModerationDecision.APPROVED]}, отклонено: {counts[ModerationDecision.REJECTED]}"
+            )
+            # Модератор продолжает работу: следующая пачка закрепляется сразу
+            moderation.claim_batch(request.user)
+            return redirect('admin:marketplace_product_moderation')
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Модерация продуктов',
+            'batch': moderation.claimed_batch(request.user),
+            'queue_length': moderation.queue_queryset().count(),
+            'throughput': moderation.throughput(hours=24),
+            'claim_ttl_minutes': int(moderation.get_claim_ttl().total_seconds() // 60),
+        }
+        return TemplateResponse(request, 'admin/marketplace/product/moderation.html', context)
+    
+    def approve_selected(self, request, queryset):
+        ids = moderation.decide(request.user, list(queryset.values_list('id', flat=True)),
+                                ModerationDecision.APPROVED, require_claim=False)
+        self.message_user(request, f'Одобрено: {len(ids)}')
+    approve_selected.short_description = 'Одобрить выбранные'
+    
+    def reject_selected(self, request, queryset):
+        ids = moderation.decide(request.user, list(queryset.values_list('id', flat=True)),
+                                ModerationDecision.REJECTED, require_claim=False)
+        self.message_user(request, f'Отклонено: {len(ids)}')
+    reject_selected.short_description = 'Отклонить выбранные'
 
 
 @admin.register(ProductPhoto)
@@ -164,6 +250,9 @@ class ProductPhotoAdmin(admin.ModelAdmin):
     search_fields = ['product__title']
     readonly_fields = ['created_at', 'photo_preview']
     ordering = ['product', 'order', 'created_at']
+    list_select_related = ['product']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Основная информация', {
@@ -195,6 +284,9 @@ class CartItemAdmin(admin.ModelAdmin):
     search_fields = ['client__email', 'product__title']
     readonly_fields = ['created_at', 'updated_at', 'total_price']
     ordering = ['-created_at']
+    list_select_related = ['client', 'product']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Основная информация', {
@@ -207,7 +299,88 @@ class CartItemAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_total_price=ExpressionWrapper(
+            F('product__price') * F('quantity'),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ))
+    
     def total_price(self, obj):
-        """Общая стоимость товара"""
-        return f"{obj.get_total_price()} ₽"
+        """Общая стоимость товара: аннотация списка, для формы добавления - по продукту"""
+        total = getattr(obj, '_total_price', None)
+        if total is None:
+            total = obj.get_total_price()
+        return f"{total} ₽"
     total_price.short_description = 'Общая стоимость'
+    total_price.admin_order_field = '_total_price'
+
+
+
+@admin.register(ModerationDecision)
+class ModerationDecisionAdmin(admin.ModelAdmin):
+    """Журнал решений модерации (только просмотр)"""
+    list_display = ['id', 'product', 'decision', 'moderator', 'decided_at']
+    list_filter = ['decision', 'decided_at']
+    list_select_related = ['product', 'moderator']
+    search_fields = ['product__title']
+    date_hierarchy = 'decided_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AbandonedCartStats)
+class AbandonedCartStatsAdmin(admin.ModelAdmin):
+    """Брошенные корзины по дням (пополняется командой archive_carts)"""
+    list_display = ['day', 'product_id', 'lines', 'quantity', 'amount']
+    list_filter = ['day']
+    search_fields = ['=product_id']
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(WebhookEndpoint)
+class WebhookEndpointAdmin(admin.ModelAdmin):
+    """Адреса вебхуков продавцов"""
+    list_display = ['id', 'seller', 'url', 'events', 'is_active', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['url', 'seller__company_name', 'seller__email']
+    list_select_related = ['seller']
+    raw_id_fields = ['seller']
+    readonly_fields = ['secret', 'created_at']
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    """Outbox событий вебхуков (только просмотр); ошибочные можно вернуть в доставку"""
+    list_display = ['id', 'endpoint', 'event', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status', 'event']
+    list_select_related = ['endpoint']
+    search_fields = ['=endpoint__id', 'endpoint__url']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['retry_selected']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def retry_selected(self, request, queryset):
+        updated = queryset.exclude(status=WebhookEvent.DELIVERED).update(
+            status=WebhookEvent.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
+        transaction.on_commit(lambda: webhooks.events_queued.send(sender=WebhookEvent, count=updated))
+        self.message_user(request, f'Возвращено в доставку: {updated}')
+    retry_selected.short_description = 'Повторить доставку'
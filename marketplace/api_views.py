@@ -1,20 +1,24 @@
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
-from .models import Product, Tag, Seller, Client
+from django.utils.crypto import get_random_string
+from .models import Product, Tag, Seller, Client, WebhookEndpoint
 from .serializers import (
     ProductListSerializer, ProductDetailSerializer, ProductCreateSerializer,
     TagSerializer, SellerRegistrationSerializer, ClientRegistrationSerializer,
-    SellerSerializer, ClientSerializer
+    SellerSerializer, ClientSerializer, WebhookEndpointSerializer
 )
 from .permissions import (
     IsSeller, IsClient, IsSellerOrReadOnly, 
     IsProductOwner, IsAdminOrReadOnly
 )
 from .authentication import TokenAuthentication
+from . import recommendations
+from .throttling import BucketThrottle
 
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
@@ -37,6 +41,8 @@ class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     permission_classes = [IsSellerOrReadOnly]
     authentication_classes = [TokenAuthentication]
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'api_products'
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -117,7 +123,11 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        # Отклоненный продукт после правки возвращается в очередь модерации
+        if not instance.checked:
+            serializer.save(moderated_at=None)
+        else:
+            self.perform_update(serializer)
         
         return Response(ProductDetailSerializer(instance).data)
     
@@ -139,11 +149,46 @@ class ProductViewSet(viewsets.ModelViewSet):
         similar = Product.objects.filter(
             tags__in=product.tags.all(),
             checked=True
-        ).exclude(id=product.id).distinct()[:5]
+        ).exclude(id=product.id).select_related('seller').prefetch_related('tags').distinct()[:5]
         
         serializer = ProductListSerializer(similar, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny], url_path='also-added')
+    def also_added(self, request, pk=None):
+        """
+        С этим товаром также добавляют (по корзинам покупателей).
+        Сам продукт не запрашивается: список читается по индексу рекомендаций
+        """
+        try:
+            product_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        products = recommendations.also_added(product_id).select_related('seller').prefetch_related('tags')
+        serializer = ProductListSerializer(products, many=True)
+        return Response(serializer.data)
+
+
+class WebhookEndpointViewSet(viewsets.ModelViewSet):
+    """
+    Адреса вебхуков текущего продавца (см. marketplace.webhooks)
+    - Продавец видит и меняет только свои адреса
+    - Секрет подписи создается сервером; rotate_secret выдает новый
+    """
+    serializer_class = WebhookEndpointSerializer
+    permission_classes = [IsSeller]
+    authentication_classes = [TokenAuthentication]
+    
+    def get_queryset(self):
+        return WebhookEndpoint.objects.filter(seller=self.request.user)
+    
+    @action(detail=True, methods=['post'], url_path='rotate-secret')
+    def rotate_secret(self, request, pk=None):
+        endpoint = self.get_object()
+        endpoint.secret = get_random_string(48)
+        endpoint.save(update_fields=['secret'])
+        return Response(self.get_serializer(endpoint).data)
+
 
 class SellerRegistrationView(generics.CreateAPIView):
     """
@@ -153,6 +198,8 @@ class SellerRegistrationView(generics.CreateAPIView):
     serializer_class = SellerRegistrationSerializer
     permission_classes = [AllowAny]
     authentication_classes = []
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'api_register'
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -173,6 +220,8 @@ class ClientRegistrationView(generics.CreateAPIView):
     serializer_class = ClientRegistrationSerializer
     permission_classes = [AllowAny]
     authentication_classes = []
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'api_register'
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
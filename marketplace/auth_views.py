@@ -2,9 +2,9 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_protect
-from django.contrib.auth import authenticate
 from .forms import ClientRegistrationForm, ClientLoginForm, SellerLoginForm
 from .models import Client, Seller
+from . import passwords
 
 
 @csrf_protect
@@ -39,20 +39,16 @@ def client_login(request):
             email = form.cleaned_data['email']
             password = form.cleaned_data['password']
             
-            # Используем authenticate с нашим кастомным бэкендом
-            try:
-                client = Client.objects.get(email=email, is_active=True)
-                if client.check_password(password):
-                    # Сохраняем информацию в сессии для веб-интерфейса
-                    request.session['client_id'] = client.id
-                    request.session['client_email'] = client.email
-                    request.session['client_name'] = f'{client.first_name} {client.last_name}'
-                    messages.success(request, f'Добро пожаловать, {client.first_name}!')
-                    return redirect('index')
-                else:
-                    messages.error(request, 'Неверный пароль')
-            except Client.DoesNotExist:
-                messages.error(request, 'Клиент с таким email не найден')
+            # Неизвестный email и неверный пароль неразличимы ни по ответу, ни по времени
+            client = passwords.authenticate(Client, email, password)
+            if client is not None:
+                # Сохраняем информацию в сессии для веб-интерфейса
+                request.session['client_id'] = client.id
+                request.session['client_email'] = client.email
+                request.session['client_name'] = f'{client.first_name} {client.last_name}'
+                messages.success(request, f'Добро пожаловать, {client.first_name}!')
+                return redirect('index')
+            messages.error(request, 'Неверный email или пароль')
     else:
         form = ClientLoginForm()
     
@@ -72,19 +68,15 @@ def seller_login(request):
             email = form.cleaned_data['email']
             password = form.cleaned_data['password']
             
-            try:
-                seller = Seller.objects.get(email=email, is_active=True)
-                if seller.check_password(password):
-                    # Сохраняем информацию в сессии для веб-интерфейса
-                    request.session['seller_id'] = seller.id
-                    request.session['seller_email'] = seller.email
-                    request.session['seller_company'] = seller.company_name
-                    messages.success(request, f'Добро пожаловать, {seller.company_name}!')
-                    return redirect('index')
-                else:
-                    messages.error(request, 'Неверный пароль')
-            except Seller.DoesNotExist:
-                messages.error(request, 'Продавец с таким email не найден')
+            seller = passwords.authenticate(Seller, email, password)
+            if seller is not None:
+                # Сохраняем информацию в сессии для веб-интерфейса
+                request.session['seller_id'] = seller.id
+                request.session['seller_email'] = seller.email
+                request.session['seller_company'] = seller.company_name
+                messages.success(request, f'Добро пожаловать, {seller.company_name}!')
+                return redirect('index')
+            messages.error(request, 'Неверный email или пароль')
     else:
         form = SellerLoginForm()
     
@@ -0,0 +1,51 @@
+"""
+Бэкенды кеша с учетом попаданий и промахов в метриках
+(marketplace_cache_requests_total, marketplace_cache_hit_ratio).
+"""
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+
+from . import metrics
+
+_MISSING = object()
+
+
+class InstrumentedCacheMixin:
+    """Считает hit/miss для get() и get_many(); имя кеша берется из LOCATION"""
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        # METRICS_NAME - опция миксина: клиент Redis не принимает лишних параметров
+        metrics_name = options.pop('METRICS_NAME', None)
+        super().__init__(server, {**params, 'OPTIONS': options})
+        self.metrics_name = metrics_name or str(server) or 'default'
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            metrics.cache_requests.inc(cache=self.metrics_name, result='miss')
+            return default
+        metrics.cache_requests.inc(cache=self.metrics_name, result='hit')
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version)
+        if found:
+            metrics.cache_requests.inc(len(found), cache=self.metrics_name, result='hit')
+        if len(keys) > len(found):
+            metrics.cache_requests.inc(len(keys) - len(found), cache=self.metrics_name, result='miss')
+        return found
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentedFileBasedCache(InstrumentedCacheMixin, FileBasedCache):
+    pass
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+    pass
@@ -0,0 +1,201 @@
+"""
+Карточки продуктов для витрины, похожих товаров и списка продавца.
+
+Карточка - плоский словарь (product_card), собранный один раз из
+продукта с уже загруженными prefetch_related('tags', 'product_photos').
+Разметка карточки заранее разобрана в строки формата по вариантам
+(VARIANTS), поэтому рендер 100 карточек - это 100 вызовов str.format без
+разрешения атрибутов, фильтров и {% url %} шаблонизатора. URL
+product_detail строится по закешированному шаблону reverse().
+
+В шаблонах: {% load product_cards %}{% product_cards cards "catalog" %}.
+"""
+from functools import lru_cache
+
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.utils.formats import localize
+from django.utils.html import escape
+from django.utils.text import Truncator
+
+# Число, которое не встречается в самих маршрутах: на его место подставляется id
+URL_PLACEHOLDER = 987654321
+
+
+@lru_cache(maxsize=32)
+def _url_parts(name, script_prefix, urlconf):
+    url = reverse(name, args=[URL_PLACEHOLDER], urlconf=urlconf)
+    head, _, tail = url.partition(str(URL_PLACEHOLDER))
+    return head, tail
+
+
+def object_url(name, object_id):
+    """reverse(name, args=[object_id]) для маршрутов с одним целым аргументом без повторного разбора"""
+    head, tail = _url_parts(name, get_script_prefix(), get_urlconf())
+    return f'{head}{object_id}{tail}'
+
+
+def product_card(product):
+    """Плоский словарь карточки; продукт должен быть загружен с prefetch тегов и фотографий"""
+    photos = product.product_photos.all()
+    if photos:
+        image_url = photos[0].photo.url
+    elif product.thumbnail:
+        image_url = product.thumbnail.url
+    else:
+        image_url = ''
+    return {
+        'id': product.id,
+        'title': product.title,
+        'description': product.description,
+        'price': product.price,
+        'stock': product.stock,
+        'checked': product.checked,
+        'image_url': image_url,
+        'tags': [tag.tagtitle for tag in product.tags.all()],
+        'url': object_url('product_detail', product.id),
+    }
+
+
+def product_cards(products):
+    return [product_card(product) for product in products]
+
+
+def _image(card, title, img_class, placeholder):
+    if card['image_url']:
+        return f'<img src="{escape(card["image_url"])}" alt="{title}" class="{img_class}"/>'
+    return placeholder
+
+
+def _stock(card):
+    if card['stock'] > 0:
+        return f'<span class="text-xs text-green-400">В наличии: {localize(card["stock"])} шт.</span>'
+    return '<span class="text-xs text-red-400">Нет в наличии</span>'
+
+
+def _tags(card, limit, separator=', '):
+    if not card['tags']:
+        return ''
+    return (
+        '<p class="text-xs uppercase tracking-wide text-white/50">'
+        + separator.join(escape(tag) for tag in card['tags'][:limit])
+        + '</p>'
+    )
+
+
+CATALOG = (
+    '<article class="flex h-full flex-col justify-between rounded-lg bg-neutral-900 p-4 shadow-md'
+    ' hover:bg-neutral-800 transition">'
+    '<div class="space-y-3">'
+    '<div class="flex items-center justify-center mb-1 overflow-hidden rounded-lg">{image}</div>'
+    '<div class="space-y-1">{tags}'
+    '<h3 class="text-lg font-semibold leading-snug"><a href="{url}" class="hover:text-white">{title}</a></h3>'
+    '<p class="text-sm text-white/60 line-clamp-2">{description}</p>'
+    '</div></div>'
+    '<div class="mt-3 space-y-2">'
+    '<div class="flex items-center justify-between">'
+    '<div class="text-lg font-semibold text-white">{price} ₽</div>{stock}</div>'
+    '<a href="{url}" class="inline-block w-full text-center rounded-lg bg-blue-700 px-4 py-2 text-sm'
+    ' font-semibold text-white shadow hover:bg-blue-800 focus:outline-none focus:ring-2 focus:ring-blue-400'
+    '{button_class}">{button}</a>'
+    '</div></article>'
+)
+
+SIMILAR = (
+    '<article class="rounded-lg border border-white/10 bg-neutral-900 p-4 shadow-sm">'
+    '<div class="flex aspect-square w-full items-center justify-center overflow-hidden rounded-lg'
+    ' bg-neutral-800 shadow-inner">{image}</div>'
+    '<div class="mt-3 space-y-1">{tags}'
+    '<h3 class="text-lg font-semibold leading-snug text-white"><a href="{url}" class="hover:text-white">{title}</a></h3>'
+    '<p class="text-sm text-white/60 line-clamp-2">{description}</p>'
+    '</div>'
+    '<div class="mt-3 flex items-center justify-between text-white">'
+    '<span class="text-lg font-semibold">{price} ₽</span>'
+    '<a href="{url}" class="text-sm font-semibold text-white/70 transition hover:text-white">Подробнее</a>'
+    '</div></article>'
+)
+
+SELLER = (
+    '<article class="flex flex-col rounded-lg border border-white/10 bg-neutral-900 p-4 shadow-sm">'
+    '<div class="mb-3 flex aspect-square w-full items-center justify-center overflow-hidden rounded-lg'
+    ' bg-neutral-800">{image}</div>'
+    '<div class="flex-1 space-y-2">'
+    '<h3 class="text-lg font-semibold text-white"><a href="{url}" class="hover:text-blue-400">{title}</a></h3>'
+    '<p class="text-sm text-white/60 line-clamp-2">{description}</p>'
+    '<div class="flex items-center justify-between">'
+    '<span class="text-lg font-semibold text-white">{price} ₽</span>'
+    '<span class="text-sm text-white/60">Остаток: {stock} шт.</span>'
+    '</div>'
+    '<div class="flex items-center justify-between">{status}'
+    '<a href="{edit_url}" class="rounded-lg bg-blue-700 px-3 py-1 text-xs font-semibold text-white'
+    ' hover:bg-blue-800">Редактировать</a>'
+    '</div></div></article>'
+)
+
+NO_PHOTO_SQUARE = '<span class="text-sm text-white/50">Нет фото</span>'
+
+
+def _catalog_fields(card, title, size, tag_limit, button, button_class):
+    return {
+        'image': _image(
+            card, title, f'{size} object-cover bg-neutral-800 rounded-lg shadow-inner',
+            f'<div class="{size} flex items-center justify-center bg-neutral-800 rounded-lg text-white/50 text-xs">'
+            'Нет фото</div>',
+        ),
+        'tags': _tags(card, tag_limit),
+        'stock': _stock(card),
+        'button': button,
+        'button_class': button_class,
+    }
+
+
+def _similar_fields(card, title):
+    return {
+        'image': _image(card, title, 'h-full w-full object-cover', NO_PHOTO_SQUARE),
+        'tags': _tags(card, 1),
+    }
+
+
+def _seller_fields(card, title):
+    return {
+        'image': _image(card, title, 'h-full w-full object-cover', NO_PHOTO_SQUARE),
+        'description': escape(Truncator(card['description']).words(15)),
+        'stock': localize(card['stock']),
+        'status': (
+            '<span class="rounded-full bg-green-900/50 px-2 py-1 text-xs text-green-400">Проверен</span>'
+            if card['checked'] else
+            '<span class="rounded-full bg-yellow-900/50 px-2 py-1 text-xs text-yellow-400">На проверке</span>'
+        ),
+        'edit_url': object_url('seller_product_edit', card['id']),
+    }
+
+
+# вариант: (строка формата, поля варианта по карточке и экранированному названию)
+VARIANTS = {
+    'catalog': (
+        CATALOG,
+        lambda card, title: _catalog_fields(card, title, 'w-full h-48', 2, 'Подробнее', ' transition'),
+    ),
+    'home': (
+        CATALOG,
+        lambda card, title: _catalog_fields(card, title, 'w-24 h-24', 1, 'Узнать подробнее', ''),
+    ),
+    'similar': (SIMILAR, _similar_fields),
+    'seller': (SELLER, _seller_fields),
+}
+
+
+def render_card(card, variant='catalog'):
+    template, variant_fields = VARIANTS[variant]
+    title = escape(card['title'])
+    fields = {
+        'url': card['url'],
+        'title': title,
+        'description': escape(card['description']),
+        'price': localize(card['price']),
+    }
+    fields.update(variant_fields(card, title))
+    return template.format(**fields)
+
+
+def render_cards(cards, variant='catalog'):
+    return ''.join(render_card(card, variant) for card in cards)
@@ -0,0 +1,147 @@
+"""
+Перенос брошенных корзин из CartItem в архив.
+
+Строки, не менявшиеся STALE_DAYS дней, переносятся в ArchivedCartItem
+(или просто удаляются при archive=False), а их количество и сумма
+добавляются к агрегатам AbandonedCartStats по дню и продукту.
+
+Таблица проходится диапазонами первичного ключа по CHUNK_SIZE id, без
+OFFSET и без длинных транзакций: на каждый диапазон - одна короткая
+транзакция (выборка с блокировкой строк, вставка в архив, upsert
+агрегатов, DELETE по id), после нее пауза PAUSE секунд, чтобы не
+мешать записи в корзины на SQLite и PostgreSQL.
+"""
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from . import metrics
+from .models import AbandonedCartStats, ArchivedCartItem, CartItem, Product
+
+DEFAULTS = {
+    'STALE_DAYS': 30,
+    'CHUNK_SIZE': 1000,
+    'PAUSE': 0.05,
+}
+
+archived_cart_lines = metrics.Counter(
+    'marketplace_cart_lines_archived_total',
+    'Строки брошенных корзин, убранные из CartItem',
+    ['action'],
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'CART_ARCHIVE', {}).get(name, DEFAULTS[name])
+
+
+@dataclass
+class Progress:
+    first_id: int = 0
+    last_id: int = 0
+    position: int = 0
+    moved: int = 0
+    seconds: float = 0.0
+
+    @property
+    def scanned(self):
+        return max(0, min(self.position, self.last_id + 1) - self.first_id)
+
+    @property
+    def rate(self):
+        return self.moved / self.seconds if self.seconds else 0.0
+
+
+def add_to_stats(rows, prices):
+    """Добавляет строки корзин к AbandonedCartStats: одно чтение и один upsert"""
+    totals = defaultdict(lambda: [0, 0, Decimal(0)])
+    for row in rows:
+        total = totals[(timezone.localdate(row['updated_at']), row['product_id'])]
+        total[0] += 1
+        total[1] += row['quantity']
+        total[2] += prices.get(row['product_id'], Decimal(0)) * row['quantity']
+
+    existing = {
+        (stats.day, stats.product_id): stats
+        for stats in AbandonedCartStats.objects.filter(
+            day__in={day for day, _ in totals},
+            product_id__in={product_id for _, product_id in totals},
+        )
+    }
+    objs = []
+    for (day, product_id), (lines, quantity, amount) in totals.items():
+        stats = existing.get((day, product_id)) or AbandonedCartStats(day=day, product_id=product_id)
+        stats.lines += lines
+        stats.quantity += quantity
+        stats.amount += amount
+        objs.append(stats)
+    AbandonedCartStats.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=['day', 'product_id'],
+        update_fields=['lines', 'quantity', 'amount'],
+    )
+
+
+def archive_range(low, high, cutoff, archive=True):
+    """Переносит устаревшие строки с low <= id < high; возвращает их число"""
+    with transaction.atomic():
+        rows = list(
+            CartItem.objects.select_for_update()
+            .filter(id__gte=low, id__lt=high, updated_at__lt=cutoff)
+            .order_by()
+            .values('id', 'client_id', 'product_id', 'quantity', 'created_at', 'updated_at')
+        )
+        if not rows:
+            return 0
+        prices = dict(
+            Product.objects.filter(id__in={row['product_id'] for row in rows}).values_list('id', 'price')
+        )
+        if archive:
+            now = timezone.now()
+            ArchivedCartItem.objects.bulk_create(
+                [
+                    ArchivedCartItem(price=prices.get(row['product_id'], Decimal(0)), archived_at=now, **row)
+                    for row in rows
+                ],
+                ignore_conflicts=True,
+            )
+        add_to_stats(rows, prices)
+        CartItem.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    archived_cart_lines.inc(len(rows), action='archived' if archive else 'deleted')
+    return len(rows)
+
+
+def archive_stale_carts(days=None, archive=True, chunk_size=None, pause=None, on_chunk=None):
+    """
+    Проходит CartItem диапазонами id от меньшего к большему. on_chunk(progress)
+    вызывается после каждого диапазона. Возвращает итоговый Progress.
+    """
+    days = get_setting('STALE_DAYS') if days is None else days
+    chunk_size = chunk_size or get_setting('CHUNK_SIZE')
+    pause = get_setting('PAUSE') if pause is None else pause
+    cutoff = timezone.now() - timedelta(days=days)
+
+    bounds = CartItem.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return Progress()
+    progress = Progress(first_id=bounds['low'], last_id=bounds['high'], position=bounds['low'])
+    started = time.perf_counter()
+    while progress.position <= progress.last_id:
+        high = progress.position + chunk_size
+        progress.moved += archive_range(progress.position, high, cutoff, archive)
+        progress.position = high
+        progress.seconds = time.perf_counter() - started
+        if on_chunk:
+            on_chunk(progress)
+        if pause and progress.position <= progress.last_id:
+            time.sleep(pause)
+    progress.seconds = time.perf_counter() - started
+    return progress
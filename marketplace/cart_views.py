@@ -4,6 +4,7 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_protect
 from django.db.models import Sum, F
 from .models import Product, CartItem, Client
+from . import metrics
 
 
 @csrf_protect
@@ -78,6 +79,7 @@ def add_to_cart(request, product_id):
         else:
             messages.success(request, f'Товар "{product.title}" добавлен в корзину')
         
+        metrics.cart_adds.inc()
         return redirect('cart')
         
     except Client.DoesNotExist:
@@ -0,0 +1,218 @@
+"""
+Сжатие ответов: brotli, zstd (если установлены пакеты Brotli и zstandard) и gzip.
+
+CompressionMiddleware сжимает HTML, JSON и прочие текстовые ответы не
+меньше MIN_SIZE байт, выбирая кодировку по Accept-Encoding в порядке
+ENCODINGS. Уже сжатые форматы (изображения, архивы), файлы (FileResponse:
+медиа и статика) и SSE-потоки не трогаются. StreamingHttpResponse
+сжимается потоково. Для страниц из кеша (marketplace.page_cache) сжатый
+вариант сохраняется рядом со страницей, и повторные попадания отдают
+его без повторного сжатия.
+"""
+import gzip
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import page_cache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - необязательная зависимость
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - необязательная зависимость
+    zstandard = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    # Порядок предпочтения, если клиент принимает несколько кодировок
+    'ENCODINGS': ['br', 'zstd', 'gzip'],
+    # Уровни для ответов на лету: баланс CPU и степени сжатия
+    'LEVELS': {'br': 5, 'zstd': 6, 'gzip': 6},
+}
+
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/(?!event-stream)|application/(json|javascript|xml|rss\+xml|atom\+xml|x-ndjson|ld\+json)|image/svg\+xml)'
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'COMPRESSION', {}).get(name, DEFAULTS[name])
+
+
+class GzipStream:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+def _gzip(data, level):
+    # mtime=0 - одинаковый результат для одинакового содержимого
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+# кодировка: (сжатие целиком, потоковый компрессор); только доступные в окружении
+CODECS = {'gzip': (_gzip, GzipStream)}
+if brotli is not None:
+    CODECS['br'] = (lambda data, level: brotli.compress(data, quality=level), BrotliStream)
+if zstandard is not None:
+    CODECS['zstd'] = (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data), ZstdStream)
+
+
+def compress(encoding, data, level=None):
+    level = get_setting('LEVELS')[encoding] if level is None else level
+    return CODECS[encoding][0](data, level)
+
+
+def parse_accept_encoding(header):
+    """Кодировки из Accept-Encoding с q > 0: {'gzip', 'br', ...}"""
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(token)
+    return accepted
+
+
+def negotiate(request, available=None):
+    """Лучшая доступная кодировка, которую принимает клиент, или None"""
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if not accepted:
+        return None
+    available = CODECS if available is None else available
+    for encoding in get_setting('ENCODINGS'):
+        if encoding in available and (encoding in accepted or '*' in accepted):
+            return encoding
+    return None
+
+
+def is_compressible(response):
+    return (
+        not response.has_header('Content-Encoding')
+        and not getattr(response, 'file_to_stream', None)
+        and response.status_code not in (204, 206, 304)
+        and COMPRESSIBLE_TYPES.match(response.get('Content-Type', ''))
+    )
+
+
+def weaken_etag(response):
+    # Сжатое тело отличается побайтно - сильный ETag стал бы неверным
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+def apply_encoding(response, encoding, content):
+    response.content = content
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(content))
+    weaken_etag(response)
+
+
+def stream(response, encoding):
+    """Заменить streaming_content на потоково сжатый"""
+    level = get_setting('LEVELS')[encoding]
+    compressor = CODECS[encoding][1](level)
+
+    def compress_sync(chunks):
+        for chunk in chunks:
+            data = compressor.compress(chunk if isinstance(chunk, bytes) else bytes(chunk))
+            if data:
+                yield data
+        yield compressor.finish()
+
+    async def compress_async(chunks):
+        async for chunk in chunks:
+            data = compressor.compress(chunk if isinstance(chunk, bytes) else bytes(chunk))
+            if data:
+                yield data
+        yield compressor.finish()
+
+    if response.is_async:
+        response.streaming_content = compress_async(response.streaming_content)
+    else:
+        response.streaming_content = compress_sync(response.streaming_content)
+    del response['Content-Length']
+    response['Content-Encoding'] = encoding
+    weaken_etag(response)
+
+
+class CompressionMiddleware:
+    """
+    Сжатие текстовых ответов (см. модуль). Ставится до PageCacheMiddleware
+    и до middleware, читающих тело ответа.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = get_setting('ENABLED')
+        self.min_size = get_setting('MIN_SIZE')
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.enabled or not is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request)
+        if encoding is None:
+            return response
+        if response.streaming:
+            stream(response, encoding)
+            return response
+
+        content = compress(encoding, response.content)
+        if len(content) >= len(response.content):
+            return response
+        cache_key = getattr(response, 'page_cache_key', None)
+        if cache_key:
+            # Страница из кеша: сжатый вариант сохраняется рядом с ней
+            page_cache.store_variant(cache_key, encoding, content)
+        apply_encoding(response, encoding, content)
+        return response
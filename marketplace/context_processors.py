@@ -0,0 +1,18 @@
+"""Контекстные процессоры шаблонов маркетплейса"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+
+
+@lru_cache(maxsize=None)
+def tailwind_css_url():
+    """URL собранного Tailwind CSS или None, если build_tailwind еще не выполнялся"""
+    name = settings.TAILWIND['OUTPUT']
+    return static(name) if finders.find(name) else None
+
+
+def static_assets(request):
+    # Без собранного CSS base.html подключает Tailwind с CDN (компиляция в браузере)
+    return {'tailwind_css_url': tailwind_css_url()}
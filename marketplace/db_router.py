@@ -0,0 +1,82 @@
+"""
+Маршрутизация запросов к БД: запись - в основную базу, чтение из
+представлений только для чтения - в реплики.
+
+Реплика выбирается в ReplicaRoutingMiddleware по имени URL
+(settings.DATABASE_ROUTING['READ_ONLY_VIEWS']) и хранится в ContextVar
+на время запроса. Все остальные чтения идут в основную базу.
+
+Чтение своих записей: после запроса, изменившего данные, клиент получает
+cookie STICKY_COOKIE на STICKY_SECONDS (больше ожидаемого отставания
+реплик), и пока она действует, его чтения обслуживает основная база.
+Внутри запроса после первой записи чтения тоже переключаются на основную базу.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'READ_ONLY_VIEWS': [],
+    'STICKY_SECONDS': 5,
+    'STICKY_COOKIE': 'db_primary',
+}
+
+_state = ContextVar('marketplace_db_routing', default=None)
+
+
+def get_setting(name):
+    return getattr(settings, 'DATABASE_ROUTING', {}).get(name, DEFAULTS[name])
+
+
+def replicas():
+    return [alias for alias in get_setting('REPLICAS') if alias in settings.DATABASES]
+
+
+def begin_request():
+    """Новое состояние маршрутизации для запроса; возвращает токен для end_request"""
+    return _state.set({'read_alias': None, 'wrote': False})
+
+
+def end_request(token):
+    """Завершить запрос; True, если в нем была запись в основную базу"""
+    state = _state.get()
+    _state.reset(token)
+    return bool(state and state['wrote'])
+
+
+def use_replica():
+    """Направить чтения текущего запроса в случайную реплику (если реплики настроены)"""
+    state = _state.get()
+    aliases = replicas()
+    if state is not None and aliases:
+        state['read_alias'] = random.choice(aliases)
+    return state['read_alias'] if state else None
+
+
+class PrimaryReplicaRouter:
+    """Запись - в основную базу, чтение - в реплику, выбранную для текущего запроса"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if not state or not state['read_alias'] or state['wrote']:
+            return None
+        # Внутри транзакции основной базы читаем оттуда же
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return state['read_alias']
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
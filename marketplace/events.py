@@ -0,0 +1,428 @@
+"""
+Шина доменных событий для изменений Product, Tag, ProductPhoto и CartItem.
+
+Изменения пишутся в outbox (DomainEvent) в той же транзакции, что и сами
+изменения. Массовые операции QuerySet.update(), bulk_create(),
+bulk_update() и delete() идут через ChangeEventQuerySet (менеджер
+objects этих моделей). Сохранения и удаления отдельных объектов
+записываются сигналами моделей в marketplace.signals. Строка outbox
+компактна: модель, действие, список id и имена измененных полей; одна
+строка на операцию записи, а не на объект.
+
+Подписчики объявляются декоратором @subscriber и получают Batch -
+изменения, схлопнутые по (модель, id): тысяча UPDATE при импорте дают
+по одному id на объект с объединенным набором полей, и подписчик
+сбрасывает каждый ключ один раз.
+
+- local=True: подписчик вызывается в пишущем процессе сразу после
+  коммита с изменениями этой транзакции. Падение процесса между
+  коммитом и вызовом теряет вызов, поэтому так подписываются только кеши.
+- Остальные подписчики читают outbox фоновой задачей
+  dispatch_domain_events пачками до BATCH_SIZE событий, у каждого своя
+  позиция (EventCursor). Ошибка подписчика не сдвигает его позицию и не
+  мешает остальным; доставка "хотя бы один раз".
+
+Позиция подписчика не должна обогнать событие, которое еще не видно.
+На PostgreSQL транзакция с меньшим id может закоммититься позже соседней,
+поэтому событие хранит xid записавшей транзакции (pg_current_xact_id()),
+а подписчики читают события в порядке (xid, id) только с xid меньше xmin
+снимка: все такие транзакции уже завершены, и новых событий до этой
+границы появиться не может. На SQLite запись сериализована, порядок id
+совпадает с порядком коммитов, и xid всегда 0.
+"""
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger('marketplace.events')
+
+DEFAULTS = {
+    'BATCH_SIZE': 1000,
+    'DISPATCH_DELAY': 2,
+    'LEASE_SECONDS': 300,
+    'KEEP_HOURS': 24,
+}
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+# Отправляется после коммита транзакции, записавшей события (подписан marketplace.signals)
+events_recorded = Signal()
+
+domain_events = metrics.Counter(
+    'marketplace_domain_events_total',
+    'Изменения объектов, записанные в outbox доменных событий',
+    ['model', 'action'],
+)
+subscriber_batches = metrics.Counter(
+    'marketplace_event_batches_total',
+    'Пачки доменных событий, переданные подписчикам',
+    ['subscriber', 'status'],
+)
+
+_subscribers = {}
+_local = threading.local()
+
+
+def get_setting(name):
+    return getattr(settings, 'DOMAIN_EVENTS', {}).get(name, DEFAULTS[name])
+
+
+def _model(name):
+    # models.py импортирует этот модуль ради менеджера
+    return apps.get_model('marketplace', name)
+
+
+@dataclass
+class Change:
+    actions: set
+    # None - изменены неизвестные поля: создание, удаление, сохранение целиком
+    fields: set | None
+
+
+class Batch:
+    """Изменения, схлопнутые по (модель, id)"""
+
+    def __init__(self):
+        self._changes = defaultdict(dict)
+
+    def add(self, model, action, ids, fields=()):
+        for pk in ids:
+            change = self._changes[model].get(pk)
+            if change is None:
+                change = self._changes[model][pk] = Change(set(), set(fields) if fields else None)
+            elif change.fields is not None:
+                if fields:
+                    change.fields.update(fields)
+                else:
+                    change.fields = None
+            change.actions.add(action)
+
+    def __bool__(self):
+        return any(self._changes.values())
+
+    def __len__(self):
+        return sum(len(changes) for changes in self._changes.values())
+
+    def changes(self, model):
+        return dict(self._changes.get(model, {}))
+
+    def ids(self, model, actions=None, ignore_fields=()):
+        """
+        id измененных объектов model. actions - только с этими действиями;
+        ignore_fields - без объектов, у которых менялись только эти поля.
+        """
+        ignore = set(ignore_fields)
+        return {
+            pk
+            for pk, change in self._changes.get(model, {}).items()
+            if (actions is None or change.actions & set(actions))
+            and (change.fields is None or not change.fields <= ignore)
+        }
+
+
+@dataclass
+class Subscriber:
+    name: str
+    func: object
+    models: tuple
+    local: bool
+
+    def wants(self, model):
+        return not self.models or model in self.models
+
+
+def subscriber(name, models=(), local=False):
+    """Декоратор подписчика: func(batch) получает изменения моделей models (пусто - всех)"""
+    def decorator(func):
+        _subscribers[name] = Subscriber(name, func, tuple(models), local)
+        return func
+    return decorator
+
+
+def subscribers(local=False):
+    return [sub for sub in _subscribers.values() if sub.local == local]
+
+
+def model_name(model):
+    return model if isinstance(model, str) else model._meta.model_name
+
+
+def record(model, action, ids, fields=(), using=None):
+    """
+    Записать событие в outbox в текущей транзакции. После коммита
+    вызываются локальные подписчики и ставится рассылка остальным.
+    """
+    ids = [pk for pk in ids if pk is not None]
+    if not ids:
+        return None
+    name = model_name(model)
+    fields = sorted(fields)
+    DomainEvent = _model('DomainEvent')
+    using = using or router.db_for_write(DomainEvent)
+    event = DomainEvent.objects.using(using).create(
+        model=name, action=action, object_ids=ids, fields=fields, xid=_current_xid(using),
+    )
+    domain_events.inc(len(ids), model=name, action=action)
+    _remember((name, action, ids, fields), using)
+    return event
+
+
+def _current_xid(using):
+    if connections[using].vendor != 'postgresql':
+        return 0
+    return RawSQL('pg_current_xact_id()::text::bigint', (), output_field=models.BigIntegerField())
+
+
+def record_deleted(model, pk, using=None):
+    """Удаление объекта: внутри ChangeEventQuerySet.delete() id копятся и пишутся одной строкой на модель"""
+    collected = getattr(_local, 'deleted', None)
+    if collected is not None:
+        collected[model_name(model)].append(pk)
+    else:
+        record(model, DELETED, [pk], using=using)
+
+
+class PendingChanges(list):
+    """Изменения транзакции для локальных подписчиков; вызывается один раз после коммита"""
+
+    def __call__(self):
+        for sub in subscribers(local=True):
+            batch = make_batch(row for row in self if sub.wants(row[0]))
+            if not batch:
+                continue
+            try:
+                sub.func(batch)
+            except Exception:
+                subscriber_batches.inc(subscriber=sub.name, status='failed')
+                logger.exception('local subscriber %s failed', sub.name)
+            else:
+                subscriber_batches.inc(subscriber=sub.name, status='done')
+        events_recorded.send(sender=_model('DomainEvent'))
+
+
+def _remember(row, using):
+    # Колбэк регистрируется один раз на уровень вложенности atomic и
+    # пропадает вместе с ним при откате до точки сохранения
+    connection = transaction.get_connection(using)
+    # atomic(savepoint=False) кладет в savepoint_ids None
+    savepoints = set(connection.savepoint_ids) - {None}
+    for sids, callback, _ in connection.run_on_commit:
+        if isinstance(callback, PendingChanges) and sids - {None} == savepoints:
+            callback.append(row)
+            return
+    transaction.on_commit(PendingChanges([row]), using=using)
+
+
+def make_batch(rows):
+    batch = Batch()
+    for model, action, ids, fields in rows:
+        batch.add(model, action, ids, fields)
+    return batch
+
+
+class ChangeEventQuerySet(models.QuerySet):
+    """
+    QuerySet, записывающий массовые изменения в outbox доменных событий в
+    той же транзакции: одна строка outbox на операцию.
+    """
+
+    def update(self, **kwargs):
+        if getattr(_local, 'bulk_update', False):
+            # Пачка bulk_update: событие запишет сам bulk_update с id из объектов
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            # id выбираются тем же условием в той же транзакции перед UPDATE
+            ids = list(self.order_by().values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            record(self.model, UPDATED, ids, kwargs, using=self.db)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            _local.bulk_update = True
+            try:
+                rows = super().bulk_update(objs, fields, batch_size=batch_size)
+            finally:
+                _local.bulk_update = False
+            record(self.model, UPDATED, [obj.pk for obj in objs], fields, using=self.db)
+        return rows
+
+    bulk_update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            # При ignore_conflicts id вставленных строк неизвестны - такие объекты не попадают в событие
+            record(self.model, CREATED, [obj.pk for obj in created], using=self.db)
+        return created
+
+    bulk_create.alters_data = True
+
+    def delete(self):
+        if getattr(_local, 'deleted', None) is not None:
+            return super().delete()
+        with transaction.atomic(using=self.db, savepoint=False):
+            collected = _local.deleted = defaultdict(list)
+            try:
+                result = super().delete()
+            finally:
+                _local.deleted = None
+            # Удаленные каскадом объекты других моделей тоже пишутся одной строкой на модель
+            for model, ids in collected.items():
+                record(model, DELETED, ids, using=self.db)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+ChangeEventManager = models.Manager.from_queryset(ChangeEventQuerySet, 'ChangeEventManager')
+
+
+def _visible_xmin(using):
+    """xmin снимка PostgreSQL: транзакции с меньшим xid завершены. None на остальных СУБД"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+        return cursor.fetchone()[0]
+
+
+def _after(position):
+    xid, pk = position
+    return Q(xid__gt=xid) | Q(xid=xid, id__gt=pk)
+
+
+def _visible_events():
+    """События, до которых позиция подписчика может дойти (см. модуль)"""
+    DomainEvent = _model('DomainEvent')
+    events = DomainEvent.objects.all()
+    xmin = _visible_xmin(events.db)
+    return events if xmin is None else events.filter(xid__lt=xmin)
+
+
+def _lease(name, now):
+    EventCursor = _model('EventCursor')
+    EventCursor.objects.get_or_create(name=name)
+    claimed = EventCursor.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now), name=name,
+    ).update(locked_until=now + timedelta(seconds=get_setting('LEASE_SECONDS')))
+    if not claimed:
+        return None
+    return EventCursor.objects.values_list('position_xid', 'position').get(name=name)
+
+
+def dispatch_subscriber(sub, visible, high, batch_size):
+    """
+    Передать подписчику события из visible до позиции high (xid, id)
+    включительно; возвращает число прочитанных строк outbox.
+    """
+    EventCursor = _model('EventCursor')
+    position = _lease(sub.name, timezone.now())
+    if position is None:
+        # Подписчика обрабатывает другой воркер
+        return 0
+    processed = 0
+    try:
+        while position < high:
+            events = visible.filter(_after(position))
+            if sub.models:
+                events = events.filter(model__in=sub.models)
+            rows = list(
+                events.order_by('xid', 'id')
+                .values_list('xid', 'id', 'model', 'action', 'object_ids', 'fields')[:batch_size]
+            )
+            if rows:
+                sub.func(make_batch(row[2:] for row in rows))
+                subscriber_batches.inc(subscriber=sub.name, status='done')
+            # Неполная пачка - до high событий для подписчика больше нет
+            position = tuple(rows[-1][:2]) if len(rows) == batch_size else high
+            EventCursor.objects.filter(name=sub.name).update(
+                position_xid=position[0], position=position[1], updated_at=timezone.now(),
+            )
+            processed += len(rows)
+    except Exception:
+        subscriber_batches.inc(subscriber=sub.name, status='failed')
+        raise
+    finally:
+        EventCursor.objects.filter(name=sub.name).update(locked_until=None)
+    return processed
+
+
+def dispatch(batch_size=None):
+    """
+    Передать накопившиеся события подписчикам (кроме локальных). Возвращает
+    {подписчик: прочитано строк}. Если подписчик упал, остальные все равно
+    обрабатываются, а в конце поднимается исключение - задача будет повторена.
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    visible = _visible_events()
+    high = visible.order_by('-xid', '-id').values_list('xid', 'id').first()
+    processed, failed = {}, []
+    if high is None:
+        return processed
+    for sub in subscribers():
+        try:
+            processed[sub.name] = dispatch_subscriber(sub, visible, tuple(high), batch_size)
+        except Exception:
+            logger.exception('subscriber %s failed', sub.name)
+            failed.append(sub.name)
+    if failed:
+        raise RuntimeError(f'Подписчики доменных событий с ошибкой: {", ".join(failed)}')
+    return processed
+
+
+def _positions():
+    names = [sub.name for sub in subscribers()]
+    positions = {
+        name: (xid, pk)
+        for name, xid, pk in _model('EventCursor').objects.filter(name__in=names)
+        .values_list('name', 'position_xid', 'position')
+    }
+    return {name: positions.get(name, (0, 0)) for name in names}
+
+
+def backlog():
+    """Есть ли события, которые прочитали не все подписчики"""
+    positions = _positions()
+    return bool(positions) and _model('DomainEvent').objects.filter(_after(min(positions.values()))).exists()
+
+
+def purge(older_than=None):
+    """Удалить события старше KEEP_HOURS, прочитанные всеми подписчиками"""
+    older_than = older_than or timedelta(hours=get_setting('KEEP_HOURS'))
+    positions = _positions()
+    if not positions:
+        return 0
+    deleted, _ = _model('DomainEvent').objects.exclude(_after(min(positions.values()))).filter(
+        created_at__lt=timezone.now() - older_than,
+    ).delete()
+    return deleted
+
+
+@metrics.register_collector
+def subscriber_lag(totals):
+    positions = _positions()
+    if not positions:
+        return []
+    events = _model('DomainEvent').objects
+    values = [({'subscriber': name}, events.filter(_after(position)).count()) for name, position in positions.items()]
+    return [('marketplace_event_subscriber_lag', 'gauge', 'Строки outbox доменных событий после позиции подписчика', values)]
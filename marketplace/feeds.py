@@ -0,0 +1,356 @@
+"""
+Sitemap и товарный фид (YML) файлами на диске.
+
+Файлы собираются в ROOT и раздаются FeedFilesMiddleware как статика, без
+ORM на запросах поисковиков:
+
+    sitemap.xml (+ .gz)          индекс sitemap
+    sitemaps/pages.xml.gz        главная и каталог
+    sitemaps/tags-N.xml.gz       каталог по тегам
+    sitemaps/products-N.xml.gz   проверенные продукты с id в диапазоне N
+    feeds/products.yml.gz        фид в формате YML
+
+Продукты разбиты на диапазоны по CHUNK_SIZE id. Диапазон читается одним
+потоком values().iterator() и за один проход пишется и в свой файл
+sitemap, и в свою часть фида - отдельный gzip-член в .parts/. Фид - это
+склейка заголовка, частей и хвоста: несколько gzip-членов подряд
+образуют корректный gzip-файл, поэтому части не пережимаются.
+
+Пересборка инкрементальная: агрегирующие запросы дают по диапазонам
+число проверенных продуктов и max(updated_at), а также сводки фотографий
+и тегов (первая фотография и первый тег попадают в оффер, но их правки
+не меняют updated_at продукта). Заново пишутся только диапазоны, где это
+изменилось с прошлой сборки (состояние в .state.json). Изменения каталога ставят пересборку фоновой задачей;
+полная - manage.py build_feeds --full.
+"""
+import gzip
+import json
+import os
+import shutil
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .cards import object_url
+from .models import Product, ProductPhoto, Tag
+from .staticfiles import StaticFilesMiddleware
+
+DEFAULTS = {
+    'ROOT': None,
+    # Адрес сайта для абсолютных ссылок в sitemap и фиде
+    'BASE_URL': 'http://127.0.0.1:8000',
+    'SHOP_NAME': 'Маркетплейс',
+    'COMPANY': 'Маркетплейс',
+    # Не больше 50 000 ссылок на файл sitemap по протоколу
+    'CHUNK_SIZE': 10000,
+    'COMPRESS_LEVEL': 6,
+    'REBUILD_DELAY': 600,
+}
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+STATE_FILE = '.state.json'
+PARTS_DIR = '.parts'
+# Пути, которые раздает FeedFilesMiddleware
+URL_PREFIXES = ('/sitemap.xml', '/sitemaps/', '/feeds/')
+
+
+def get_setting(name):
+    return getattr(settings, 'FEEDS', {}).get(name, DEFAULTS[name])
+
+
+def get_root():
+    return Path(get_setting('ROOT') or Path(settings.BASE_DIR) / 'var' / 'feeds')
+
+
+def absolute(url):
+    if url.startswith(('http://', 'https://')):
+        return url
+    return get_setting('BASE_URL').rstrip('/') + url
+
+
+def media_url(name):
+    return absolute(default_storage.url(name)) if name else ''
+
+
+def w3c(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+class AtomicGzip:
+    """gzip-файл, который появляется под своим именем только после успешной записи"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.temp = self.path.with_name(self.path.name + '.tmp')
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.raw = open(self.temp, 'wb')
+        self.file = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=get_setting('COMPRESS_LEVEL'), mtime=0)
+        return self
+
+    def write(self, text):
+        self.file.write(text.encode())
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        self.raw.close()
+        if exc_type is None:
+            os.replace(self.temp, self.path)
+        else:
+            self.temp.unlink(missing_ok=True)
+
+
+def write_atomic(path, data):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    temp.write_bytes(data)
+    os.replace(temp, path)
+
+
+def url_entry(loc, lastmod=None):
+    lastmod = f'<lastmod>{w3c(lastmod)}</lastmod>' if lastmod else ''
+    return f'<url><loc>{escape(loc)}</loc>{lastmod}</url>\n'
+
+
+def chunk_stats(chunk_size):
+    """
+    {диапазон: подпись} тремя агрегирующими запросами. Подпись начинается с
+    числа проверенных продуктов и max(updated_at) в ISO, дальше - сводки
+    фотографий и тегов этих продуктов.
+    """
+    rows = (
+        Product.objects.filter(checked=True)
+        .annotate(chunk=F('id') / chunk_size)
+        .values('chunk')
+        .annotate(count=Count('id'), lastmod=Max('updated_at'))
+        .order_by()
+    )
+    # Суммы произведений id меняются и при перестановке фотографий или замене тега
+    photos = {
+        row['chunk']: (row['count'], row['added'].isoformat(), row['order'])
+        for row in ProductPhoto.objects.filter(product__checked=True)
+        .annotate(chunk=F('product_id') / chunk_size)
+        .values('chunk')
+        .annotate(count=Count('id'), added=Max('created_at'), order=Sum(F('id') * F('order')))
+        .order_by()
+    }
+    tags = {
+        row['chunk']: (row['count'], row['links'])
+        for row in Product.tags.through.objects.filter(product__checked=True)
+        .annotate(chunk=F('product_id') / chunk_size)
+        .values('chunk')
+        .annotate(count=Count('id'), links=Sum(F('product_id') * F('tag_id')))
+        .order_by()
+    }
+    return {
+        row['chunk']: (
+            row['count'], row['lastmod'].isoformat(),
+            *photos.get(row['chunk'], (0, None, 0)), *tags.get(row['chunk'], (0, 0)),
+        )
+        for row in rows
+    }
+
+
+def product_rows(chunk, chunk_size):
+    first_photo = ProductPhoto.objects.filter(product=OuterRef('pk')).order_by('order', 'created_at').values('photo')[:1]
+    first_tag = Product.tags.through.objects.filter(product_id=OuterRef('pk')).order_by('tag_id').values('tag_id')[:1]
+    return (
+        Product.objects.filter(checked=True, id__gte=chunk * chunk_size, id__lt=(chunk + 1) * chunk_size)
+        .order_by('id')
+        .values('id', 'title', 'description', 'price', 'stock', 'thumbnail', 'updated_at')
+        .annotate(photo=Subquery(first_photo), tag_id=Subquery(first_tag))
+        .iterator(chunk_size=2000)
+    )
+
+
+def offer_entry(row, url):
+    picture = media_url(row['photo'] or row['thumbnail'])
+    parts = [
+        f'<offer id="{row["id"]}" available="{"true" if row["stock"] > 0 else "false"}">',
+        f'<url>{escape(url)}</url>',
+        f'<price>{row["price"]}</price>',
+        '<currencyId>RUR</currencyId>',
+    ]
+    if row['tag_id'] is not None:
+        parts.append(f'<categoryId>{row["tag_id"]}</categoryId>')
+    if picture:
+        parts.append(f'<picture>{escape(picture)}</picture>')
+    parts.append(f'<name>{escape(row["title"])}</name>')
+    parts.append(f'<description>{escape(row["description"])}</description>')
+    parts.append(f'<count>{row["stock"]}</count>')
+    parts.append('</offer>\n')
+    return ''.join(parts)
+
+
+def write_product_chunk(root, chunk, chunk_size):
+    """Один проход по диапазону: файл sitemap и gzip-член фида"""
+    with AtomicGzip(root / 'sitemaps' / f'products-{chunk}.xml.gz') as sitemap, \
+            AtomicGzip(root / PARTS_DIR / f'offers-{chunk}.gz') as offers:
+        sitemap.write(f'{XML_HEADER}<urlset xmlns="{SITEMAP_NS}">\n')
+        for row in product_rows(chunk, chunk_size):
+            url = absolute(object_url('product_detail', row['id']))
+            sitemap.write(url_entry(url, row['updated_at']))
+            offers.write(offer_entry(row, url))
+        sitemap.write('</urlset>\n')
+
+
+def write_tag_sitemaps(root, chunk_size):
+    """Страницы каталога по тегам; возвращает имена файлов"""
+    catalog = absolute('/catalog/')
+    tags = Tag.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=2000)
+    names = []
+    while batch := list(islice(tags, chunk_size)):
+        names.append(f'tags-{len(names)}.xml.gz')
+        with AtomicGzip(root / 'sitemaps' / names[-1]) as sitemap:
+            sitemap.write(f'{XML_HEADER}<urlset xmlns="{SITEMAP_NS}">\n')
+            for tag_id in batch:
+                sitemap.write(url_entry(f'{catalog}?tags={tag_id}'))
+            sitemap.write('</urlset>\n')
+    return names
+
+
+def write_pages_sitemap(root):
+    with AtomicGzip(root / 'sitemaps' / 'pages.xml.gz') as sitemap:
+        sitemap.write(f'{XML_HEADER}<urlset xmlns="{SITEMAP_NS}">\n')
+        sitemap.write(url_entry(absolute('/')))
+        sitemap.write(url_entry(absolute('/catalog/')))
+        sitemap.write('</urlset>\n')
+
+
+def write_feed(root, chunks, built_at):
+    categories = ''.join(
+        f'<category id="{tag_id}">{escape(title)}</category>'
+        for tag_id, title in Tag.objects.order_by('id').values_list('id', 'tagtitle').iterator(chunk_size=2000)
+    )
+    head = (
+        f'{XML_HEADER}<yml_catalog date={quoteattr(w3c(built_at))}>\n<shop>'
+        f'<name>{escape(get_setting("SHOP_NAME"))}</name>'
+        f'<company>{escape(get_setting("COMPANY"))}</company>'
+        f'<url>{escape(absolute("/"))}</url>'
+        '<currencies><currency id="RUR" rate="1"/></currencies>'
+        f'<categories>{categories}</categories>\n<offers>\n'
+    )
+    level = get_setting('COMPRESS_LEVEL')
+    path = root / 'feeds' / 'products.yml.gz'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    with open(temp, 'wb') as feed:
+        feed.write(gzip.compress(head.encode(), level, mtime=0))
+        for chunk in sorted(chunks):
+            with open(root / PARTS_DIR / f'offers-{chunk}.gz', 'rb') as part:
+                shutil.copyfileobj(part, feed)
+        feed.write(gzip.compress(b'</offers>\n</shop>\n</yml_catalog>\n', level, mtime=0))
+    os.replace(temp, path)
+
+
+def write_index(root, entries):
+    body = ''.join(
+        f'<sitemap><loc>{escape(absolute("/sitemaps/" + name))}</loc><lastmod>{lastmod}</lastmod></sitemap>\n'
+        for name, lastmod in entries
+    )
+    data = f'{XML_HEADER}<sitemapindex xmlns="{SITEMAP_NS}">\n{body}</sitemapindex>\n'.encode()
+    write_atomic(root / 'sitemap.xml', data)
+    write_atomic(root / 'sitemap.xml.gz', gzip.compress(data, 9, mtime=0))
+
+
+def load_state(root):
+    try:
+        with open(root / STATE_FILE) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(full=False, root=None):
+    """
+    Пересобрать sitemap и фид. Без full переписываются только диапазоны
+    продуктов, изменившиеся с прошлой сборки. Возвращает (диапазонов, переписано).
+    """
+    root = Path(root or get_root())
+    chunk_size = min(get_setting('CHUNK_SIZE'), 50000)
+    state = load_state(root)
+    if full or state.get('chunk_size') != chunk_size:
+        state = {}
+    previous = {int(chunk): tuple(value) for chunk, value in state.get('chunks', {}).items()}
+    current = chunk_stats(chunk_size)
+    built_at = timezone.now()
+
+    dirty = [
+        chunk for chunk, value in current.items()
+        if previous.get(chunk) != value or not (root / PARTS_DIR / f'offers-{chunk}.gz').exists()
+    ]
+    for chunk in sorted(dirty):
+        write_product_chunk(root, chunk, chunk_size)
+    for chunk in previous.keys() - current.keys():
+        (root / 'sitemaps' / f'products-{chunk}.xml.gz').unlink(missing_ok=True)
+        (root / PARTS_DIR / f'offers-{chunk}.gz').unlink(missing_ok=True)
+
+    write_pages_sitemap(root)
+    tag_files = write_tag_sitemaps(root, chunk_size)
+    for stale in (root / 'sitemaps').glob('tags-*.xml.gz'):
+        if stale.name not in tag_files:
+            stale.unlink()
+    write_feed(root, current, built_at)
+
+    generated = w3c(built_at)
+    write_index(root, [
+        ('pages.xml.gz', generated),
+        *((name, generated) for name in tag_files),
+        *(
+            (f'products-{chunk}.xml.gz', w3c(datetime.fromisoformat(current[chunk][1])))
+            for chunk in sorted(current)
+        ),
+    ])
+    # Состояние пишется последним: по его mtime FeedFilesMiddleware видит новую сборку
+    state = {
+        'chunk_size': chunk_size,
+        'built_at': built_at.isoformat(),
+        'chunks': {str(chunk): list(value) for chunk, value in current.items()},
+    }
+    write_atomic(root / STATE_FILE, json.dumps(state).encode())
+    return len(current), len(dirty)
+
+
+class FeedFilesMiddleware(StaticFilesMiddleware):
+    """
+    Раздает sitemap и фид из ROOT как статику (с .gz-вариантом индекса).
+    Список файлов перечитывается, когда меняется .state.json после сборки.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.root = get_root()
+        self.version = None
+        self.files = {}
+
+    def refresh(self):
+        try:
+            version = os.stat(self.root / STATE_FILE).st_mtime_ns
+        except OSError:
+            version = None
+        if version != self.version:
+            self.files = self.scan(str(self.root)) if version else {}
+            self.version = version
+
+    def __call__(self, request):
+        if not request.path_info.startswith(URL_PREFIXES):
+            return self.get_response(request)
+        self.refresh()
+        static_file = self.files.get(request.path_info[1:])
+        if static_file is None:
+            return self.get_response(request)
+        if request.method not in ('GET', 'HEAD'):
+            response = HttpResponse(status=405)
+            response['Allow'] = 'GET, HEAD'
+            return response
+        return self.serve(request, static_file)
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from . import passwords
 from .models import Client, Seller, Product, Tag
 
 
@@ -87,7 +88,7 @@ class ClientRegistrationForm(forms.ModelForm):
         client = super().save(commit=False)
         password = self.cleaned_data.get('password')
         if password:
-            client.set_password(password)  # Пароль автоматически хешируется
+            client.password = passwords.hash_password(password)
         if commit:
             client.save()
         return client
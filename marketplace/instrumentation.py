@@ -0,0 +1,179 @@
+"""
+Инструментирование запросов: количество и время SQL, время рендера шаблонов,
+общее время ответа и поиск вероятных N+1 (повторяющихся форм запросов).
+
+Данные собираются только для выборки запросов (settings.PERF_INSTRUMENTATION
+['SAMPLE_RATE']), поэтому middleware можно держать включенным в production.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template import base as template_base
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'SERVER_TIMING': True,
+}
+
+_current_profile = ContextVar('marketplace_request_profile', default=None)
+
+# Литералы в SQL заменяются на "?", списки IN (...) схлопываются,
+# чтобы запросы, отличающиеся только параметрами, имели одну форму
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*(?:\?|%s)\s*,?)+\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def get_setting(name):
+    return getattr(settings, 'PERF_INSTRUMENTATION', {}).get(name, DEFAULTS[name])
+
+
+def normalize_sql(sql):
+    """Привести SQL к "форме" без конкретных значений параметров"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class RequestProfile:
+    """Метрики одного запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.shapes = Counter()
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def repeated_shapes(self, threshold):
+        """Формы запросов, выполненные не менее threshold раз - вероятные N+1"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+class QueryRecorder:
+    """Обертка для connection.execute_wrapper, считающая запросы текущего профиля"""
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.profile.sql_time += time.perf_counter() - started
+            self.profile.query_count += 1
+            self.profile.shapes[normalize_sql(sql)] += 1
+
+
+def activate(profile):
+    return _current_profile.set(profile)
+
+
+def deactivate(token):
+    _current_profile.reset(token)
+
+
+_original_template_render = template_base.Template.render
+_template_patch_lock = threading.Lock()
+
+
+def _timed_template_render(self, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return _original_template_render(self, context)
+    # Учитываем только шаблоны верхнего уровня: include/extends входят в их время
+    profile.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        profile.template_depth -= 1
+        if profile.template_depth == 0:
+            profile.template_time += time.perf_counter() - started
+
+
+def install_template_timing():
+    """Подменить Template.render на версию с замером времени (один раз на процесс)"""
+    with _template_patch_lock:
+        if template_base.Template.render is not _timed_template_render:
+            template_base.Template.render = _timed_template_render
+
+
+class UrlStats:
+    """Накопленная статистика по одному имени URL"""
+
+    __slots__ = ('requests', 'total_time', 'sql_time', 'template_time',
+                 'queries', 'max_queries', 'n_plus_one')
+
+    def __init__(self):
+        self.requests = 0
+        self.total_time = 0.0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.n_plus_one = 0
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'avg_ms': round(self.total_time * 1000 / requests, 2),
+            'avg_sql_ms': round(self.sql_time * 1000 / requests, 2),
+            'avg_template_ms': round(self.template_time * 1000 / requests, 2),
+            'avg_queries': round(self.queries / requests, 2),
+            'max_queries': self.max_queries,
+            'n_plus_one_requests': self.n_plus_one,
+        }
+
+
+_url_stats = {}
+_url_stats_lock = threading.Lock()
+
+
+def record(url_name, profile, total_time, suspected):
+    with _url_stats_lock:
+        stats = _url_stats.get(url_name)
+        if stats is None:
+            stats = _url_stats[url_name] = UrlStats()
+        stats.requests += 1
+        stats.total_time += total_time
+        stats.sql_time += profile.sql_time
+        stats.template_time += profile.template_time
+        stats.queries += profile.query_count
+        stats.max_queries = max(stats.max_queries, profile.query_count)
+        if suspected:
+            stats.n_plus_one += 1
+
+
+def get_url_stats():
+    """Агрегаты по именам URL текущего процесса (только для выборки запросов)"""
+    with _url_stats_lock:
+        return {name: stats.as_dict() for name, stats in sorted(_url_stats.items())}
+
+
+def reset_url_stats():
+    with _url_stats_lock:
+        _url_stats.clear()
+
+
+def server_timing_header(profile, total_time):
+    return (
+        f'db;dur={profile.sql_time * 1000:.1f};desc="{profile.query_count} queries", '
+        f'tpl;dur={profile.template_time * 1000:.1f}, '
+        f'total;dur={total_time * 1000:.1f}'
+    )
@@ -0,0 +1,196 @@
+"""
+Живые обновления остатков и цен (Server-Sent Events).
+
+В каждом процессе-воркере живёт один ProductHub: подписчики (SSE-соединения)
+регистрируются на набор id продуктов, а изменения Product раздаются им
+без опроса базы. Для нескольких процессов (gunicorn/uvicorn workers)
+используется бэкенд широковещательной рассылки, настраиваемый через
+settings.LIVE_UPDATES['BACKEND'].
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'marketplace.live.LocalBroadcast',
+    'OPTIONS': {},
+    'HEARTBEAT': 15,
+    'MAX_PRODUCTS': 100,
+    'RETRY_MS': 5000,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'LIVE_UPDATES', {}).get(name, DEFAULTS[name])
+
+
+class Subscription:
+    """
+    Подписка одного SSE-соединения.
+
+    Хранит только последнее событие по каждому продукту: если клиент
+    не успевает читать, промежуточные значения остатка схлопываются.
+    """
+
+    def __init__(self, product_ids, loop):
+        self.product_ids = frozenset(product_ids)
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, event):
+        # Вызывается только в цикле событий подписчика
+        self.pending[event['id']] = event
+        self.ready.set()
+
+    def drain(self):
+        events = list(self.pending.values())
+        self.pending.clear()
+        self.ready.clear()
+        return events
+
+
+class ProductHub:
+    """Внутрипроцессный fan-out событий продуктов по подписчикам"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, product_ids):
+        subscription = Subscription(product_ids, asyncio.get_running_loop())
+        with self._lock:
+            for product_id in subscription.product_ids:
+                self._subscribers[product_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for product_id in subscription.product_ids:
+                subscribers = self._subscribers.get(product_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[product_id]
+
+    def narrow(self, subscription, product_ids):
+        """Оставить подписке только product_ids: события остальных продуктов до нее не доходят"""
+        removed = subscription.product_ids - frozenset(product_ids)
+        if not removed:
+            return
+        subscription.product_ids = subscription.product_ids - removed
+        with self._lock:
+            for product_id in removed:
+                subscribers = self._subscribers.get(product_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[product_id]
+        for product_id in removed:
+            subscription.pending.pop(product_id, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    def dispatch(self, event):
+        """
+        Доставить событие локальным подписчикам.
+        Потокобезопасно: может вызываться из синхронного кода ORM.
+        """
+        with self._lock:
+            subscribers = tuple(self._subscribers.get(event['id'], ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт - соединение умерло
+                self.unsubscribe(subscription)
+
+
+hub = ProductHub()
+
+
+class LocalBroadcast:
+    """Рассылка только внутри текущего процесса (по умолчанию, для одного воркера)"""
+
+    def __init__(self, hub, **options):
+        self.hub = hub
+
+    def publish(self, event):
+        self.hub.dispatch(event)
+
+
+class RedisBroadcast:
+    """
+    Межпроцессная рассылка через Redis pub/sub.
+
+    Требует пакет redis. Каждый процесс публикует события в канал
+    и слушает его в фоновом потоке, передавая полученное в свой hub.
+    """
+
+    def __init__(self, hub, url='redis://localhost:6379/0', channel='marketplace:live'):
+        try:
+            import redis
+        except ImportError as exc:
+            raise ImproperlyConfigured('Для RedisBroadcast установите пакет redis') from exc
+        self.hub = hub
+        self.channel = channel
+        self.client = redis.Redis.from_url(url)
+        self._listener = threading.Thread(target=self._listen, name='live-updates-redis', daemon=True)
+        self._listener.start()
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            try:
+                self.hub.dispatch(json.loads(message['data']))
+            except (ValueError, KeyError, TypeError):
+                logger.warning('Некорректное сообщение live-обновлений: %r', message)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(get_setting('BACKEND'))
+                _backend = backend_class(hub, **get_setting('OPTIONS'))
+    return _backend
+
+
+def publish_product_change(product_id, changes):
+    """
+    Опубликовать изменение продукта.
+    changes - словарь только с изменившимися полями (stock и/или price).
+    """
+    event = {'id': product_id}
+    event.update(changes)
+    try:
+        get_backend().publish(event)
+    except Exception:
+        # Живые обновления не должны ломать запись продукта
+        logger.exception('Не удалось опубликовать изменение продукта %s', product_id)
+
+
+def format_event(event):
+    """Сериализовать событие в формат text/event-stream"""
+    return f"event: product\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
@@ -0,0 +1,81 @@
+import asyncio
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
+
+from . import live
+from .models import Product
+
+
+def parse_product_ids(raw, limit):
+    """Разобрать строку вида "1,2,3" в список уникальных положительных id"""
+    product_ids = []
+    for part in raw.split(','):
+        try:
+            product_id = int(part)
+        except (ValueError, TypeError):
+            continue
+        if product_id > 0 and product_id not in product_ids:
+            product_ids.append(product_id)
+    return product_ids[:limit]
+
+
+async def snapshot_events(product_ids):
+    """Текущие остатки и цены - первое, что получает подписчик"""
+    queryset = Product.objects.filter(id__in=product_ids, checked=True).values('id', 'stock', 'price')
+    return [
+        {'id': row['id'], 'stock': row['stock'], 'price': str(row['price'])}
+        async for row in queryset
+    ]
+
+
+async def stream_product_events(product_ids, subscribe):
+    yield f"retry: {live.get_setting('RETRY_MS')}\n\n"
+    # Подписываемся до чтения снимка, чтобы не потерять изменения между ними
+    subscription = live.hub.subscribe(product_ids) if subscribe else None
+    try:
+        snapshot = await snapshot_events(product_ids)
+        if subscription is not None:
+            # Непроверенные продукты не видны на витрине - их изменения не отдаются
+            live.hub.narrow(subscription, [event['id'] for event in snapshot])
+        for event in snapshot:
+            yield live.format_event(event)
+        if subscription is None or not subscription.product_ids:
+            return
+        heartbeat = live.get_setting('HEARTBEAT')
+        while True:
+            try:
+                await asyncio.wait_for(subscription.ready.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # Комментарий-пинг держит соединение открытым через прокси
+                yield ': ping\n\n'
+                continue
+            for event in subscription.drain():
+                yield live.format_event(event)
+    finally:
+        if subscription is not None:
+            live.hub.unsubscribe(subscription)
+
+
+@require_http_methods(["GET"])
+async def product_stream(request):
+    """
+    SSE-поток изменений остатков и цен.
+    GET /api/products/stream/?ids=1,2,3
+
+    Под ASGI соединение держится открытым и получает события из hub.
+    Под WSGI отдается только текущий снимок, после чего EventSource
+    переподключается через retry мс (деградация до опроса).
+    """
+    product_ids = parse_product_ids(request.GET.get('ids', ''), live.get_setting('MAX_PRODUCTS'))
+    if not product_ids:
+        return HttpResponseBadRequest('Не указаны id продуктов')
+
+    response = StreamingHttpResponse(
+        stream_product_events(product_ids, subscribe=isinstance(request, ASGIRequest)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
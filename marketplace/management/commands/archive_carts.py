@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from marketplace import cart_archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Перенести строки корзин, не менявшиеся заданное число дней, в архив '
+        '(ArchivedCartItem) или удалить их, пополнив агрегаты брошенных корзин. '
+        'Таблица обрабатывается диапазонами id с паузами между ними.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Возраст последнего изменения строки в днях')
+        parser.add_argument('--delete', action='store_true', help='Удалить без переноса в архив (агрегаты сохраняются)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Ширина диапазона id')
+        parser.add_argument('--pause', type=float, default=None, help='Пауза между диапазонами, секунд')
+
+    def handle(self, *args, **options):
+        def report(progress):
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'  id до {progress.position - 1}: перенесено {progress.moved}, '
+                    f'{progress.rate:.0f} строк/с'
+                )
+
+        progress = cart_archive.archive_stale_carts(
+            days=options['days'],
+            archive=not options['delete'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            on_chunk=report,
+        )
+        action = 'Удалено' if options['delete'] else 'Перенесено в архив'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} строк: {progress.moved} из диапазона {progress.scanned} id '
+            f'за {progress.seconds:.1f} с ({progress.rate:.0f} строк/с, '
+            f'{progress.scanned / progress.seconds if progress.seconds else 0:.0f} id/с)'
+        ))
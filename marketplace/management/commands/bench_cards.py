@@ -0,0 +1,93 @@
+import time
+from itertools import cycle, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+
+from marketplace import cards
+from marketplace.models import Product
+
+# Карточка каталога в прежнем виде: цикл шаблона по экземплярам модели с {% url %}
+LEGACY_TEMPLATE = '''
+{% for product in products %}
+  <article class="flex h-full flex-col justify-between rounded-lg bg-neutral-900 p-4 shadow-md hover:bg-neutral-800 transition">
+    <div class="space-y-3">
+      <div class="flex items-center justify-center mb-1 overflow-hidden rounded-lg">
+        {% if product.product_photos.all %}
+          <img src="{{ product.product_photos.all.0.photo.url }}" alt="{{ product.title }}" class="w-full h-48 object-cover bg-neutral-800 rounded-lg shadow-inner"/>
+        {% elif product.thumbnail %}
+          <img src="{{ product.thumbnail.url }}" alt="{{ product.title }}" class="w-full h-48 object-cover bg-neutral-800 rounded-lg shadow-inner"/>
+        {% else %}
+          <div class="w-full h-48 flex items-center justify-center bg-neutral-800 rounded-lg text-white/50 text-xs">Нет фото</div>
+        {% endif %}
+      </div>
+      <div class="space-y-1">
+        {% if product.tags.all %}
+          <p class="text-xs uppercase tracking-wide text-white/50">
+            {% for tag in product.tags.all|slice:":2" %}{{ tag.tagtitle }}{% if not forloop.last %}, {% endif %}{% endfor %}
+          </p>
+        {% endif %}
+        <h3 class="text-lg font-semibold leading-snug">
+          <a href="{% url 'product_detail' product.id %}" class="hover:text-white">{{ product.title }}</a>
+        </h3>
+        <p class="text-sm text-white/60 line-clamp-2">{{ product.description }}</p>
+      </div>
+    </div>
+    <div class="mt-3 space-y-2">
+      <div class="flex items-center justify-between">
+        <div class="text-lg font-semibold text-white">{{ product.price }} ₽</div>
+        {% if product.stock > 0 %}
+          <span class="text-xs text-green-400">В наличии: {{ product.stock }} шт.</span>
+        {% else %}
+          <span class="text-xs text-red-400">Нет в наличии</span>
+        {% endif %}
+      </div>
+      <a href="{% url 'product_detail' product.id %}" class="inline-block w-full text-center rounded-lg bg-blue-700 px-4 py-2 text-sm font-semibold text-white shadow hover:bg-blue-800 focus:outline-none focus:ring-2 focus:ring-blue-400 transition">Подробнее</a>
+    </div>
+  </article>
+{% endfor %}
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнить скорость рендера карточек каталога: прежний цикл шаблона по экземплярам '
+        'модели против плоских карточек marketplace.cards. Печатает карточек в секунду.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=100, help='Карточек на одну страницу')
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        count, iterations = options['cards'], options['iterations']
+        loaded = list(
+            Product.objects.filter(checked=True).prefetch_related('tags', 'product_photos')[:count]
+        )
+        if not loaded:
+            raise CommandError('Нет проверенных продуктов - сначала выполните seed_marketplace')
+        # Продуктов меньше, чем нужно карточек, - повторяем (prefetch уже в памяти)
+        products = list(islice(cycle(loaded), count))
+
+        legacy = engines['django'].from_string(LEGACY_TEMPLATE)
+        compiled = engines['django'].from_string('{% load product_cards %}{% product_cards cards "catalog" %}')
+        card_list = cards.product_cards(products)
+
+        self.report('шаблон по моделям', count, iterations, lambda: legacy.render({'products': products}))
+        self.report('сборка карточек', count, iterations, lambda: cards.product_cards(products))
+        self.report('рендер карточек', count, iterations, lambda: compiled.render({'cards': card_list}))
+        self.report(
+            'сборка + рендер', count, iterations,
+            lambda: compiled.render({'cards': cards.product_cards(products)}),
+        )
+
+    def report(self, name, count, iterations, render):
+        render()  # прогрев: разбор шаблона, кеш reverse()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            render()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{name:<20} {count * iterations / elapsed:>12,.0f} карточек/с   '
+            f'{elapsed / iterations * 1000:>8.2f} мс на {count} карточек'
+        )
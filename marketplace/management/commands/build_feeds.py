@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from marketplace import feeds
+
+
+class Command(BaseCommand):
+    help = (
+        'Собрать sitemap.xml, файлы sitemap и товарный фид (YML) в FEEDS["ROOT"]. '
+        'Без --full переписываются только диапазоны продуктов, изменившиеся с прошлой '
+        'сборки; после изменений каталога пересборка ставится в очередь автоматически.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Переписать все файлы')
+
+    def handle(self, *args, **options):
+        chunks, rewritten = feeds.build(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{feeds.get_root()}: диапазонов продуктов {chunks}, переписано {rewritten}'
+        ))
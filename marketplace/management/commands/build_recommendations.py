@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from marketplace import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновить рекомендации "с этим товаром также добавляют": добавить к матрице '
+        'совместных добавлений новые строки корзин и пересчитать списки затронутых '
+        'продуктов. После добавлений в корзину пересборка ставится в очередь автоматически.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Построить матрицу заново по всем корзинам')
+
+    def handle(self, *args, **options):
+        events, products = recommendations.build(full=options['full'])
+        backend = recommendations.Matrix.__name__
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк корзин: {events}, обновлено продуктов: {products} ({backend})'
+        ))
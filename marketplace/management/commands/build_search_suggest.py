@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from marketplace import suggest
+
+
+class Command(BaseCommand):
+    help = (
+        'Собрать снимок индекса подсказок поиска (marketplace.suggest). Запускайте после '
+        'деплоя и периодически с --full: при изменениях каталога индекс пересобирается '
+        'инкрементально фоновой задачей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Перечитать все продукты и пересчитать популярность')
+
+    def handle(self, *args, **options):
+        entries, keys, heavy = suggest.build(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{suggest.get_path()}: записей {entries}, ключей {keys}, тяжелых префиксов {heavy}'
+        ))
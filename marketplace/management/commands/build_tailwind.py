@@ -0,0 +1,42 @@
+import shlex
+import shutil
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Собрать Tailwind CSS заранее вместо CDN: в результат попадают только классы, '
+        'используемые в шаблонах и Python-коде (TAILWIND["CONTENT"]). Нужен Tailwind CLI v3 - '
+        'standalone-бинарь tailwindcss или "npx tailwindcss@3" (TAILWIND_CLI). '
+        'Запускайте перед collectstatic.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cli', default=settings.TAILWIND['CLI'], help='Команда Tailwind CLI')
+        parser.add_argument('--no-minify', action='store_true')
+
+    def handle(self, *args, **options):
+        cli = shlex.split(options['cli'])
+        if not cli or shutil.which(cli[0]) is None:
+            raise CommandError(
+                f'Tailwind CLI не найден: {options["cli"]}. Скачайте standalone-бинарь '
+                'https://github.com/tailwindlabs/tailwindcss/releases (v3) или укажите TAILWIND_CLI="npx tailwindcss@3"'
+            )
+        output = Path(settings.STATICFILES_DIRS[0]) / settings.TAILWIND['OUTPUT']
+        output.parent.mkdir(parents=True, exist_ok=True)
+        command = cli + [
+            '--input', str(settings.TAILWIND['INPUT']),
+            '--output', str(output),
+            '--content', ','.join(str(pattern) for pattern in settings.TAILWIND['CONTENT']),
+        ]
+        if not options['no_minify']:
+            command.append('--minify')
+        try:
+            subprocess.run(command, check=True)
+        except subprocess.CalledProcessError as error:
+            raise CommandError(f'Tailwind CLI завершился с кодом {error.returncode}')
+        self.stdout.write(self.style.SUCCESS(f'{output}: {output.stat().st_size / 1024:.1f} КБ'))
@@ -0,0 +1,124 @@
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from marketplace.models import Product
+
+# Профиль "до": настройки SQLite по умолчанию (журнал отката, полная синхронизация)
+BASELINE_PRAGMAS = ['PRAGMA journal_mode=DELETE', 'PRAGMA synchronous=FULL']
+BASELINE_TIMEOUT = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Смешанная нагрузка чтение/запись на копии SQLite-базы: профиль по умолчанию '
+        '(journal_mode=DELETE, synchronous=FULL) против настроек из DATABASES["default"]["OPTIONS"]. '
+        'Читатели выполняют запрос каталога, писатели обновляют остатки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=10, help='Длительность каждого прогона, с')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Бенчмарк сравнивает режимы SQLite; для PostgreSQL используйте loadtest')
+        if connection.is_in_memory_db():
+            raise CommandError('Нужна файловая база SQLite')
+
+        settings_options = connection.settings_dict['OPTIONS']
+        tuned_pragmas = [
+            statement.strip()
+            for statement in settings_options.get('init_command', '').split(';')
+            if statement.strip()
+        ]
+        profiles = [
+            ('до (по умолчанию)', BASELINE_PRAGMAS, BASELINE_TIMEOUT),
+            ('после (settings)', tuned_pragmas, settings_options.get('timeout', BASELINE_TIMEOUT)),
+        ]
+
+        product_table = Product._meta.db_table
+        ids = list(Product.objects.using(options['database']).values_list('id', flat=True)[:10000])
+        if not ids:
+            raise CommandError('В БД нет продуктов - сначала выполните seed_marketplace')
+
+        with tempfile.TemporaryDirectory() as directory:
+            for index, (name, pragmas, timeout) in enumerate(profiles):
+                # Каждый профиль - на свежей копии, чтобы прогоны не влияли друг на друга;
+                # backup API учитывает еще не перенесенные из WAL страницы
+                path = Path(directory) / f'profile-{index}.sqlite3'
+                with closing(sqlite3.connect(connection.settings_dict['NAME'])) as source, \
+                        closing(sqlite3.connect(path)) as target:
+                    source.backup(target)
+                result = self.run_profile(path, pragmas, timeout, product_table, ids, options)
+                self.report(name, result, options['duration'])
+
+    def run_profile(self, path, pragmas, timeout, table, ids, options):
+        deadline = time.monotonic() + options['duration']
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+        read_sql = (
+            f'SELECT id, title, price, stock FROM {table} '
+            f'WHERE checked = 1 AND price >= ? ORDER BY created_at DESC LIMIT 20'
+        )
+        write_sql = f'UPDATE {table} SET stock = ? WHERE id = ?'
+
+        def connect():
+            db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+            for pragma in pragmas:
+                db.execute(pragma)
+            return db
+
+        def worker(kind, index):
+            rng = random.Random(None if options['seed'] is None else options['seed'] + index)
+            db = connect()
+            done = errors = 0
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        if kind == 'reads':
+                            db.execute(read_sql, [rng.randrange(0, 1000)]).fetchall()
+                        else:
+                            db.execute('BEGIN IMMEDIATE')
+                            db.execute(write_sql, [rng.randrange(0, 500), rng.choice(ids)])
+                            db.execute('COMMIT')
+                        done += 1
+                    except sqlite3.OperationalError:
+                        errors += 1
+                        if db.in_transaction:
+                            db.execute('ROLLBACK')
+            finally:
+                db.close()
+            with lock:
+                counts[kind] += done
+                counts['errors'] += errors
+
+        threads = [
+            threading.Thread(target=worker, args=('reads', index)) for index in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=('writes', options['readers'] + index))
+            for index in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts
+
+    def report(self, name, counts, duration):
+        self.stdout.write(
+            f'{name:<20} чтений/с: {counts["reads"] / duration:>9.1f}   '
+            f'записей/с: {counts["writes"] / duration:>8.1f}   '
+            f'ошибок блокировки: {counts["errors"]}'
+        )
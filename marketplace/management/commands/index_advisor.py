@@ -0,0 +1,110 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from marketplace import moderation, seller_stats
+from marketplace.models import Product
+
+# Формы запросов горячих представлений и индексы, которые их обслуживают.
+# При изменении фильтров/сортировок в views.py и seller_views.py обновляйте этот список.
+QUERY_SHAPES = [
+    # (имя, построитель queryset(seller_id), предлагаемый индекс)
+    ('index / catalog newest',
+     lambda seller_id: Product.objects.filter(checked=True).order_by('-created_at')[:20],
+     "models.Index(fields=['-created_at'], name='product_checked_recent_idx', condition=Q(checked=True))"),
+    ('catalog price_asc',
+     lambda seller_id: Product.objects.filter(checked=True).order_by('price')[:20],
+     "models.Index(fields=['price', 'id'], name='product_checked_price_idx', condition=Q(checked=True))"),
+    ('catalog price_desc',
+     lambda seller_id: Product.objects.filter(checked=True).order_by('-price')[:20],
+     "models.Index(fields=['price', 'id'], name='product_checked_price_idx', condition=Q(checked=True))"),
+    ('catalog name',
+     lambda seller_id: Product.objects.filter(checked=True).order_by('title')[:20],
+     "models.Index(fields=['title', 'id'], name='product_checked_title_idx', condition=Q(checked=True))"),
+    ('catalog in_stock',
+     lambda seller_id: Product.objects.filter(checked=True, stock__gt=0).order_by('-created_at')[:20],
+     "models.Index(fields=['-created_at'], name='product_checked_recent_idx', condition=Q(checked=True))"),
+    ('seller_products all',
+     lambda seller_id: Product.objects.filter(seller_id=seller_id).order_by('-created_at')[:20],
+     "models.Index(fields=['seller', '-created_at'], name='product_seller_recent_idx')"),
+    ('seller_products checked',
+     lambda seller_id: Product.objects.filter(seller_id=seller_id, checked=True).order_by('-created_at')[:20],
+     "models.Index(fields=['seller', '-created_at'], name='product_seller_recent_idx')"),
+    ('seller_dashboard low_stock',
+     lambda seller_id: Product.objects.filter(
+         seller_id=seller_id, stock__gt=0, stock__lte=seller_stats.LOW_STOCK_THRESHOLD,
+     ).order_by('stock')[:5],
+     "models.Index(fields=['seller', 'stock', '-updated_at'], name='product_seller_stock_idx')"),
+    ('seller_dashboard out_of_stock',
+     lambda seller_id: Product.objects.filter(seller_id=seller_id, stock=0).order_by('-updated_at')[:5],
+     "models.Index(fields=['seller', 'stock', '-updated_at'], name='product_seller_stock_idx')"),
+    ('moderation queue',
+     lambda seller_id: moderation.queue_queryset()[:50],
+     "models.Index(fields=['checked', 'created_at'], name='product_moderation_queue_idx')"),
+]
+
+# Признаки проблем в планах: (СУБД, регулярное выражение, описание)
+PLAN_ISSUES = [
+    ('sqlite', re.compile(r'\bSCAN (\w+)(?! USING)(?:\s|$)'), 'полный просмотр таблицы'),
+    ('sqlite', re.compile(r'USE TEMP B-TREE FOR ORDER BY'), 'сортировка во временном B-дереве'),
+    ('postgresql', re.compile(r'Seq Scan on (\w+)'), 'полный просмотр таблицы'),
+    ('postgresql', re.compile(r'^\s*(?:->\s+)?Sort\b', re.MULTILINE), 'сортировка'),
+]
+INDEX_RE = re.compile(r'(?:USING (?:COVERING )?INDEX|Index (?:Only )?Scan(?: Backward)? using) (\w+)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогнать EXPLAIN для форм запросов каталога, панели продавца и очереди модерации '
+        'и показать полные просмотры и сортировки вместе с индексами, которые их устраняют. '
+        'Запускайте на заполненной БД (seed_marketplace): на пустых таблицах планировщик '
+        'выбирает полный просмотр. Предложенные индексы добавляются в Product.Meta.indexes, '
+        'затем makemigrations.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--verbose-plans', action='store_true', help='Печатать планы целиком')
+        parser.add_argument('--fail-on-issues', action='store_true',
+                            help='Код возврата 1, если остались проблемные планы (для CI)')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        vendor = connections[using].vendor
+        if vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Разбор планов для {vendor} не поддерживается')
+
+        seller_id = (
+            Product.objects.using(using).values('seller_id').order_by('seller_id').first() or {}
+        ).get('seller_id')
+        if seller_id is None:
+            raise CommandError('В БД нет продуктов - сначала выполните seed_marketplace')
+
+        suggestions = {}
+        for name, build, index in QUERY_SHAPES:
+            plan = build(seller_id).using(using).explain()
+            issues = [
+                description
+                for issue_vendor, pattern, description in PLAN_ISSUES
+                if issue_vendor == vendor and pattern.search(plan)
+            ]
+            used = sorted(set(INDEX_RE.findall(plan)))
+            status = self.style.ERROR('ПРОБЛЕМА') if issues else self.style.SUCCESS('OK')
+            self.stdout.write(f'{status:<10} {name:<32} индексы: {", ".join(used) or "-"}')
+            for issue in issues:
+                self.stdout.write(f'           - {issue}')
+            if options['verbose_plans']:
+                self.stdout.write('\n'.join(f'           | {line}' for line in plan.splitlines()))
+            if issues:
+                suggestions.setdefault(index, []).append(name)
+
+        if not suggestions:
+            self.stdout.write(self.style.SUCCESS('Все формы запросов обслуживаются индексами'))
+            return
+
+        self.stdout.write('\nДобавьте в Product.Meta.indexes и выполните makemigrations:')
+        for index, names in suggestions.items():
+            self.stdout.write(f'    {index},  # {", ".join(names)}')
+        if options['fail_on_issues']:
+            raise CommandError(f'Проблемных форм запросов: {sum(len(n) for n in suggestions.values())}')
@@ -0,0 +1,212 @@
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from http.cookiejar import CookieJar
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace.models import Client, Product, Seller, Tag
+
+from .seed_marketplace import SEED_PASSWORD, WORDS
+
+SCENARIOS = ('browse', 'search', 'cart', 'seller_bulk_edit')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class VirtualUser:
+    """Один виртуальный пользователь со своей сессией (cookies)"""
+
+    def __init__(self, command, rng):
+        self.command = command
+        self.rng = rng
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, name, path, data=None):
+        url = self.command.base_url + path
+        body = None
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.csrf_token())
+            body = urllib.parse.urlencode(data, doseq=True).encode()
+        started = time.perf_counter()
+        status = 0
+        try:
+            with self.opener.open(url, data=body, timeout=self.command.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+        except (urllib.error.URLError, OSError):
+            status = 0
+        self.command.record(name, time.perf_counter() - started, status)
+        return status
+
+    def login(self, kind, email):
+        path = f'/auth/{kind}/login/'
+        self.request(f'{kind}_login_page', path)
+        self.request(f'{kind}_login', path, {'email': email, 'password': SEED_PASSWORD})
+
+    # Сценарии
+
+    def browse(self):
+        data = self.command.data
+        self.request('index', '/')
+        self.request('catalog', '/catalog/?' + urllib.parse.urlencode({
+            'tags': self.rng.choice(data['tags']),
+            'sort': self.rng.choice(('newest', 'price_asc', 'price_desc', 'name')),
+        }))
+        for product_id in self.rng.sample(data['products'], k=min(3, len(data['products']))):
+            self.request('product_detail', f'/products/{product_id}/')
+
+    def search(self):
+        query = self.rng.choice(WORDS)
+        self.request('catalog_search', '/catalog/?' + urllib.parse.urlencode({'q': query}))
+        self.request('catalog_search_in_stock', '/catalog/?' + urllib.parse.urlencode({'q': query, 'in_stock': 'true'}))
+
+    def cart(self):
+        data = self.command.data
+        if not data['clients']:
+            return
+        self.login('client', self.rng.choice(data['clients']))
+        for product_id in self.rng.sample(data['products'], k=min(2, len(data['products']))):
+            self.request('product_detail', f'/products/{product_id}/')
+            self.request('add_to_cart', f'/cart/add/{product_id}/', {'quantity': 1})
+        self.request('cart', '/cart/')
+
+    def seller_bulk_edit(self):
+        data = self.command.data
+        if not data['sellers']:
+            return
+        seller_id, email = self.rng.choice(data['sellers'])
+        self.login('seller', email)
+        self.request('seller_dashboard', '/seller/dashboard/')
+        self.request('seller_products', '/seller/products/')
+        for product in self.command.seller_products(seller_id)[:5]:
+            self.request('seller_product_edit_form', f'/seller/products/{product["id"]}/edit/')
+            self.request('seller_product_edit', f'/seller/products/{product["id"]}/edit/', {
+                'title': product['title'],
+                'description': product['description'],
+                'price': product['price'],
+                'stock': self.rng.randrange(0, 200),
+            })
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест запущенного сервера: виртуальные пользователи выполняют сценарии '
+        'browse/search/cart/seller_bulk_edit, в конце печатаются p50/p95/p99 по каждому запросу. '
+        'Учетные данные берутся из данных seed_marketplace.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=10, help='Параллельных виртуальных пользователей')
+        parser.add_argument('--duration', type=float, default=30, help='Длительность теста, с')
+        parser.add_argument('--scenario', action='append', default=[],
+                            help='Сценарий и вес, например browse:5 (можно несколько раз)')
+        parser.add_argument('--think-time', type=float, default=0.0, help='Пауза между сценариями, с')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        scenarios, weights = self.parse_scenarios(options['scenario'])
+        self.data = self.load_data()
+        if not self.data['products']:
+            raise CommandError('В БД нет проверенных продуктов - сначала выполните seed_marketplace')
+
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self._seller_products = {}
+        deadline = time.monotonic() + options['duration']
+        seed = options['seed']
+
+        def run(index):
+            rng = random.Random(None if seed is None else seed + index)
+            while time.monotonic() < deadline:
+                user = VirtualUser(self, rng)
+                getattr(user, rng.choices(scenarios, weights=weights)[0])()
+                if options['think_time']:
+                    time.sleep(options['think_time'])
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(options['users'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.print_report(time.perf_counter() - started)
+
+    def parse_scenarios(self, raw):
+        if not raw:
+            return ['browse', 'search', 'cart', 'seller_bulk_edit'], [6, 3, 2, 1]
+        scenarios, weights = [], []
+        for item in raw:
+            name, _, weight = item.partition(':')
+            if name not in SCENARIOS:
+                raise CommandError(f'Неизвестный сценарий {name}; доступны: {", ".join(SCENARIOS)}')
+            scenarios.append(name)
+            weights.append(float(weight or 1))
+        return scenarios, weights
+
+    def load_data(self):
+        return {
+            'products': list(Product.objects.filter(checked=True, stock__gt=0).values_list('id', flat=True)[:5000]),
+            'tags': list(Tag.objects.values_list('id', flat=True)[:200]),
+            'clients': list(Client.objects.filter(email__endswith='@seed.local').values_list('email', flat=True)[:1000]),
+            'sellers': list(Seller.objects.filter(email__endswith='@seed.local').values_list('id', 'email')[:1000]),
+        }
+
+    def seller_products(self, seller_id):
+        with self.lock:
+            if seller_id not in self._seller_products:
+                self._seller_products[seller_id] = list(
+                    Product.objects.filter(seller_id=seller_id).values('id', 'title', 'description', 'price')[:5]
+                )
+            return self._seller_products[seller_id]
+
+    def record(self, name, elapsed, status):
+        with self.lock:
+            self.samples[name].append(elapsed)
+            if not 200 <= status < 400:
+                self.errors[name] += 1
+
+    def print_report(self, elapsed):
+        header = f'{"запрос":<28}{"кол-во":>8}{"ошибки":>8}{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}{"max, мс":>10}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        everything = []
+        for name in sorted(self.samples):
+            values = sorted(self.samples[name])
+            everything.extend(values)
+            self.stdout.write(self.format_row(name, values, self.errors[name]))
+        everything.sort()
+        self.stdout.write('-' * len(header))
+        self.stdout.write(self.format_row('ИТОГО', everything, sum(self.errors.values())))
+        self.stdout.write(f'\n{len(everything)} запросов за {elapsed:.1f} с: {len(everything) / elapsed:.1f} RPS')
+
+    @staticmethod
+    def format_row(name, values, errors):
+        return (
+            f'{name:<28}{len(values):>8}{errors:>8}'
+            f'{percentile(values, 0.50) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}'
+            f'{percentile(values, 0.99) * 1000:>10.1f}{(values[-1] if values else 0) * 1000:>10.1f}'
+        )
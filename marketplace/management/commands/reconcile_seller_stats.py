@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from marketplace import seller_stats
+from marketplace.models import Seller, SellerStats
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверить материализованные счетчики продавцов (SellerStats) с таблицей продуктов '
+        'и исправить расхождения. Продавцы обрабатываются пачками: один агрегирующий запрос '
+        'и один upsert на пачку.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seller', type=int, action='append', default=[], help='Только указанные продавцы')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        sellers = Seller.objects.order_by('id').values_list('id', flat=True)
+        if options['seller']:
+            sellers = sellers.filter(id__in=options['seller'])
+        chunk_size = options['chunk_size']
+        checked = drifted = 0
+        last_id = 0
+
+        while True:
+            # Пачки по диапазонам первичного ключа, без OFFSET
+            ids = list(sellers.filter(id__gt=last_id)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            with transaction.atomic():
+                actual = seller_stats.aggregate_counters(ids)
+                stored = {
+                    row['seller_id']: row
+                    for row in SellerStats.objects.filter(seller_id__in=ids).values('seller_id', *seller_stats.COUNTER_FIELDS)
+                }
+                broken = {}
+                for seller_id, values in actual.items():
+                    current = stored.get(seller_id)
+                    if current is None or any(current[field] != values[field] for field in seller_stats.COUNTER_FIELDS):
+                        broken[seller_id] = values
+                        if options['verbosity'] > 1:
+                            self.stdout.write(f'  продавец {seller_id}: {current} -> {values}')
+                if broken and not options['dry_run']:
+                    seller_stats.save_counters(broken)
+            checked += len(ids)
+            drifted += len(broken)
+
+        action = 'найдено' if options['dry_run'] else 'исправлено'
+        self.stdout.write(self.style.SUCCESS(f'Проверено продавцов: {checked}, {action} расхождений: {drifted}'))
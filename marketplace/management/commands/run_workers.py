@@ -0,0 +1,97 @@
+import multiprocessing
+import signal
+import time
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from marketplace import events, task_queue, webhooks
+
+# Как часто главный процесс удаляет старые выполненные задачи, с
+PURGE_INTERVAL = 600
+
+
+def worker_main(index, prefix, burst, batch, stop_event):
+    # При запуске через spawn/forkserver (macOS, Windows, Python 3.14) процесс
+    # начинается с чистого интерпретатора; DJANGO_SETTINGS_MODULE наследуется
+    if not apps.ready:
+        django.setup()
+    # Ctrl+C получает главный процесс и завершает воркеры через stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    try:
+        task_queue.run_worker(
+            worker_id=f'{prefix}-{index}', burst=burst, batch=batch, stop=stop_event.is_set,
+        )
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Запустить пул процессов-воркеров фоновых задач (marketplace/tasks.py). '
+        'Задачи берутся из таблицы Task: PostgreSQL - SKIP LOCKED, SQLite - опрос. '
+        'Текущая задача дорабатывается до конца при SIGTERM/Ctrl+C.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Число процессов-воркеров')
+        parser.add_argument('--batch', type=int, default=1, help='Задач за одно обращение к очереди')
+        parser.add_argument('--burst', action='store_true', help='Выйти, когда очередь опустеет')
+        parser.add_argument('--worker-id', default=None, help='Префикс идентификатора воркеров')
+
+    def handle(self, *args, **options):
+        prefix = options['worker_id'] or task_queue.default_worker_id()
+        names = ', '.join(sorted(task_queue.registered_tasks())) or '-'
+        self.stdout.write(f'Задачи: {names}')
+
+        if options['processes'] <= 1:
+            processed = task_queue.run_worker(worker_id=f'{prefix}-0', burst=options['burst'], batch=options['batch'])
+            self.stdout.write(f'Выполнено задач: {processed}')
+            return
+
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+        stop_event = multiprocessing.Event()
+
+        def spawn(index):
+            process = multiprocessing.Process(
+                target=worker_main,
+                args=(index, prefix, options['burst'], options['batch'], stop_event),
+                name=f'task-worker-{index}',
+            )
+            process.start()
+            return process
+
+        def shutdown(*args):
+            self.stdout.write('Останавливаем воркеры после текущих задач...')
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        workers = {index: spawn(index) for index in range(options['processes'])}
+        last_purge = 0.0
+        while any(process.is_alive() for process in workers.values()):
+            time.sleep(1)
+            if stop_event.is_set() or options['burst']:
+                continue
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    self.stderr.write(f'Воркер {index} завершился с кодом {process.exitcode}, перезапуск')
+                    workers[index] = spawn(index)
+            if time.monotonic() - last_purge > PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                deleted = task_queue.purge_finished()
+                delivered = webhooks.purge_delivered()
+                dispatched = events.purge()
+                connections.close_all()
+                if deleted:
+                    self.stdout.write(f'Удалено выполненных задач: {deleted}')
+                if delivered:
+                    self.stdout.write(f'Удалено доставленных событий вебхуков: {delivered}')
+                if dispatched:
+                    self.stdout.write(f'Удалено разосланных доменных событий: {dispatched}')
+        self.stdout.write('Воркеры остановлены')
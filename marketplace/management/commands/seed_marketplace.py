@@ -0,0 +1,238 @@
+import itertools
+import random
+import re
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from marketplace import seller_stats
+from marketplace.models import CartItem, Client, Product, ProductPhoto, Seller, Tag
+
+SEED_PASSWORD = 'seed-password-123'
+
+WORDS = (
+    'смартфон', 'чехол', 'кабель', 'наушники', 'лампа', 'кружка', 'рюкзак', 'куртка',
+    'кроссовки', 'часы', 'книга', 'игрушка', 'чайник', 'сковорода', 'ноутбук', 'мышь',
+    'клавиатура', 'монитор', 'стол', 'стул', 'подушка', 'плед', 'зонт', 'термос',
+)
+ADJECTIVES = (
+    'новый', 'компактный', 'мощный', 'легкий', 'прочный', 'яркий', 'теплый',
+    'беспроводной', 'классический', 'детский', 'профессиональный', 'умный',
+)
+
+
+def zipf_weights(count, exponent):
+    """Кумулятивные веса распределения Ципфа: первые элементы популярнее"""
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def next_index(queryset, field, pattern):
+    """
+    Номер, с которого продолжать нумерацию сгенерированных строк: повторный
+    запуск дописывает данные, а не падает на уникальных email и названиях.
+    Строки создаются по возрастанию номера, поэтому последняя по id - с наибольшим.
+    """
+    last = queryset.filter(**{f'{field}__regex': pattern}).order_by('-pk').values_list(field, flat=True).first()
+    return int(re.search(pattern, last).group(1)) + 1 if last else 0
+
+
+def chunked(total, size):
+    start = 0
+    while start < total:
+        yield start, min(size, total - start)
+        start += size
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполнить БД синтетическими данными: продавцы, теги, продукты с популярностью по Ципфу, '
+        'фотографии и корзины. Данные вставляются через bulk_create большими пачками; '
+        'повторный запуск добавляет новые строки после уже созданных.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=300)
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--clients', type=int, default=10_000)
+        parser.add_argument('--cart-lines', type=int, default=50_000, help='Строк корзины всего')
+        parser.add_argument('--tags-per-product', type=int, default=3)
+        parser.add_argument('--photos-per-product', type=int, default=1)
+        parser.add_argument('--checked-ratio', type=float, default=0.9, help='Доля прошедших модерацию')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Показатель распределения Ципфа')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора для воспроизводимости')
+        parser.add_argument('--images', type=int, default=0,
+                            help='Сгенерировать N картинок-заглушек (Pillow) и раздать их продуктам')
+
+    def handle(self, *args, **options):
+        if options['products'] and not options['sellers']:
+            raise CommandError('Для продуктов нужен хотя бы один продавец')
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.password_hash = make_password(SEED_PASSWORD)
+        started = time.perf_counter()
+
+        images = self.create_placeholder_images(options['images']) if options['images'] else []
+        seller_ids = self.create_sellers(options['sellers'])
+        tag_ids = self.create_tags(options['tags'])
+        product_ids = self.create_products(options, seller_ids, tag_ids, images)
+        client_ids = self.create_clients(options['clients'])
+        self.create_cart_items(options, client_ids, product_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с. '
+            f'Пароль всех продавцов и клиентов: {SEED_PASSWORD}'
+        ))
+
+    def report(self, label, count, started):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else count
+        self.stdout.write(f'{label}: {count} за {elapsed:.1f} с ({rate:.0f} строк/с)')
+
+    def create_placeholder_images(self, count):
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            raise CommandError('Для --images нужен Pillow')
+        directory = Path(settings.MEDIA_ROOT) / 'products' / 'thumbnails'
+        directory.mkdir(parents=True, exist_ok=True)
+        names = []
+        for index in range(count):
+            color = tuple(self.rng.randrange(40, 220) for _ in range(3))
+            image = Image.new('RGB', (480, 480), color)
+            ImageDraw.Draw(image).text((24, 24), f'seed #{index}', fill=(255, 255, 255))
+            name = f'products/thumbnails/seed-{index}.jpg'
+            image.save(Path(settings.MEDIA_ROOT) / name, 'JPEG', quality=70)
+            names.append(name)
+        return names
+
+    def create_sellers(self, count):
+        started = time.perf_counter()
+        first = next_index(Seller.objects, 'email', r'^seller(\d+)@seed\.local$')
+        ids = []
+        for offset, size in chunked(count, self.chunk_size):
+            offset += first
+            with transaction.atomic():
+                sellers = Seller.objects.bulk_create([
+                    Seller(
+                        email=f'seller{index}@seed.local',
+                        password=self.password_hash,
+                        company_name=f'Продавец {index}',
+                        contact_person=f'Контакт {index}',
+                        phone=f'+7900{index:07d}',
+                    )
+                    for index in range(offset, offset + size)
+                ])
+            ids.extend(seller.pk for seller in sellers)
+        self.report('Продавцы', count, started)
+        return ids
+
+    def create_tags(self, count):
+        started = time.perf_counter()
+        first = next_index(Tag.objects, 'tagtitle', r'^\w+-(\d+)$')
+        tags = Tag.objects.bulk_create(
+            [Tag(tagtitle=f'{self.rng.choice(WORDS)}-{index}') for index in range(first, first + count)],
+            batch_size=self.chunk_size,
+        )
+        self.report('Теги', count, started)
+        return [tag.pk for tag in tags]
+
+    def create_products(self, options, seller_ids, tag_ids, images):
+        started = time.perf_counter()
+        rng = self.rng
+        total = options['products']
+        seller_weights = zipf_weights(len(seller_ids), options['zipf'])
+        tag_weights = zipf_weights(len(tag_ids), options['zipf']) if tag_ids else None
+        tags_per_product = min(options['tags_per_product'], len(tag_ids))
+        Through = Product.tags.through
+        product_ids = []
+
+        for offset, size in chunked(total, self.chunk_size):
+            sellers = rng.choices(seller_ids, cum_weights=seller_weights, k=size)
+            products = [
+                Product(
+                    title=f'{rng.choice(ADJECTIVES).capitalize()} {rng.choice(WORDS)} {offset + index}',
+                    description=f'Синтетический товар №{offset + index}. ' + ' '.join(rng.choices(WORDS, k=12)),
+                    price=Decimal(rng.randrange(100, 500_000)) / 100,
+                    stock=0 if rng.random() < 0.1 else rng.randrange(1, 500),
+                    seller_id=seller_id,
+                    checked=rng.random() < options['checked_ratio'],
+                    thumbnail=rng.choice(images) if images else None,
+                )
+                for index, seller_id in enumerate(sellers)
+            ]
+            with transaction.atomic():
+                products = Product.objects.bulk_create(products)
+                links = []
+                for product in products:
+                    chosen = set()
+                    while len(chosen) < tags_per_product:
+                        chosen.add(rng.choices(tag_ids, cum_weights=tag_weights)[0])
+                    links.extend(Through(product_id=product.pk, tag_id=tag_id) for tag_id in chosen)
+                Through.objects.bulk_create(links)
+                if images and options['photos_per_product']:
+                    ProductPhoto.objects.bulk_create([
+                        ProductPhoto(product_id=product.pk, photo=rng.choice(images), order=order)
+                        for product in products
+                        for order in range(options['photos_per_product'])
+                    ])
+            product_ids.extend(product.pk for product in products)
+            self.stdout.write(f'  продукты: {offset + size}/{total}')
+        # bulk_create минует сигналы - счетчики продавцов пересчитываются пачками
+        for offset, size in chunked(len(seller_ids), self.chunk_size):
+            seller_stats.refresh(seller_ids[offset:offset + size])
+        self.report('Продукты', total, started)
+        return product_ids
+
+    def create_clients(self, count):
+        started = time.perf_counter()
+        first = next_index(Client.objects, 'email', r'^client(\d+)@seed\.local$')
+        ids = []
+        for offset, size in chunked(count, self.chunk_size):
+            offset += first
+            with transaction.atomic():
+                clients = Client.objects.bulk_create([
+                    Client(
+                        email=f'client{index}@seed.local',
+                        password=self.password_hash,
+                        first_name=f'Имя{index}',
+                        last_name=f'Фамилия{index}',
+                    )
+                    for index in range(offset, offset + size)
+                ])
+            ids.extend(client.pk for client in clients)
+        self.report('Клиенты', count, started)
+        return ids
+
+    def create_cart_items(self, options, client_ids, product_ids):
+        if not client_ids or not product_ids:
+            return
+        started = time.perf_counter()
+        rng = self.rng
+        total = options['cart_lines']
+        # Популярность товаров в корзинах тоже по Ципфу, но в случайном порядке id
+        popular = product_ids[:]
+        rng.shuffle(popular)
+        weights = zipf_weights(len(popular), options['zipf'])
+        seen = set()
+        created = 0
+        for _, size in chunked(total, self.chunk_size):
+            items = []
+            for client_id, product_id in zip(
+                rng.choices(client_ids, k=size),
+                rng.choices(popular, cum_weights=weights, k=size),
+            ):
+                if (client_id, product_id) in seen:
+                    continue
+                seen.add((client_id, product_id))
+                items.append(CartItem(client_id=client_id, product_id=product_id, quantity=rng.randrange(1, 4)))
+            with transaction.atomic():
+                CartItem.objects.bulk_create(items)
+            created += len(items)
+        self.report('Строки корзин', created, started)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from marketplace import page_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогреть кеш страниц витрины: главная, каталог и самые популярные страницы '
+        'по статистике HotPage. Запускайте после деплоя и сброса кеша; при изменениях '
+        'каталога прогрев ставится в очередь фоновых задач автоматически.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Сколько страниц прогреть (WARM_LIMIT)')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Одновременных рендеров (WARM_CONCURRENCY)')
+        parser.add_argument('--pause', type=float, default=None, help='Пауза после каждой страницы, с')
+        parser.add_argument('--list', action='store_true', help='Только показать популярные страницы')
+
+    def handle(self, *args, **options):
+        limit = page_cache.get_setting('WARM_LIMIT') if options['limit'] is None else options['limit']
+        if options['list']:
+            for _, url in page_cache.hot_pages(limit):
+                self.stdout.write(url)
+            return
+        warmed = page_cache.warm(limit, options['concurrency'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Прогрето страниц: {warmed}'))
@@ -0,0 +1,380 @@
+"""
+Метрики маркетплейса в формате Prometheus без внешних сервисов.
+
+Значения хранятся в mmap-файлах каталога settings.MARKETPLACE_METRICS['DIR'].
+Каждый процесс пишет в собственный файл (потоки процесса - под общей
+блокировкой), а /metrics суммирует файлы всех воркеров gunicorn.
+Живой процесс держит на своём файле flock; файл умершего процесса
+подхватывает следующий запущенный, продолжая его счётчики, поэтому
+число файлов не превышает пикового числа одновременно живых процессов.
+
+Gauge-метрики, которые дешевле посчитать в момент опроса (длина очереди
+модерации и т.п.), регистрируются через register_collector().
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: файлы не переиспользуются
+    fcntl = None
+
+from django.conf import settings
+
+_HEADER = struct.Struct('i')
+_KEY_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+_INITIAL_SIZE = 64 * 1024
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULTS = {
+    # Адреса, с которых /metrics доступен без токена; пусто - ни с каких
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+    # Токен для заголовка "Authorization: Bearer <TOKEN>"; None - доступ только по адресу
+    'TOKEN': None,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'MARKETPLACE_METRICS', {}).get(name, DEFAULTS[name])
+
+
+def get_metrics_dir():
+    default = Path(settings.BASE_DIR) / 'var' / 'metrics'
+    return Path(getattr(settings, 'MARKETPLACE_METRICS', {}).get('DIR', default))
+
+
+class MmapValueStore:
+    """
+    Файл значений одного процесса: заголовок с занятым размером,
+    затем записи [длина ключа][ключ, выровненный по 8 байт][float64].
+    Пишет только процесс-владелец, читают все процессы.
+    BlockingIOError - файлом владеет другой живой процесс.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._file.close()
+                raise
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        for key, _, position in iterate_entries(self._map, self._used):
+            self._positions[key] = position
+
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._capacity = capacity
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def _allocate(self, key):
+        encoded = key.encode('utf-8')
+        padded = len(encoded) + (-(_KEY_LENGTH.size + len(encoded)) % 8)
+        end = self._used + _KEY_LENGTH.size + padded + _VALUE.size
+        if end > self._capacity:
+            self._grow(end)
+        _KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _KEY_LENGTH.size:self._used + _KEY_LENGTH.size + len(encoded)] = encoded
+        position = self._used + _KEY_LENGTH.size + padded
+        _VALUE.pack_into(self._map, position, 0.0)
+        # Размер обновляется последним: читатели видят только целые записи
+        self._used = end
+        _HEADER.pack_into(self._map, 0, end)
+        self._positions[key] = position
+        return position
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._allocate(key)
+            _VALUE.pack_into(self._map, position, _VALUE.unpack_from(self._map, position)[0] + amount)
+
+    def close(self):
+        """Закрыть файл и снять flock - файл сможет подхватить другой процесс"""
+        self._map.close()
+        self._file.close()
+
+
+def iterate_entries(buffer, used):
+    offset = _HEADER.size
+    while offset < used:
+        length = _KEY_LENGTH.unpack_from(buffer, offset)[0]
+        key_start = offset + _KEY_LENGTH.size
+        key = bytes(buffer[key_start:key_start + length]).decode('utf-8')
+        position = key_start + length + (-(_KEY_LENGTH.size + length) % 8)
+        yield key, _VALUE.unpack_from(buffer, position)[0], position
+        offset = position + _VALUE.size
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _open_store():
+    directory = get_metrics_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    if fcntl is not None:
+        for path in sorted(directory.glob('*.db')):
+            try:
+                return MmapValueStore(path)
+            except OSError:
+                continue
+    # pid в имени мог достаться от умершего процесса, чей файл уже подхвачен
+    return MmapValueStore(directory / f'{os.getpid()}-{uuid.uuid4().hex[:8]}.db')
+
+
+def _get_store():
+    global _store
+    store = _store
+    # После fork (gunicorn --preload) процесс наследует файл родителя - заводим свой
+    if store is None or store.pid != os.getpid():
+        with _store_lock:
+            if _store is None or _store.pid != os.getpid():
+                _store = _open_store()
+            store = _store
+    return store
+
+
+def reset_store():
+    """Закрыть файл текущего процесса (смена каталога, тесты)"""
+    global _store
+    with _store_lock:
+        if _store is not None and _store.pid == os.getpid():
+            _store.close()
+        _store = None
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False, separators=(',', ':'))
+
+
+_registry = {}
+_collectors = []
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+        _registry[name] = self
+
+    def _labels(self, labels):
+        return {name: str(labels[name]) for name in self.labelnames}
+
+    def _cached_key(self, suffix, labels):
+        # Сериализация ключа дороже самой записи - кешируем по значениям меток
+        cache_key = (suffix, tuple(labels.get(name) for name in self.labelnames), labels.get('le'))
+        key = self._keys.get(cache_key)
+        if key is None:
+            key = self._keys[cache_key] = _key(self.name + suffix, labels)
+        return key
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _get_store().add(self._cached_key('', self._labels(labels)), amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        store = _get_store()
+        # Храним некумулятивные бакеты: одна запись на наблюдение
+        le = next((bound for bound in self.buckets if value <= bound), '+Inf')
+        store.add(self._cached_key('_bucket', dict(labels, le=str(le))), 1)
+        store.add(self._cached_key('_sum', labels), value)
+        store.add(self._cached_key('_count', labels), 1)
+
+
+def register_collector(collector):
+    """
+    Зарегистрировать функцию, вызываемую при каждом опросе /metrics.
+    Она получает просуммированные значения хранилища и возвращает
+    список (name, type, help, [(labels, value), ...]).
+    """
+    _collectors.append(collector)
+    return collector
+
+
+def collect_values():
+    """Суммировать значения из файлов всех процессов"""
+    totals = defaultdict(float)
+    directory = get_metrics_dir()
+    if not directory.exists():
+        return totals
+    for path in directory.glob('*.db'):
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        if len(data) < _HEADER.size:
+            continue
+        used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+        for key, value, _ in iterate_entries(data, used):
+            totals[key] += value
+    return totals
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def generate_latest():
+    """Текст экспозиции в формате Prometheus 0.0.4"""
+    totals = collect_values()
+    samples = defaultdict(list)
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        samples[name].append((tuple(tuple(pair) for pair in labels), value))
+
+    lines = []
+    for metric in sorted(_registry.values(), key=lambda m: m.name):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        if metric.type == 'histogram':
+            lines.extend(_histogram_lines(metric, samples))
+        else:
+            for labels, value in sorted(samples.get(metric.name, ())):
+                lines.append(f'{metric.name}{_format_labels(labels)} {_format_value(value)}')
+
+    for collector in _collectors:
+        for name, metric_type, documentation, values in collector(totals):
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in values:
+                lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric, samples):
+    buckets = defaultdict(dict)
+    for labels, value in samples.get(metric.name + '_bucket', ()):
+        labels = dict(labels)
+        le = labels.pop('le')
+        buckets[tuple(sorted(labels.items()))][le] = value
+    sums = dict(samples.get(metric.name + '_sum', ()))
+    counts = dict(samples.get(metric.name + '_count', ()))
+
+    lines = []
+    bounds = [str(bound) for bound in metric.buckets] + ['+Inf']
+    for labels in sorted(counts):
+        cumulative = 0
+        for bound in bounds:
+            cumulative += buckets[labels].get(bound, 0)
+            bucket_labels = list(labels) + [('le', bound)]
+            lines.append(f'{metric.name}_bucket{_format_labels(bucket_labels)} {_format_value(cumulative)}')
+        lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_value(sums.get(labels, 0))}')
+        lines.append(f'{metric.name}_count{_format_labels(labels)} {_format_value(counts[labels])}')
+    return lines
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Метрики производительности
+request_duration = Histogram(
+    'marketplace_http_request_duration_seconds',
+    'Время обработки HTTP-запроса',
+    ['view', 'method'],
+)
+db_queries_per_request = Histogram(
+    'marketplace_db_queries_per_request',
+    'Количество SQL-запросов на HTTP-запрос',
+    ['view'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+db_query_duration = Histogram(
+    'marketplace_db_query_duration_seconds',
+    'Время выполнения SQL-запроса',
+    ['database'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+cache_requests = Counter(
+    'marketplace_cache_requests_total',
+    'Обращения к кешу по результату (hit/miss)',
+    ['cache', 'result'],
+)
+
+# Бизнес-метрики
+cart_adds = Counter(
+    'marketplace_cart_adds_total',
+    'Добавления товаров в корзину (для "в секунду" используйте rate())',
+)
+stock_out_events = Counter(
+    'marketplace_stock_out_events_total',
+    'Переходы остатка продукта в ноль',
+)
+
+
+@register_collector
+def cache_hit_ratio(totals):
+    by_cache = defaultdict(lambda: {'hit': 0.0, 'miss': 0.0})
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        if name == cache_requests.name:
+            labels = dict(labels)
+            by_cache[labels['cache']][labels['result']] += value
+    values = [
+        ({'cache': cache}, counts['hit'] / (counts['hit'] + counts['miss']))
+        for cache, counts in sorted(by_cache.items())
+        if counts['hit'] + counts['miss']
+    ]
+    return [('marketplace_cache_hit_ratio', 'gauge', 'Доля попаданий в кеш', values)]
+
+
+@register_collector
+def moderation_queue(totals):
+    from .moderation import queue_queryset
+    pending = queue_queryset().count()
+    return [('marketplace_moderation_queue_length', 'gauge', 'Продукты, ожидающие модерации', [({}, pending)])]
+
+
+@register_collector
+def image_pipeline_backlog(totals):
+    from .models import Task
+    from .tasks import optimize_product_images
+    backlog = Task.objects.filter(
+        name=optimize_product_images.name, status__in=[Task.QUEUED, Task.RUNNING],
+    ).count()
+    return [('marketplace_image_pipeline_backlog', 'gauge', 'Изображения продуктов, ожидающие обработки', [({}, backlog)])]
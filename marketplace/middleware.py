@@ -0,0 +1,144 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import db_router, instrumentation, metrics
+
+perf_logger = logging.getLogger('marketplace.perf')
+
+
+class PerformanceMiddleware:
+    """
+    Замер SQL, рендера шаблонов и общего времени ответа для выборки запросов.
+
+    Результаты отдаются в заголовке Server-Timing, пишутся в лог
+    marketplace.perf и накапливаются по имени URL (см. instrumentation.get_url_stats).
+    Повторяющиеся формы SQL в одном запросе помечаются как вероятные N+1.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = instrumentation.get_setting('ENABLED')
+        self.sample_rate = instrumentation.get_setting('SAMPLE_RATE')
+        self.threshold = instrumentation.get_setting('N_PLUS_ONE_THRESHOLD')
+        self.server_timing = instrumentation.get_setting('SERVER_TIMING')
+        if self.enabled:
+            instrumentation.install_template_timing()
+
+    def __call__(self, request):
+        if not self.enabled or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = instrumentation.RequestProfile()
+        recorder = instrumentation.QueryRecorder(profile)
+        token = instrumentation.activate(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+
+        total_time = profile.total_time
+        suspected = profile.repeated_shapes(self.threshold)
+        match = request.resolver_match
+        url_name = match.view_name if match else '<unresolved>'
+        instrumentation.record(url_name, profile, total_time, bool(suspected))
+
+        if self.server_timing:
+            response['Server-Timing'] = instrumentation.server_timing_header(profile, total_time)
+
+        log = perf_logger.warning if suspected else perf_logger.info
+        log(
+            'perf %s %s: %d queries, %.1f ms total%s',
+            request.method, request.path, profile.query_count, total_time * 1000,
+            ' (probable N+1)' if suspected else '',
+            extra={
+                'url_name': url_name,
+                'status': response.status_code,
+                'total_ms': round(total_time * 1000, 2),
+                'sql_ms': round(profile.sql_time * 1000, 2),
+                'template_ms': round(profile.template_time * 1000, 2),
+                'queries': profile.query_count,
+                'n_plus_one': [{'sql': shape, 'count': count} for shape, count in suspected],
+            },
+        )
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Гистограммы времени ответа и числа SQL-запросов по имени URL,
+    а также времени каждого SQL-запроса по алиасу БД (см. marketplace.metrics).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        query_count = 0
+
+        def observe_query(execute, sql, params, many, context):
+            nonlocal query_count
+            query_started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                query_count += 1
+                metrics.db_query_duration.observe(
+                    time.perf_counter() - query_started,
+                    database=context['connection'].alias,
+                )
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(observe_query))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        metrics.request_duration.observe(time.perf_counter() - started, view=view, method=request.method)
+        metrics.db_queries_per_request.observe(query_count, view=view)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Чтения представлений из DATABASE_ROUTING['READ_ONLY_VIEWS'] направляются
+    в реплики (см. marketplace.db_router). После изменяющего запроса клиент
+    на STICKY_SECONDS закрепляется за основной базой через cookie.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.read_only_views = frozenset(db_router.get_setting('READ_ONLY_VIEWS'))
+        self.sticky_cookie = db_router.get_setting('STICKY_COOKIE')
+        self.sticky_seconds = db_router.get_setting('STICKY_SECONDS')
+
+    def __call__(self, request):
+        token = db_router.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = db_router.end_request(token)
+        if wrote or request.method not in self.SAFE_METHODS:
+            response.set_cookie(
+                self.sticky_cookie, '1', max_age=self.sticky_seconds,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            request.method in self.SAFE_METHODS
+            and request.resolver_match.view_name in self.read_only_views
+            and self.sticky_cookie not in request.COOKIES
+        ):
+            db_router.use_replica()
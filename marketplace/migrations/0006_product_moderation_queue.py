@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0005_cartitem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('decision', models.CharField(choices=[('approved', 'Одобрен'), ('rejected', 'Отклонен')], max_length=10, verbose_name='Решение')),
+                ('decided_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата решения')),
+            ],
+            options={
+                'verbose_name': 'Решение модерации',
+                'verbose_name_plural': 'Решения модерации',
+                'ordering': ['-decided_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='moderated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата модерации'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='moderation_claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Взят на модерацию'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='moderation_claimed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Закреплен за модератором до'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['checked', 'created_at'], name='product_moderation_queue_idx'),
+        ),
+        migrations.AddField(
+            model_name='moderationdecision',
+            name='moderator',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Модератор'),
+        ),
+        migrations.AddField(
+            model_name='moderationdecision',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moderation_decisions', to='marketplace.product', verbose_name='Продукт'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Q, Sum
+
+
+def fill_seller_stats(apps, schema_editor):
+    """Начальное заполнение счетчиков по существующим продуктам"""
+    Product = apps.get_model('marketplace', 'Product')
+    Seller = apps.get_model('marketplace', 'Seller')
+    SellerStats = apps.get_model('marketplace', 'SellerStats')
+    rows = {
+        row['seller_id']: row
+        for row in Product.objects.values('seller_id').annotate(
+            total=Count('id'),
+            checked_count=Count('id', filter=Q(checked=True)),
+            low=Count('id', filter=Q(stock__gt=0, stock__lte=10)),
+            out=Count('id', filter=Q(stock=0)),
+            value=Sum(F('price') * F('stock'), output_field=DecimalField(max_digits=16, decimal_places=2)),
+        ).order_by()
+    }
+    SellerStats.objects.bulk_create([
+        SellerStats(
+            seller_id=seller_id,
+            total_products=rows.get(seller_id, {}).get('total', 0),
+            checked_products=rows.get(seller_id, {}).get('checked_count', 0),
+            low_stock_products=rows.get(seller_id, {}).get('low', 0),
+            out_of_stock_products=rows.get(seller_id, {}).get('out', 0),
+            inventory_value=rows.get(seller_id, {}).get('value') or 0,
+        )
+        for seller_id in Seller.objects.values_list('id', flat=True).iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0006_product_moderation_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerStats',
+            fields=[
+                ('seller', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='marketplace.seller', verbose_name='Продавец')),
+                ('total_products', models.IntegerField(default=0, verbose_name='Всего продуктов')),
+                ('checked_products', models.IntegerField(default=0, verbose_name='Проверено')),
+                ('low_stock_products', models.IntegerField(default=0, verbose_name='С низким остатком')),
+                ('out_of_stock_products', models.IntegerField(default=0, verbose_name='Без остатка')),
+                ('inventory_value', models.DecimalField(decimal_places=2, default=0, help_text='Сумма price * stock по всем продуктам', max_digits=16, verbose_name='Стоимость остатков')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Статистика продавца',
+                'verbose_name_plural': 'Статистика продавцов',
+            },
+        ),
+        migrations.RunPython(fill_seller_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Индексы, которые есть только в PostgreSQL. Строятся CONCURRENTLY, чтобы
+# не блокировать запись в таблицу продуктов, поэтому миграция не атомарна.
+POSTGRES_INDEXES = [
+    # Поиск каталога: UPPER(col) LIKE UPPER('%q%') (icontains) использует триграммы
+    (
+        'product_title_trgm_idx',
+        'ON marketplace_product USING gin (UPPER(title) gin_trgm_ops)',
+    ),
+    (
+        'product_description_trgm_idx',
+        'ON marketplace_product USING gin (UPPER(description) gin_trgm_ops)',
+    ),
+    # Фильтр по тегам: index-only scan по связи тег -> продукт
+    (
+        'product_tags_tag_product_idx',
+        'ON marketplace_product_tags (tag_id, product_id)',
+    ),
+]
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, definition in POSTGRES_INDEXES:
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}')
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in POSTGRES_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('marketplace', '0007_sellerstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('checked', True)), fields=['-created_at'], name='product_checked_recent_idx'),
+        ),
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes, atomic=False),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0010_task_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.CharField(max_length=255, unique=True, verbose_name='Сигнатура')),
+                ('path', models.CharField(max_length=2000, verbose_name='URL')),
+                ('hits', models.FloatField(default=0, verbose_name='Оценка обращений')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Популярная страница',
+                'verbose_name_plural': 'Популярные страницы',
+            },
+        ),
+    ]
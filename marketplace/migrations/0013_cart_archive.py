@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0012_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCartItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID строки корзины')),
+                ('client_id', models.IntegerField(verbose_name='Клиент')),
+                ('product_id', models.IntegerField(verbose_name='Продукт')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена при архивации')),
+                ('created_at', models.DateTimeField(verbose_name='Дата добавления')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата последнего изменения')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата архивации')),
+            ],
+            options={
+                'verbose_name': 'Архивная строка корзины',
+                'verbose_name_plural': 'Архив корзин',
+            },
+        ),
+        migrations.CreateModel(
+            name='AbandonedCartStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('product_id', models.IntegerField(verbose_name='Продукт')),
+                ('lines', models.PositiveIntegerField(default=0, verbose_name='Строк')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Сумма')),
+            ],
+            options={
+                'verbose_name': 'Брошенные корзины за день',
+                'verbose_name_plural': 'Брошенные корзины по дням',
+                'ordering': ['-day', 'product_id'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product_id'), name='abandoned_cart_day_product_uniq')],
+            },
+        ),
+    ]
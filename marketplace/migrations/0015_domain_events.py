@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0014_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('action', models.CharField(choices=[('created', 'Создание'), ('updated', 'Изменение'), ('deleted', 'Удаление')], max_length=10, verbose_name='Действие')),
+                ('object_ids', models.JSONField(default=list, verbose_name='ID объектов')),
+                ('fields', models.JSONField(blank=True, default=list, help_text='Пусто - неизвестно какие', verbose_name='Поля')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата')),
+            ],
+            options={
+                'verbose_name': 'Доменное событие',
+                'verbose_name_plural': 'Доменные события',
+            },
+        ),
+        migrations.CreateModel(
+            name='EventCursor',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Подписчик')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Позиция')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Аренда до')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Позиция подписчика',
+                'verbose_name_plural': 'Позиции подписчиков',
+            },
+        ),
+    ]
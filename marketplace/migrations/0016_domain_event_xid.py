@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0015_domain_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domainevent',
+            name='xid',
+            field=models.BigIntegerField(default=0, help_text='pg_current_xact_id() записавшей транзакции; 0 на остальных СУБД', verbose_name='Транзакция'),
+        ),
+        migrations.AddField(
+            model_name='eventcursor',
+            name='position_xid',
+            field=models.BigIntegerField(default=0, verbose_name='Позиция: транзакция'),
+        ),
+        migrations.AddIndex(
+            model_name='domainevent',
+            index=models.Index(fields=['xid', 'id'], name='domain_event_order_idx'),
+        ),
+    ]
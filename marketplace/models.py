@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
 from django.core.validators import MinLengthValidator, MinValueValidator
 
+from .events import ChangeEventManager
+
 
 class UserManager(BaseUserManager):
     """Менеджер для создания пользователей"""
@@ -116,6 +119,8 @@ class Tag(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     
+    objects = ChangeEventManager()
+    
     class Meta:
         verbose_name = 'Тег'
         verbose_name_plural = 'Теги'
@@ -176,16 +181,49 @@ class Product(models.Model):
         verbose_name='Проверен',
         help_text='Только администратор может изменить это поле'
     )
+    # Очередь модерации: checked=False и moderated_at пустое.
+    # Отклоненный продукт получает moderated_at и возвращается в очередь после правки продавцом.
+    moderated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата модерации'
+    )
+    moderation_claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Взят на модерацию'
+    )
+    moderation_claimed_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Закреплен за модератором до'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
+    objects = ChangeEventManager()
+    
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
-            models.Index(fields=['checked']),
+            models.Index(fields=['checked', 'created_at'], name='product_moderation_queue_idx'),
+            # Витрина и каталог читают только проверенные продукты, новые первыми
+            models.Index(fields=['-created_at'], name='product_checked_recent_idx', condition=models.Q(checked=True)),
+            # Сортировки каталога по цене и названию без временной сортировки;
+            # id - стабильный порядок при равных значениях
+            models.Index(fields=['price', 'id'], name='product_checked_price_idx', condition=models.Q(checked=True)),
+            models.Index(fields=['title', 'id'], name='product_checked_title_idx', condition=models.Q(checked=True)),
+            # Списки продавца (seller_products, панель): свои продукты, новые первыми
+            models.Index(fields=['seller', '-created_at'], name='product_seller_recent_idx'),
+            # Панель продавца: низкий остаток (по stock) и нулевой остаток (по updated_at)
+            models.Index(fields=['seller', 'stock', '-updated_at'], name='product_seller_stock_idx'),
+            # Проверить формы запросов: python manage.py index_advisor
         ]
     
     def __str__(self):
@@ -216,6 +254,8 @@ class ProductPhoto(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
     
+    objects = ChangeEventManager()
+    
     class Meta:
         verbose_name = 'Фотография продукта'
         verbose_name_plural = 'Фотографии продуктов'
@@ -250,6 +290,8 @@ class CartItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
+    objects = ChangeEventManager()
+    
     class Meta:
         verbose_name = 'Товар в корзине'
         verbose_name_plural = 'Товары в корзине'
@@ -265,3 +307,368 @@ class CartItem(models.Model):
     def get_total_price(self):
         """Получить общую стоимость товара (цена * количество)"""
         return self.product.price * self.quantity
+
+
+class ModerationDecision(models.Model):
+    """Журнал решений модерации (для метрик пропускной способности)"""
+    APPROVED = 'approved'
+    REJECTED = 'rejected'
+    DECISION_CHOICES = [
+        (APPROVED, 'Одобрен'),
+        (REJECTED, 'Отклонен'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='moderation_decisions',
+        verbose_name='Продукт'
+    )
+    moderator = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+',
+        verbose_name='Модератор'
+    )
+    decision = models.CharField(max_length=10, choices=DECISION_CHOICES, verbose_name='Решение')
+    decided_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата решения')
+
+    class Meta:
+        verbose_name = 'Решение модерации'
+        verbose_name_plural = 'Решения модерации'
+        ordering = ['-decided_at']
+
+    def __str__(self):
+        return f"{self.get_decision_display()}: {self.product_id}"
+
+
+class SellerStats(models.Model):
+    """
+    Счетчики продуктов продавца. Поддерживаются инкрементально при записи
+    продуктов (marketplace.seller_stats), расхождения исправляет
+    команда reconcile_seller_stats.
+    """
+    seller = models.OneToOneField(
+        Seller,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Продавец'
+    )
+    total_products = models.IntegerField(default=0, verbose_name='Всего продуктов')
+    checked_products = models.IntegerField(default=0, verbose_name='Проверено')
+    low_stock_products = models.IntegerField(default=0, verbose_name='С низким остатком')
+    out_of_stock_products = models.IntegerField(default=0, verbose_name='Без остатка')
+    inventory_value = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        verbose_name='Стоимость остатков',
+        help_text='Сумма price * stock по всем продуктам'
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Статистика продавца'
+        verbose_name_plural = 'Статистика продавцов'
+
+    def __str__(self):
+        return f"Статистика {self.seller_id}"
+
+    @property
+    def unchecked_products(self):
+        return self.total_products - self.checked_products
+
+
+class Task(models.Model):
+    """Фоновая задача в очереди на базе БД (см. marketplace.task_queue)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=200, verbose_name='Задача')
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name='Аргументы')
+    priority = models.SmallIntegerField(default=0, verbose_name='Приоритет', help_text='Больше - раньше')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name='Статус')
+    dedup_key = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        verbose_name='Ключ дедупликации',
+        help_text='Пока задача с этим ключом ждет в очереди, повторная не ставится'
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='Максимум попыток')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Не раньше')
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name='Воркер')
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Аренда до')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начало выполнения')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Окончание выполнения')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-created_at']
+        indexes = [
+            # Выбор следующей задачи: только ожидающие, по приоритету и времени
+            models.Index(
+                fields=['-priority', 'run_after', 'id'],
+                name='task_ready_idx',
+                condition=models.Q(status='queued'),
+            ),
+            # Возврат задач упавших воркеров по истекшей аренде
+            models.Index(fields=['locked_until'], name='task_lease_idx', condition=models.Q(status='running')),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status='queued'),
+                name='task_queued_dedup_key_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class HotPage(models.Model):
+    """
+    Популярная страница для прогрева кеша (см. marketplace.page_cache).
+    Счетчик пополняется оценками частот из скетчей процессов и затухает со временем.
+    """
+    signature = models.CharField(max_length=255, unique=True, verbose_name='Сигнатура')
+    path = models.CharField(max_length=2000, verbose_name='URL')
+    hits = models.FloatField(default=0, verbose_name='Оценка обращений')
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Популярная страница'
+        verbose_name_plural = 'Популярные страницы'
+
+    def __str__(self):
+        return self.path
+
+
+class ProductRecommendation(models.Model):
+    """
+    "С этим товаром также добавляют": лучшие K продуктов по совместным
+    добавлениям в корзины (см. marketplace.recommendations).
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Продукт'
+    )
+    recommended = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='recommended_for',
+        verbose_name='Рекомендуемый продукт'
+    )
+    rank = models.PositiveSmallIntegerField(verbose_name='Позиция')
+    score = models.FloatField(verbose_name='Оценка')
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        constraints = [
+            # Индекс (product, rank) - чтение списка одним диапазоном в нужном порядке
+            models.UniqueConstraint(fields=['product', 'rank'], name='product_recommendation_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id}"
+
+
+class ArchivedCartItem(models.Model):
+    """
+    Строка брошенной корзины, перенесенная из CartItem командой archive_carts
+    (см. marketplace.cart_archive). id совпадает с id исходной строки.
+    Без внешних ключей и вторичных индексов: архив только дописывается и
+    переживает удаление клиентов и продуктов.
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID строки корзины')
+    client_id = models.IntegerField(verbose_name='Клиент')
+    product_id = models.IntegerField(verbose_name='Продукт')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена при архивации')
+    created_at = models.DateTimeField(verbose_name='Дата добавления')
+    updated_at = models.DateTimeField(verbose_name='Дата последнего изменения')
+    archived_at = models.DateTimeField(default=timezone.now, verbose_name='Дата архивации')
+
+    class Meta:
+        verbose_name = 'Архивная строка корзины'
+        verbose_name_plural = 'Архив корзин'
+
+    def __str__(self):
+        return f"{self.client_id} - {self.product_id} (x{self.quantity})"
+
+
+class AbandonedCartStats(models.Model):
+    """
+    Брошенные корзины по дню последнего изменения строки и продукту.
+    Пополняется командой archive_carts и в режиме удаления без архива.
+    """
+    day = models.DateField(verbose_name='День')
+    product_id = models.IntegerField(verbose_name='Продукт')
+    lines = models.PositiveIntegerField(default=0, verbose_name='Строк')
+    quantity = models.PositiveIntegerField(default=0, verbose_name='Количество')
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name='Сумма')
+
+    class Meta:
+        verbose_name = 'Брошенные корзины за день'
+        verbose_name_plural = 'Брошенные корзины по дням'
+        ordering = ['-day', 'product_id']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product_id'], name='abandoned_cart_day_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.product_id}"
+
+
+class WebhookEndpoint(models.Model):
+    """
+    Адрес продавца для вебхуков (см. marketplace.webhooks). События, на
+    которые подписан адрес, доставляются пачками POST-запросами с
+    подписью HMAC-SHA256 секретом адреса.
+    """
+    PRODUCT_APPROVED = 'product.approved'
+    PRODUCT_STOCK_LOW = 'product.stock_low'
+    PRODUCT_OUT_OF_STOCK = 'product.out_of_stock'
+    CART_ADDED = 'cart.added'
+    EVENT_CHOICES = [
+        (PRODUCT_APPROVED, 'Продукт одобрен модерацией'),
+        (PRODUCT_STOCK_LOW, 'Остаток продукта стал низким'),
+        (PRODUCT_OUT_OF_STOCK, 'Продукт закончился'),
+        (CART_ADDED, 'Продукт добавлен в корзину'),
+    ]
+
+    seller = models.ForeignKey(
+        Seller,
+        on_delete=models.CASCADE,
+        related_name='webhook_endpoints',
+        verbose_name='Продавец'
+    )
+    url = models.URLField(max_length=500, verbose_name='URL')
+    secret = models.CharField(max_length=64, verbose_name='Секрет подписи')
+    events = models.JSONField(default=list, verbose_name='События')
+    is_active = models.BooleanField(default=True, verbose_name='Активен')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Вебхук продавца'
+        verbose_name_plural = 'Вебхуки продавцов'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.seller_id}: {self.url}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Событие для доставки на адрес вебхука (outbox). Пишется в той же
+    транзакции, что и изменение, которое его вызвало; доставляется
+    фоновой задачей deliver_webhooks.
+    """
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает доставки'),
+        (DELIVERED, 'Доставлено'),
+        (FAILED, 'Не доставлено'),
+    ]
+
+    endpoint = models.ForeignKey(
+        WebhookEndpoint,
+        on_delete=models.CASCADE,
+        related_name='outbox',
+        verbose_name='Адрес'
+    )
+    event = models.CharField(max_length=50, choices=WebhookEndpoint.EVENT_CHOICES, verbose_name='Событие')
+    payload = models.JSONField(default=dict, verbose_name='Данные')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата создания')
+    delivered_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата доставки')
+
+    class Meta:
+        verbose_name = 'Событие вебхука'
+        verbose_name_plural = 'События вебхуков'
+        ordering = ['-id']
+        indexes = [
+            # Выбор событий к отправке: только ожидающие, по времени попытки
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                name='webhook_event_due_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event} #{self.pk} ({self.status})"
+
+
+class DomainEvent(models.Model):
+    """
+    Изменение каталога или корзин в outbox доменных событий (см.
+    marketplace.events). Одна строка - одна операция записи: сохранение
+    объекта или массовый UPDATE, bulk_create, bulk_update со списком id.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (CREATED, 'Создание'),
+        (UPDATED, 'Изменение'),
+        (DELETED, 'Удаление'),
+    ]
+
+    model = models.CharField(max_length=50, verbose_name='Модель')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name='Действие')
+    object_ids = models.JSONField(default=list, verbose_name='ID объектов')
+    fields = models.JSONField(default=list, blank=True, verbose_name='Поля', help_text='Пусто - неизвестно какие')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Дата')
+    xid = models.BigIntegerField(
+        default=0, verbose_name='Транзакция',
+        help_text='pg_current_xact_id() записавшей транзакции; 0 на остальных СУБД',
+    )
+
+    class Meta:
+        verbose_name = 'Доменное событие'
+        verbose_name_plural = 'Доменные события'
+        # Порядок чтения подписчиками (см. marketplace.events)
+        indexes = [models.Index(fields=['xid', 'id'], name='domain_event_order_idx')]
+
+    def __str__(self):
+        return f"{self.model}.{self.action} #{self.pk}"
+
+
+class EventCursor(models.Model):
+    """Позиция подписчика в outbox доменных событий: (xid, id) последнего обработанного события"""
+    name = models.CharField(max_length=100, primary_key=True, verbose_name='Подписчик')
+    position_xid = models.BigIntegerField(default=0, verbose_name='Позиция: транзакция')
+    position = models.BigIntegerField(default=0, verbose_name='Позиция')
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Аренда до')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Позиция подписчика'
+        verbose_name_plural = 'Позиции подписчиков'
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
@@ -0,0 +1,174 @@
+"""
+Очередь модерации продуктов.
+
+Модератор забирает пачку продуктов из очереди (checked=False, moderated_at
+пустое) в порядке created_at. Пачка закрепляется за ним на
+MODERATION_CLAIM_TTL, поэтому несколько модераторов не видят одни и те же
+продукты. Решение по пачке применяется одним UPDATE ... WHERE id IN (...),
+после чего один раз отправляется сигнал products_moderated. Кеши, поиск и
+прочие производные данные узнают об изменении из доменного события,
+которое UPDATE пишет в outbox (см. marketplace.events). События вебхуков
+product.approved пишутся в той же транзакции, что и решение.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncHour
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import metrics, seller_stats, webhooks
+from .models import ModerationDecision, Product
+
+# Отправляется один раз на пачку после коммита: product_ids, decision, moderator
+products_moderated = Signal()
+
+moderation_decisions = metrics.Counter(
+    'marketplace_moderation_decisions_total',
+    'Решения модерации (items/hour: rate(...[1h]) * 3600)',
+    ['decision'],
+)
+
+
+def get_claim_ttl():
+    return getattr(settings, 'MODERATION_CLAIM_TTL', timedelta(minutes=10))
+
+
+def get_batch_size():
+    return getattr(settings, 'MODERATION_BATCH_SIZE', 50)
+
+
+def queue_queryset():
+    """Продукты, ожидающие модерации, в порядке поступления (индекс checked, created_at)"""
+    return Product.objects.filter(checked=False, moderated_at__isnull=True).order_by('created_at')
+
+
+def _claimable(moderator, now):
+    return (
+        Q(moderation_claimed_until__isnull=True)
+        | Q(moderation_claimed_until__lt=now)
+        | Q(moderation_claimed_by=moderator)
+    )
+
+
+def claim_batch(moderator, size=None):
+    """
+    Закрепить за модератором следующую пачку продуктов и вернуть их.
+    Незавершенная пачка этого же модератора выдается повторно.
+    """
+    size = size or get_batch_size()
+    now = timezone.now()
+    claimed_until = now + get_claim_ttl()
+    candidates = queue_queryset().filter(_claimable(moderator, now))
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            # PostgreSQL: строки, заблокированные другим модератором, пропускаются без ожидания
+            ids = list(
+                candidates.select_for_update(skip_locked=True, of=('self',))
+                .values_list('id', flat=True)[:size]
+            )
+            Product.objects.filter(id__in=ids).update(
+                moderation_claimed_by=moderator,
+                moderation_claimed_until=claimed_until,
+            )
+        else:
+            # SQLite: запись сериализуется, а повторная проверка условия в UPDATE
+            # не дает перехватить продукт, уже закрепленный другим модератором
+            ids = list(candidates.values_list('id', flat=True)[:size])
+            Product.objects.filter(_claimable(moderator, now), id__in=ids).update(
+                moderation_claimed_by=moderator,
+                moderation_claimed_until=claimed_until,
+            )
+
+    return list(
+        Product.objects.filter(
+            moderation_claimed_by=moderator,
+            moderation_claimed_until=claimed_until,
+        ).select_related('seller').order_by('created_at')
+    )
+
+
+def claimed_batch(moderator):
+    """Незавершенная пачка модератора без нового закрепления (для показа страницы)"""
+    return list(
+        queue_queryset().filter(
+            moderation_claimed_by=moderator,
+            moderation_claimed_until__gte=timezone.now(),
+        ).select_related('seller')
+    )
+
+
+def release_claims(moderator):
+    """Вернуть незавершенную пачку модератора в общую очередь"""
+    return Product.objects.filter(moderation_claimed_by=moderator, moderated_at__isnull=True).update(
+        moderation_claimed_by=None,
+        moderation_claimed_until=None,
+    )
+
+
+def decide(moderator, product_ids, decision, require_claim=True):
+    """
+    Применить решение к пачке продуктов одним UPDATE.
+    При require_claim=True учитываются только еще не проверенные продукты,
+    закрепленные за модератором. Без закрепления (действия админки) решение
+    применяется к любым продуктам, в том числе уже проверенным: так можно
+    отозвать одобрение. Возвращает список id, к которым решение применено.
+    """
+    if decision not in (ModerationDecision.APPROVED, ModerationDecision.REJECTED):
+        raise ValueError(f'Неизвестное решение модерации: {decision}')
+    now = timezone.now()
+
+    with transaction.atomic():
+        queryset = Product.objects.filter(id__in=product_ids)
+        if require_claim:
+            queryset = queryset.filter(
+                moderated_at__isnull=True,
+                moderation_claimed_by=moderator,
+                moderation_claimed_until__gte=now,
+            )
+        rows = list(queryset.select_for_update().values_list('id', 'seller_id', 'checked'))
+        if not rows:
+            return []
+        ids = [product_id for product_id, _, _ in rows]
+        Product.objects.filter(id__in=ids).update(
+            checked=decision == ModerationDecision.APPROVED,
+            moderated_at=now,
+            moderation_claimed_by=None,
+            moderation_claimed_until=None,
+            updated_at=now,
+        )
+        ModerationDecision.objects.bulk_create([
+            ModerationDecision(product_id=product_id, moderator=moderator, decision=decision)
+            for product_id in ids
+        ])
+        # UPDATE минует сигналы моделей - счетчики продавцов пересчитываются явно
+        seller_stats.refresh(seller_id for _, seller_id, _ in rows)
+        if decision == ModerationDecision.APPROVED:
+            # События вебхуков - в той же транзакции, что и решение; повторное
+            # одобрение уже проверенного продукта события не дает
+            webhooks.products_approved([(pk, seller_id) for pk, seller_id, checked in rows if not checked])
+        transaction.on_commit(lambda: products_moderated.send(
+            sender=Product, product_ids=ids, decision=decision, moderator=moderator,
+        ))
+
+    moderation_decisions.inc(len(ids), decision=decision)
+    return ids
+
+
+def throughput(hours=24):
+    """Решений по часам за последние hours часов: [(час, одобрено, отклонено), ...]"""
+    since = timezone.now() - timedelta(hours=hours)
+    rows = (
+        ModerationDecision.objects.filter(decided_at__gte=since)
+        .annotate(hour=TruncHour('decided_at'))
+        .values('hour')
+        .annotate(
+            approved=Count('id', filter=Q(decision=ModerationDecision.APPROVED)),
+            rejected=Count('id', filter=Q(decision=ModerationDecision.REJECTED)),
+        )
+        .order_by('-hour')
+    )
+    return [(row['hour'], row['approved'], row['rejected']) for row in rows]
@@ -0,0 +1,38 @@
+import hmac
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from . import instrumentation, metrics
+
+
+@staff_member_required
+@require_http_methods(["GET"])
+def perf_stats(request):
+    """Агрегаты PerformanceMiddleware по именам URL (текущий процесс)"""
+    return JsonResponse({
+        'sample_rate': instrumentation.get_setting('SAMPLE_RATE'),
+        'urls': instrumentation.get_url_stats(),
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def metrics_allowed(request):
+    """Доступ к /metrics: по токену из MARKETPLACE_METRICS['TOKEN'] или с адреса из ALLOWED_IPS"""
+    token = metrics.get_setting('TOKEN')
+    if token:
+        scheme, _, provided = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(provided.encode(), token.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in metrics.get_setting('ALLOWED_IPS')
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Экспозиция метрик в формате Prometheus. По умолчанию доступна только
+    с локального адреса (см. metrics_allowed).
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.generate_latest(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,451 @@
+"""
+Кеш страниц витрины для анонимных посетителей и его прогрев.
+
+PageCacheMiddleware отдает index, catalog и product_detail из кеша, если
+у запроса нет cookie сессии и сообщений - такая страница не зависит от
+посетителя. Ключ строится из нормализованной сигнатуры запроса: для
+каталога учитываются только параметры фильтров в порядке имен, поэтому
+?sort=name&q=x и ?q=x&sort=name попадают в одну запись.
+
+Запись хранит поколения областей, от которых зависит страница: главная
+и каталог - области catalog, страница продукта - области самого продукта
+и продуктов из ее блоков (page_cache.depends_on). Изменение продукта
+меняет поколения catalog и этого продукта, поэтому страницы остальных
+продуктов остаются в кеше; изменение тегов сбрасывает все поколение
+целиком. Запись с устаревшим поколением не отдается и истекает по TIMEOUT.
+
+Кеш должен быть общим для процессов (файловый или Redis): в кеше
+отдельного процесса (LocMem) сброс и прогрев не доходят до остальных
+воркеров, поэтому вне DEBUG такой кеш страниц не используется.
+
+Частоты сигнатур из живого трафика оцениваются в каждом процессе
+скетчем count-min с top-K кандидатов (память не зависит от числа
+уникальных поисковых запросов) и раз в FLUSH_INTERVAL секунд
+сбрасываются в таблицу HotPage с экспоненциальным затуханием. После
+деплоя (manage.py warm_page_cache) и после изменений каталога (задача
+warm_page_cache) самые популярные страницы рендерятся заранее не более
+чем WARM_CONCURRENCY потоками.
+"""
+import hashlib
+import logging
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.handlers.base import BaseHandler
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from . import compression, metrics
+from .models import HotPage
+
+logger = logging.getLogger('marketplace.page_cache')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'TIMEOUT': 600,
+    # Кешируемые представления и GET-параметры, от которых зависит страница
+    'VIEWS': {
+        'index': [],
+        'catalog': ['q', 'tags', 'min_price', 'max_price', 'in_stock', 'sort'],
+        'product_detail': [],
+    },
+    'SKETCH_WIDTH': 2048,
+    'SKETCH_DEPTH': 4,
+    'TOP_K': 100,
+    'FLUSH_INTERVAL': 30,
+    'HALF_LIFE_HOURS': 24,
+    'WARM_LIMIT': 100,
+    'WARM_CONCURRENCY': 2,
+    'WARM_PAUSE': 0.05,
+    'WARM_DELAY': 10,
+    'WARM_HOST': None,
+}
+
+GENERATION_KEY = 'page_cache:generation'
+# Области, на которые делится кеш: все страницы, списки продуктов, продукт
+ALL_SCOPE = 'all'
+CATALOG_SCOPE = 'catalog'
+# Ключ META внутренних запросов прогрева: из HTTP-заголовка его не подделать
+WARM_META = 'marketplace.page_cache.warm'
+MAX_URL_LENGTH = 2000
+
+pages_warmed = metrics.Counter(
+    'marketplace_page_cache_warmed_total',
+    'Страницы, отрендеренные прогревом кеша',
+    ['result'],
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'PAGE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting('CACHE')]
+
+
+def is_shared(cache):
+    """Кеш виден всем процессам: в LocMem сброс из одного воркера не дойдет до других"""
+    return not isinstance(cache, LocMemCache)
+
+
+class CountMinSketch:
+    """Оценка частот в фиксированной памяти: может завысить, но не занизить"""
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('L', [0]) * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        return [
+            int.from_bytes(digest[offset:offset + 4], 'little') % self.width
+            for offset in range(0, 4 * self.depth, 4)
+        ]
+
+    def add(self, key, count=1):
+        """Учесть count обращений и вернуть новую оценку частоты ключа"""
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += count
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class TopK:
+    """Не более k ключей с наибольшими оценками частоты: {ключ: (оценка, данные)}"""
+
+    def __init__(self, k):
+        self.k = k
+        self.items = {}
+        self._floor = 0
+
+    def offer(self, key, estimate, payload):
+        if key in self.items or len(self.items) < self.k:
+            self.items[key] = (estimate, payload)
+            if len(self.items) == self.k:
+                self._floor = min(value[0] for value in self.items.values())
+        elif estimate > self._floor:
+            # Оценки только растут, поэтому устаревший _floor лишь занижает порог
+            del self.items[min(self.items, key=lambda item: self.items[item][0])]
+            self.items[key] = (estimate, payload)
+            self._floor = min(value[0] for value in self.items.values())
+
+
+class TrafficRecorder:
+    """Частоты сигнатур страниц в процессе; периодически сбрасываются в HotPage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        self.sketch = CountMinSketch(get_setting('SKETCH_WIDTH'), get_setting('SKETCH_DEPTH'))
+        self.top = TopK(get_setting('TOP_K'))
+
+    def record(self, signature, url):
+        with self.lock:
+            self.top.offer(signature, self.sketch.add(signature), url)
+            if time.monotonic() - self.last_flush < get_setting('FLUSH_INTERVAL'):
+                return
+            candidates = self._take()
+        save_hits(candidates)
+
+    def flush(self):
+        with self.lock:
+            candidates = self._take()
+        save_hits(candidates)
+
+    def _take(self):
+        candidates = self.top.items
+        self._reset()
+        self.last_flush = time.monotonic()
+        return candidates
+
+
+recorder = TrafficRecorder()
+
+
+def decayed(hits, updated_at, now):
+    return hits * 0.5 ** ((now - updated_at).total_seconds() / (get_setting('HALF_LIFE_HOURS') * 3600))
+
+
+def save_hits(candidates, now=None):
+    """Добавить оценки {сигнатура: (обращений, url)} к HotPage с затуханием накопленного"""
+    if not candidates:
+        return
+    now = now or timezone.now()
+    # Явный алиас: запись из GET-запроса не должна закреплять клиента за основной базой
+    pages = HotPage.objects.using(DEFAULT_DB_ALIAS)
+    existing = {
+        signature: decayed(hits, updated_at, now)
+        for signature, hits, updated_at in pages.filter(
+            signature__in=list(candidates),
+        ).values_list('signature', 'hits', 'updated_at')
+    }
+    pages.bulk_create(
+        [
+            HotPage(signature=signature, path=url, hits=existing.get(signature, 0) + count, updated_at=now)
+            for signature, (count, url) in candidates.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['signature'],
+        update_fields=['path', 'hits', 'updated_at'],
+    )
+
+
+def hot_pages(limit, now=None):
+    """Самые популярные страницы с учетом затухания: [(сигнатура, url), ...]"""
+    now = now or timezone.now()
+    rows = HotPage.objects.using(DEFAULT_DB_ALIAS).values_list('signature', 'path', 'hits', 'updated_at')
+    scored = sorted(
+        ((decayed(hits, updated_at, now), signature, url) for signature, url, hits, updated_at in rows),
+        reverse=True,
+    )
+    return [(signature, url) for _, signature, url in scored[:limit]]
+
+
+def page_signature(request, views=None):
+    """
+    Вернуть (сигнатура, канонический URL) для кешируемой страницы или None.
+    Заодно выставляет request.resolver_match - при попадании в кеш
+    представление не вызывается, а метрики берут из него имя URL.
+    """
+    views = get_setting('VIEWS') if views is None else views
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    if match.view_name not in views:
+        return None
+    request.resolver_match = match
+    params = [(name, value) for name in sorted(views[match.view_name]) for value in request.GET.getlist(name)]
+    url = f'{request.path}?{urlencode(params)}' if params else request.path
+    if len(url) > MAX_URL_LENGTH:
+        return None
+    return hashlib.sha1(url.encode()).hexdigest(), url
+
+
+def is_anonymous(request):
+    # Без сессии и сообщений страница одинакова для всех посетителей
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES and CookieStorage.cookie_name not in request.COOKIES
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def page_scope(match):
+    """Область страницы по разобранному URL: продукт или списки каталога"""
+    product_id = match.kwargs.get('product_id')
+    return product_scope(product_id) if product_id is not None else CATALOG_SCOPE
+
+
+def depends_on(request, product_ids):
+    """Отметить, что страница показывает эти продукты (блоки похожих и т.п.)"""
+    request.page_cache_products = [*getattr(request, 'page_cache_products', ()), *product_ids]
+
+
+def scope_key(scope):
+    return f'{GENERATION_KEY}:{scope}'
+
+
+def new_generation():
+    # Время в нс: после потери ключа поколения старые записи не оживут
+    return time.time_ns()
+
+
+def current_generations(cache, scopes):
+    """{ключ поколения: значение} для областей; недостающие поколения заводятся"""
+    keys = [scope_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    # add() не затирает поколение, выставленное параллельным сбросом
+    conflicts = [key for key in missing if not cache.add(key, found.setdefault(key, new_generation()), None)]
+    if conflicts:
+        found.update(cache.get_many(conflicts))
+    return found
+
+
+def invalidate(product_ids=None):
+    """
+    Сделать недействительными страницы продуктов product_ids и списки
+    каталога; без product_ids - все закешированные страницы.
+    """
+    scopes = [ALL_SCOPE] if product_ids is None else [CATALOG_SCOPE, *map(product_scope, product_ids)]
+    generation = new_generation()
+    get_cache().set_many({scope_key(scope): generation for scope in scopes}, None)
+
+
+def cache_key(signature):
+    return f'page_cache:{signature}'
+
+
+def is_cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+        and 'no-store' not in response.get('Cache-Control', '')
+    )
+
+
+class PageCacheMiddleware:
+    """
+    Отдает страницы витрины анонимным посетителям из кеша (см. модуль).
+    Ставится после SecurityMiddleware: заголовки внутренних middleware
+    сохраняются вместе со страницей.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = get_setting('ENABLED')
+        if self.enabled and not settings.DEBUG and not is_shared(get_cache()):
+            logger.warning('page cache disabled: cache %r is local to the process', get_setting('CACHE'))
+            self.enabled = False
+        self.views = get_setting('VIEWS')
+        self.timeout = get_setting('TIMEOUT')
+
+    def __call__(self, request):
+        page = self.enabled and request.method in ('GET', 'HEAD') and page_signature(request, self.views)
+        if not page:
+            return self.get_response(request)
+
+        signature, url = page
+        warming = request.META.get(WARM_META, False)
+        response = self.serve(request, signature, warming) if is_anonymous(request) else self.get_response(request)
+        # Учитываются только существующие страницы: 404 не должны попадать в прогрев
+        if request.method == 'GET' and not warming and response.status_code == 200:
+            recorder.record(signature, url)
+        return response
+
+    def serve(self, request, signature, warming):
+        cache = get_cache()
+        key = cache_key(signature)
+        if not warming:
+            entry = cache.get(key)
+            if entry is not None:
+                content, headers, generations, digest = entry
+                encoding = compression.negotiate(request)
+                compressed_key = variant_key(f'{key}:{digest}', encoding) if encoding else None
+                current = cache.get_many([*generations, compressed_key] if encoding else list(generations))
+                if all(current.get(name) == value for name, value in generations.items()):
+                    return self.cached_response(f'{key}:{digest}', content, headers, encoding, current.get(compressed_key))
+
+        # Поколения читаются до рендера: сброс во время рендера не даст сохранить старую страницу
+        generations = current_generations(cache, [ALL_SCOPE, page_scope(request.resolver_match)])
+        response = self.get_response(request)
+        if is_cacheable(response):
+            related = {product_scope(pk) for pk in getattr(request, 'page_cache_products', ())}
+            generations.update(current_generations(cache, related))
+            digest = hashlib.blake2b(response.content, digest_size=8).hexdigest()
+            cache.set(key, (response.content, list(response.headers.items()), generations, digest), self.timeout)
+            response['X-Page-Cache'] = 'miss'
+            response.page_cache_key = f'{key}:{digest}'
+        return response
+
+    def cached_response(self, key, content, headers, encoding, variant):
+        if variant is None:
+            response = HttpResponse(content, headers=headers)
+            # CompressionMiddleware сожмет тело и сохранит вариант под этим ключом
+            response.page_cache_key = key
+        else:
+            response = HttpResponse(variant, headers=headers)
+            compression.apply_encoding(response, encoding, variant)
+            patch_vary_headers(response, ('Accept-Encoding',))
+        response['X-Page-Cache'] = 'hit'
+        return response
+
+
+def variant_key(key, encoding):
+    # key включает хеш содержимого: вариант прежней версии страницы не подойдет к новой
+    return f'{key}:{encoding}'
+
+
+def store_variant(key, encoding, content):
+    """Сохранить сжатый вариант страницы рядом с ней"""
+    get_cache().set(variant_key(key, encoding), content, get_setting('TIMEOUT'))
+
+
+def warm_host():
+    host = get_setting('WARM_HOST')
+    if host:
+        return host
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0] if hosts else 'localhost'
+
+
+def warm(limit=None, concurrency=None, pause=None):
+    """
+    Отрендерить популярные страницы в кеш через полный стек middleware.
+    concurrency ограничивает число одновременных рендеров, pause - пауза
+    после каждого, чтобы прогрев не вытеснял живой трафик из БД.
+    Возвращает число прогретых страниц.
+    """
+    limit = get_setting('WARM_LIMIT') if limit is None else limit
+    concurrency = max(1, get_setting('WARM_CONCURRENCY') if concurrency is None else concurrency)
+    pause = get_setting('WARM_PAUSE') if pause is None else pause
+
+    # Главная и каталог без фильтров нужны всегда, даже без накопленной статистики
+    urls = [reverse('index'), reverse('catalog')]
+    urls += [url for _, url in hot_pages(limit) if url not in urls]
+    urls = urls[:max(limit, 2)]
+
+    handler = BaseHandler()
+    handler.load_middleware()
+    # Accept-Encoding со всеми кодировками: заодно кешируется сжатый вариант страницы
+    factory = RequestFactory(
+        HTTP_HOST=warm_host(),
+        HTTP_ACCEPT_ENCODING=', '.join(compression.CODECS),
+        **{WARM_META: True},
+    )
+
+    def render(url):
+        try:
+            response = handler.get_response(factory.get(url))
+            response.close()
+            result = 'ok' if response.status_code == 200 else 'skipped'
+        except Exception:
+            logger.exception('page cache warm failed: %s', url)
+            result = 'error'
+        finally:
+            if concurrency > 1:
+                connections.close_all()
+            time.sleep(pause)
+        pages_warmed.inc(result=result)
+        return result == 'ok'
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        results = [render(url) for url in urls]
+    else:
+        with ThreadPoolExecutor(concurrency, thread_name_prefix='page-cache-warm') as pool:
+            results = list(pool.map(render, urls))
+    logger.info('warmed %d/%d pages in %.1f s', sum(results), len(urls), time.perf_counter() - started)
+    return sum(results)
+
+
+def trim(keep=None):
+    """Оставить в HotPage только keep самых популярных записей"""
+    keep = get_setting('TOP_K') * 4 if keep is None else keep
+    signatures = [signature for signature, _ in hot_pages(keep)]
+    deleted, _ = HotPage.objects.using(DEFAULT_DB_ALIAS).exclude(signature__in=signatures).delete()
+    return deleted
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_table_rows(model, using='default'):
+    """
+    Быстрая оценка числа строк таблицы без COUNT(*).
+    PostgreSQL - статистика планировщика (pg_class.reltuples),
+    SQLite - MAX(rowid).
+    Для прочих СУБД возвращает None.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            # -1 означает, что таблица еще ни разу не анализировалась
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # MAX(rowid) берется из B-дерева за O(log n); удаленные строки дают завышение
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0] or 0
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: для нефильтрованного списка берет оценку
+    числа строк из статистики СУБД вместо полного COUNT(*).
+    Если оценка меньше ADMIN_ESTIMATED_COUNT_THRESHOLD, считает точно.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            threshold = getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
+            estimate = estimate_table_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate >= threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,143 @@
+"""
+Хеширование паролей продавцов и клиентов.
+
+Основной хешер - scrypt (или argon2 при установленном argon2-cffi из
+requirements-auth.txt) с параметрами из PASSWORD_HASHING. Старые хеши
+(PBKDF2) и хеши с устаревшими параметрами проверяются как раньше и
+перехешируются при успешном входе.
+
+Хеши считаются в ограниченном пуле потоков (POOL_SIZE на процесс): поток
+запроса ждет результат, но одновременно CPU тратят не больше POOL_SIZE
+хешей, и поток входа не вытесняет остальные запросы.
+
+authenticate выполняет одинаковую работу для существующих и неизвестных
+email: для неизвестного пароль сверяется с заранее посчитанным хешем
+того же хешера, поэтому время ответа не выдает зарегистрированные адреса.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import get_random_string
+
+DEFAULTS = {
+    'POOL_SIZE': 4,
+    # n = 2 ** 14, r = 8: около 16 МБ памяти и 30-50 мс на хеш
+    'SCRYPT': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    # Рекомендация OWASP: 19 МБ, 2 прохода
+    'ARGON2': {'time_cost': 2, 'memory_cost': 19 * 1024, 'parallelism': 1},
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'PASSWORD_HASHING', {}).get(name, DEFAULTS[name])
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """scrypt с параметрами из PASSWORD_HASHING['SCRYPT']; смена параметров перехеширует пароли при входе"""
+
+    @property
+    def work_factor(self):
+        return get_setting('SCRYPT')['work_factor']
+
+    @property
+    def block_size(self):
+        return get_setting('SCRYPT')['block_size']
+
+    @property
+    def parallelism(self):
+        return get_setting('SCRYPT')['parallelism']
+
+    @property
+    def maxmem(self):
+        # По умолчанию OpenSSL ограничивает scrypt 32 МБ; нужно 128 * n * r байт,
+        # не меньше 64 МБ - для проверки хешей с прежними, более дорогими параметрами
+        return max(64 * 1024 * 1024, 2 * 128 * self.work_factor * self.block_size)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """argon2id с параметрами из PASSWORD_HASHING['ARGON2']"""
+
+    @property
+    def time_cost(self):
+        return get_setting('ARGON2')['time_cost']
+
+    @property
+    def memory_cost(self):
+        return get_setting('ARGON2')['memory_cost']
+
+    @property
+    def parallelism(self):
+        return get_setting('ARGON2')['parallelism']
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(get_setting('POOL_SIZE'), thread_name_prefix='password-hash')
+    return _pool
+
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    global _pool
+    if setting in ('PASSWORD_HASHING', 'PASSWORD_HASHERS'):
+        _dummy_hash.cache_clear()
+        if setting == 'PASSWORD_HASHING' and _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def run(func, *args):
+    """Выполняет func в пуле хеширования и ждет результат"""
+    return _get_pool().submit(func, *args).result()
+
+
+def hash_password(raw_password):
+    return run(hashers.make_password, raw_password)
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash():
+    return hashers.make_password(get_random_string(32))
+
+
+def _verify(raw_password, encoded):
+    """(пароль верен, нужно перехешировать); encoded=None - неизвестный пользователь"""
+    if encoded is None or not hashers.is_password_usable(encoded):
+        hashers.check_password(raw_password, _dummy_hash())
+        return False, False
+    outdated = []
+    valid = hashers.check_password(raw_password, encoded, setter=outdated.append)
+    return valid, bool(outdated)
+
+
+def _user_lookup(model, email):
+    return model.objects.filter(email=email, is_active=True)
+
+
+def _finish(user, raw_password, valid, outdated):
+    if not valid:
+        return None
+    if outdated:
+        # Запись хеша - в потоке запроса: у потоков пула своих соединений с БД нет
+        user.password = hash_password(raw_password)
+        user.save(update_fields=['password'])
+    return user
+
+
+def authenticate(model, email, password):
+    """Активный пользователь model с таким email и паролем или None"""
+    user = _user_lookup(model, email).first()
+    valid, outdated = run(_verify, password, user.password if user else None)
+    return _finish(user, password, valid, outdated)
+
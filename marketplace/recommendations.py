@@ -0,0 +1,369 @@
+"""
+"С этим товаром также добавляют": рекомендации по совместным добавлениям в корзины.
+
+Матрица совместной встречаемости C[i, j] - сколько клиентов добавили в
+корзину и i, и j; C[i, i] (counts) - сколько клиентов добавили i. Веса
+затухают с периодом полураспада HALF_LIFE_DAYS, поэтому свежие корзины
+весят больше старых. Оценка пары нормализуется по популярности (косинус):
+C[i, j] / sqrt(counts[i] * counts[j]) - иначе хиты рекомендовались бы ко
+всему подряд. Для каждого продукта лучшие TOP_K сохраняются в
+ProductRecommendation и читаются одним запросом по индексу (product, rank).
+
+Пересборка инкрементальная: новые строки CartItem (id больше отметки
+прежней сборки) добавляются к матрице пачками по CHUNK_SIZE (и не шире
+DECAY_STEP_HOURS по времени), в паре с уже лежащими в корзинах тех же
+клиентов. Перед каждой пачкой матрица затухает до времени пачки. Списки пересчитываются только для
+затронутых продуктов и их соседей. Матрица и отметка хранятся в файле
+STATE_PATH; без него (или с --full) матрица строится заново по всем
+корзинам.
+
+С установленными NumPy и SciPy (requirements-recommendations.txt)
+матрица хранится как scipy.sparse.csr_matrix и обновляется разреженным
+умножением индикаторных матриц корзин; без них - словарями на чистом
+Python с тем же результатом.
+"""
+import logging
+import math
+import os
+import struct
+import tempfile
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CartItem, Product, ProductRecommendation
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # pragma: no cover - необязательная зависимость
+    numpy = sparse = None
+
+logger = logging.getLogger('marketplace.tasks')
+
+DEFAULTS = {
+    # По умолчанию - var/recommendations.bin в BASE_DIR
+    'STATE_PATH': None,
+    'TOP_K': 10,
+    'HALF_LIFE_DAYS': 30,
+    # Затухшие ниже этого веса пары удаляются из матрицы
+    'PRUNE_WEIGHT': 0.05,
+    'CHUNK_SIZE': 5000,
+    'DECAY_STEP_HOURS': 24,
+    'REBUILD_DELAY': 300,
+}
+
+MAGIC = b'MREC'
+VERSION = 1
+# magic, версия, отметка (id CartItem), время затухания (мс), пар, счетчиков
+HEADER = struct.Struct('<4sHQQII')
+# Ограничение SQLite на число параметров запроса
+DELETE_BATCH = 500
+
+
+def get_setting(name):
+    return getattr(settings, 'RECOMMENDATIONS', {}).get(name, DEFAULTS[name])
+
+
+def get_state_path():
+    return str(get_setting('STATE_PATH') or Path(settings.BASE_DIR) / 'var' / 'recommendations.bin')
+
+
+def decay_factor(since, until):
+    if since is None or until <= since:
+        return 1.0
+    return 0.5 ** ((until - since).total_seconds() / (get_setting('HALF_LIFE_DAYS') * 86400))
+
+
+class CooccurrenceMatrix:
+    """Симметричная матрица на словарях: {i: {j: вес}} и {i: вес}"""
+
+    def __init__(self):
+        self.rows = defaultdict(dict)
+        self.counts = defaultdict(float)
+
+    @classmethod
+    def from_arrays(cls, pair_rows, pair_cols, pair_weights, count_ids, count_weights):
+        matrix = cls()
+        for i, j, weight in zip(pair_rows, pair_cols, pair_weights):
+            matrix.rows[i][j] = weight
+            matrix.rows[j][i] = weight
+        matrix.counts.update(zip(count_ids, count_weights))
+        return matrix
+
+    def decay(self, factor, prune):
+        if factor == 1.0:
+            return
+        for i in list(self.rows):
+            row = {j: weight * factor for j, weight in self.rows[i].items() if weight * factor >= prune}
+            if row:
+                self.rows[i] = row
+            else:
+                del self.rows[i]
+        for i in list(self.counts):
+            self.counts[i] *= factor
+
+    def add(self, baskets):
+        """baskets: [(продукты уже в корзине, новые продукты), ...] по клиентам"""
+        for old, new in baskets:
+            seen = list(old)
+            for j in new:
+                self.counts[j] += 1
+                for i in seen:
+                    if i != j:
+                        self.rows[i][j] = self.rows[i].get(j, 0.0) + 1
+                        self.rows[j][i] = self.rows[j].get(i, 0.0) + 1
+                seen.append(j)
+
+    def neighbors(self, product_id):
+        return self.rows.get(product_id, {}).keys()
+
+    def products(self):
+        return set(self.rows)
+
+    def top(self, product_id, k, allowed):
+        count = self.counts.get(product_id, 0.0)
+        scored = [
+            (weight / math.sqrt(count * self.counts[j]), j)
+            for j, weight in self.rows.get(product_id, {}).items()
+            if j in allowed and count and self.counts.get(j)
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(j, score) for score, j in scored[:k]]
+
+    def to_arrays(self):
+        pairs = [(i, j, weight) for i, row in self.rows.items() for j, weight in row.items() if i < j]
+        return (
+            [i for i, _, _ in pairs], [j for _, j, _ in pairs], [weight for _, _, weight in pairs],
+            list(self.counts), list(self.counts.values()),
+        )
+
+
+class SparseCooccurrenceMatrix:
+    """Та же матрица в scipy.sparse: индекс строки и столбца - id продукта"""
+
+    def __init__(self, size=1):
+        self.matrix = sparse.csr_matrix((size, size))
+        self.counts = numpy.zeros(size)
+
+    @classmethod
+    def from_arrays(cls, pair_rows, pair_cols, pair_weights, count_ids, count_weights):
+        rows, cols = numpy.asarray(pair_rows, dtype=numpy.int64), numpy.asarray(pair_cols, dtype=numpy.int64)
+        ids = numpy.asarray(count_ids, dtype=numpy.int64)
+        size = int(max(rows.max(initial=0), cols.max(initial=0), ids.max(initial=0))) + 1
+        matrix = cls(size)
+        weights = numpy.asarray(pair_weights, dtype=numpy.float64)
+        upper = sparse.coo_matrix((weights, (rows, cols)), shape=(size, size)).tocsr()
+        matrix.matrix = upper + upper.T
+        matrix.counts[ids] = numpy.asarray(count_weights, dtype=numpy.float64)
+        return matrix
+
+    def _grow(self, size):
+        if size > self.matrix.shape[0]:
+            self.matrix.resize((size, size))
+            self.counts = numpy.concatenate([self.counts, numpy.zeros(size - len(self.counts))])
+
+    def decay(self, factor, prune):
+        if factor == 1.0:
+            return
+        self.matrix = self.matrix * factor
+        self.matrix.data[self.matrix.data < prune] = 0
+        self.matrix.eliminate_zeros()
+        self.counts *= factor
+
+    def add(self, baskets):
+        # Индикаторные матрицы клиент x продукт: ΔC = Nᵀ·O + Oᵀ·N + Nᵀ·N без диагонали
+        size = max((product for old, new in baskets for product in (*old, *new)), default=0) + 1
+        self._grow(size)
+        size = self.matrix.shape[0]
+
+        def indicator(column):
+            rows = [client for client, products in enumerate(column) for _ in products]
+            cols = [product for products in column for product in products]
+            return sparse.csr_matrix(
+                (numpy.ones(len(cols)), (rows, cols)), shape=(len(column), size),
+            )
+
+        old = indicator([old for old, _ in baskets])
+        new = indicator([new for _, new in baskets])
+        delta = new.T @ old
+        delta = delta + delta.T + new.T @ new
+        delta = delta - sparse.diags(delta.diagonal())
+        delta.eliminate_zeros()
+        self.matrix = (self.matrix + delta).tocsr()
+        self.counts += numpy.asarray(new.sum(axis=0)).ravel()
+
+    def neighbors(self, product_id):
+        if product_id >= self.matrix.shape[0]:
+            return []
+        start, end = self.matrix.indptr[product_id], self.matrix.indptr[product_id + 1]
+        return self.matrix.indices[start:end].tolist()
+
+    def products(self):
+        return set(numpy.flatnonzero(numpy.diff(self.matrix.indptr)).tolist())
+
+    def top(self, product_id, k, allowed):
+        if product_id >= self.matrix.shape[0] or not self.counts[product_id]:
+            return []
+        start, end = self.matrix.indptr[product_id], self.matrix.indptr[product_id + 1]
+        columns = self.matrix.indices[start:end]
+        keep = numpy.fromiter((column in allowed for column in columns.tolist()), dtype=bool, count=len(columns))
+        keep &= self.counts[columns] > 0
+        columns = columns[keep]
+        scores = self.matrix.data[start:end][keep] / numpy.sqrt(self.counts[product_id] * self.counts[columns])
+        # Тот же порядок, что у словарной матрицы: оценка по убыванию, затем id
+        order = numpy.lexsort((columns, -scores))[:k]
+        return [(int(columns[index]), float(scores[index])) for index in order]
+
+    def to_arrays(self):
+        upper = sparse.triu(self.matrix, k=1).tocoo()
+        ids = numpy.flatnonzero(self.counts)
+        return upper.row.tolist(), upper.col.tolist(), upper.data.tolist(), ids.tolist(), self.counts[ids].tolist()
+
+
+# SciPy - если установлен, иначе словари
+Matrix = SparseCooccurrenceMatrix if sparse is not None else CooccurrenceMatrix
+
+
+def load_state(path, matrix_class=None):
+    """(матрица, отметка, время затухания) из файла или None, если файла нет"""
+    matrix_class = matrix_class or Matrix
+    try:
+        with open(path, 'rb') as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        return None
+    magic, version, watermark, decayed_ms, pairs, counts = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    offset = HEADER.size
+    sections = []
+    for typecode, count in (('q', pairs), ('q', pairs), ('d', pairs), ('q', counts), ('d', counts)):
+        values = array(typecode)
+        values.frombytes(data[offset:offset + count * values.itemsize])
+        offset += count * values.itemsize
+        sections.append(values)
+    decayed_at = datetime.fromtimestamp(decayed_ms / 1000, tz=dt_timezone.utc) if decayed_ms else None
+    return matrix_class.from_arrays(*sections), watermark, decayed_at
+
+
+def save_state(path, matrix, watermark, decayed_at):
+    pair_rows, pair_cols, pair_weights, count_ids, count_weights = matrix.to_arrays()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix='.recommendations-')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(HEADER.pack(
+                MAGIC, VERSION, watermark, int(decayed_at.timestamp() * 1000) if decayed_at else 0,
+                len(pair_rows), len(count_ids),
+            ))
+            for typecode, values in (
+                ('q', pair_rows), ('q', pair_cols), ('d', pair_weights), ('q', count_ids), ('d', count_weights),
+            ):
+                output.write(array(typecode, values).tobytes())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def add_cart_events(matrix, watermark, decayed_at):
+    """
+    Добавить к матрице строки CartItem с id больше watermark.
+    Возвращает (новая отметка, время затухания, затронутые продукты, событий).
+    """
+    chunk_size = get_setting('CHUNK_SIZE')
+    step = timedelta(hours=get_setting('DECAY_STEP_HOURS'))
+    prune = get_setting('PRUNE_WEIGHT')
+    touched, events = set(), 0
+    while True:
+        chunk = list(
+            CartItem.objects.filter(id__gt=watermark).order_by('id')
+            .values_list('id', 'client_id', 'product_id', 'created_at')[:chunk_size]
+        )
+        if not chunk:
+            return watermark, decayed_at, touched, events
+        # События пачки считаются одновременными: пачка не шире DECAY_STEP по времени
+        first_time = chunk[0][3]
+        chunk = chunk[:next(
+            (index for index, row in enumerate(chunk) if abs(row[3] - first_time) > step), len(chunk),
+        )]
+        chunk_time = max(row[3] for row in chunk)
+        matrix.decay(decay_factor(decayed_at, chunk_time), prune)
+        decayed_at = max(decayed_at, chunk_time) if decayed_at else chunk_time
+
+        new = defaultdict(list)
+        for _, client_id, product_id, _ in chunk:
+            new[client_id].append(product_id)
+        old = defaultdict(list)
+        for client_id, product_id in CartItem.objects.filter(
+            client_id__in=list(new), id__lte=watermark,
+        ).values_list('client_id', 'product_id'):
+            old[client_id].append(product_id)
+        matrix.add([(old[client_id], products) for client_id, products in new.items()])
+
+        touched.update(product_id for _, _, product_id, _ in chunk)
+        events += len(chunk)
+        watermark = chunk[-1][0]
+
+
+def save_recommendations(matrix, product_ids):
+    """Заменить списки рекомендаций продуктов product_ids лучшими TOP_K из матрицы"""
+    existing = set(Product.objects.values_list('id', flat=True))
+    top_k = get_setting('TOP_K')
+    product_ids = sorted(product_ids)
+    rows = [
+        ProductRecommendation(product_id=product_id, recommended_id=recommended_id, rank=rank, score=score)
+        for product_id in product_ids if product_id in existing
+        for rank, (recommended_id, score) in enumerate(matrix.top(product_id, top_k, existing))
+    ]
+    with transaction.atomic():
+        for start in range(0, len(product_ids), DELETE_BATCH):
+            ProductRecommendation.objects.filter(product_id__in=product_ids[start:start + DELETE_BATCH]).delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=DELETE_BATCH)
+    return len(rows)
+
+
+def build(full=False, path=None):
+    """
+    Обновить матрицу новыми добавлениями в корзины и пересчитать
+    рекомендации затронутых продуктов. Возвращает (событий, продуктов).
+    """
+    path = path or get_state_path()
+    state = None if full else load_state(path)
+    if state is None:
+        matrix, watermark, decayed_at = Matrix(), 0, None
+    else:
+        matrix, watermark, decayed_at = state
+
+    watermark, decayed_at, touched, events = add_cart_events(matrix, watermark, decayed_at)
+    if state is None:
+        affected = matrix.products()
+        # Полная пересборка: списки продуктов, выпавших из матрицы, тоже удаляются
+        affected.update(ProductRecommendation.objects.values_list('product_id', flat=True).distinct())
+    else:
+        # Изменилась популярность затронутых - меняются и оценки их соседей
+        affected = set(touched)
+        for product_id in touched:
+            affected.update(matrix.neighbors(product_id))
+
+    now = timezone.now()
+    matrix.decay(decay_factor(decayed_at, now), get_setting('PRUNE_WEIGHT'))
+    saved = save_recommendations(matrix, affected) if affected else 0
+    save_state(path, matrix, watermark, now if decayed_at else None)
+    logger.info('recommendations: %s cart events, %s products, %s rows', events, len(affected), saved)
+    return events, len(affected)
+
+
+def also_added(product_id):
+    """Проверенные продукты, которые добавляют вместе с product_id, в порядке оценки"""
+    return Product.objects.filter(
+        checked=True, recommended_for__product_id=product_id,
+    ).order_by('recommended_for__rank')
+
@@ -0,0 +1,141 @@
+"""
+Материализованные счетчики продуктов продавца (SellerStats).
+
+Счетчики меняются инкрементально на каждую запись продукта: из вклада
+продукта до изменения и после него считается дельта, которая применяется
+одним UPDATE ... SET field = field + delta. Массовые изменения
+(QuerySet.update, bulk_update, bulk_create) пересчитывают затронутых
+продавцов через refresh() в подписчике доменных событий seller-stats.
+Накопившиеся расхождения исправляет команда reconcile_seller_stats.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, Q, Sum
+
+from .models import Product, SellerStats
+
+# Порог "низкого остатка" - тот же, что показывает панель продавца
+LOW_STOCK_THRESHOLD = 10
+
+COUNTER_FIELDS = (
+    'total_products',
+    'checked_products',
+    'low_stock_products',
+    'out_of_stock_products',
+    'inventory_value',
+)
+
+# Поля продукта, от которых зависят счетчики
+STATE_FIELDS = ('seller_id', 'checked', 'stock', 'price')
+
+
+def product_state(instance):
+    """
+    Снимок полей продукта, влияющих на счетчики.
+    None, если какое-то поле отложено (.only()/.defer()) и вклад неизвестен.
+    """
+    if any(field not in instance.__dict__ for field in STATE_FIELDS):
+        return None
+    return {field: instance.__dict__[field] for field in STATE_FIELDS}
+
+
+def contribution(state):
+    """Вклад одного продукта в счетчики продавца"""
+    stock = state['stock'] or 0
+    return {
+        'total_products': 1,
+        'checked_products': int(bool(state['checked'])),
+        'low_stock_products': int(0 < stock <= LOW_STOCK_THRESHOLD),
+        'out_of_stock_products': int(stock == 0),
+        'inventory_value': Decimal(str(state['price'] or 0)) * stock,
+    }
+
+
+def apply_delta(seller_id, delta, create_missing=True):
+    """
+    Прибавить дельту к счетчикам продавца одним UPDATE.
+    Если строки счетчиков еще нет, она создается пересчетом (create_missing=True).
+    """
+    delta = {field: value for field, value in delta.items() if value}
+    if not delta:
+        return
+    updated = SellerStats.objects.filter(seller_id=seller_id).update(
+        **{field: F(field) + value for field, value in delta.items()}
+    )
+    if not updated and create_missing:
+        refresh([seller_id])
+
+
+def record_product_change(old_state, new_state):
+    """
+    Учесть изменение продукта: old_state - снимок до записи (None для нового),
+    new_state - после (None для удаленного).
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    if old_state is not None:
+        for field, value in contribution(old_state).items():
+            deltas[old_state['seller_id']][field] -= value
+    if new_state is not None:
+        for field, value in contribution(new_state).items():
+            deltas[new_state['seller_id']][field] += value
+    for seller_id, delta in deltas.items():
+        # Для удаленного продукта строку не создаем: продавец может удаляться каскадом
+        apply_delta(seller_id, delta, create_missing=new_state is not None)
+
+
+def aggregate_counters(seller_ids):
+    """Точные значения счетчиков по таблице продуктов: {seller_id: {поле: значение}}"""
+    rows = (
+        Product.objects.filter(seller_id__in=seller_ids)
+        .values('seller_id')
+        .annotate(
+            total=Count('id'),
+            checked_count=Count('id', filter=Q(checked=True)),
+            low=Count('id', filter=Q(stock__gt=0, stock__lte=LOW_STOCK_THRESHOLD)),
+            out=Count('id', filter=Q(stock=0)),
+            value=Sum(F('price') * F('stock'), output_field=DecimalField(max_digits=16, decimal_places=2)),
+        )
+        .order_by()
+    )
+    counters = {
+        seller_id: dict.fromkeys(COUNTER_FIELDS, 0) for seller_id in seller_ids
+    }
+    for row in rows:
+        counters[row['seller_id']] = {
+            'total_products': row['total'],
+            'checked_products': row['checked_count'],
+            'low_stock_products': row['low'],
+            'out_of_stock_products': row['out'],
+            'inventory_value': row['value'] or Decimal('0'),
+        }
+    return counters
+
+
+def refresh(seller_ids):
+    """Пересчитать счетчики продавцов одним агрегирующим запросом и одним upsert"""
+    seller_ids = list(set(seller_ids))
+    if not seller_ids:
+        return {}
+    counters = aggregate_counters(seller_ids)
+    save_counters(counters)
+    return counters
+
+
+def save_counters(counters):
+    """Записать счетчики {seller_id: {поле: значение}} одним upsert"""
+    SellerStats.objects.bulk_create(
+        [SellerStats(seller_id=seller_id, **values) for seller_id, values in counters.items()],
+        update_conflicts=True,
+        unique_fields=['seller'],
+        update_fields=[*COUNTER_FIELDS, 'updated_at'],
+    )
+
+
+def get_for_seller(seller):
+    """Строка счетчиков продавца; при отсутствии создается пересчетом"""
+    try:
+        return SellerStats.objects.get(seller=seller)
+    except SellerStats.DoesNotExist:
+        refresh([seller.pk])
+        return SellerStats.objects.get(seller=seller)
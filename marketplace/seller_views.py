@@ -2,10 +2,48 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_protect
-from django.db.models import Max
+from django.db.models import Max, Q
+from . import cards, seller_stats
 from .models import Seller, Product, ProductPhoto
 from .forms import ProductForm
 
+DASHBOARD_LIST_SIZE = 5
+
+
+def _dashboard_listings(seller):
+    """
+    Последние, заканчивающиеся и закончившиеся продукты продавца одним запросом.
+    Каждая секция - ограниченный подзапрос id; строки объединяются через OR,
+    а по секциям раскладываются в Python. Берутся только поля, которые выводит шаблон.
+    """
+    low_stock = Q(stock__gt=0, stock__lte=seller_stats.LOW_STOCK_THRESHOLD)
+    out_of_stock = Q(stock=0)
+    own = Product.objects.filter(seller=seller)
+    
+    def top_ids(queryset, ordering):
+        return queryset.order_by(ordering).values('id')[:DASHBOARD_LIST_SIZE]
+    
+    products = list(
+        own.filter(
+            Q(id__in=top_ids(own, '-created_at'))
+            | Q(id__in=top_ids(own.filter(low_stock), 'stock'))
+            | Q(id__in=top_ids(own.filter(out_of_stock), '-updated_at'))
+        ).only('id', 'title', 'price', 'stock', 'checked', 'created_at', 'updated_at').order_by()
+    )
+    # В выборке гарантированно есть первые DASHBOARD_LIST_SIZE каждой секции,
+    # лишние строки из других секций отсекаются сортировкой и срезом
+    return {
+        'recent': sorted(products, key=lambda p: p.created_at, reverse=True)[:DASHBOARD_LIST_SIZE],
+        'low_stock': sorted(
+            (p for p in products if 0 < p.stock <= seller_stats.LOW_STOCK_THRESHOLD),
+            key=lambda p: p.stock,
+        )[:DASHBOARD_LIST_SIZE],
+        'out_of_stock': sorted(
+            (p for p in products if p.stock == 0),
+            key=lambda p: p.updated_at, reverse=True,
+        )[:DASHBOARD_LIST_SIZE],
+    }
+
 
 @csrf_protect
 @require_http_methods(["GET"])
@@ -18,36 +56,19 @@ def seller_dashboard(request):
     try:
         seller = Seller.objects.get(id=request.session['seller_id'])
         
-        # Оптимизированные запросы
-        products_qs = Product.objects.filter(seller=seller)
-        
-        # Статистика
-        total_products = products_qs.count()
-        checked_products = products_qs.filter(checked=True).count()
-        unchecked_products = total_products - checked_products
-        
-        # Последние продукты
-        recent_products = products_qs.select_related('seller').prefetch_related('tags', 'product_photos').order_by('-created_at')[:5]
-        
-        # Продукты с низким остатком
-        low_stock_products = products_qs.filter(
-            stock__lte=10,
-            stock__gt=0
-        ).select_related('seller').prefetch_related('tags', 'product_photos').order_by('stock')[:5]
-        
-        # Продукты без остатка
-        out_of_stock_products = products_qs.filter(
-            stock=0
-        ).select_related('seller').prefetch_related('tags', 'product_photos')[:5]
+        # Статистика - одна строка материализованных счетчиков
+        stats = seller_stats.get_for_seller(seller)
+        listings = _dashboard_listings(seller)
         
         context = {
             'seller': seller,
-            'total_products': total_products,
-            'checked_products': checked_products,
-            'unchecked_products': unchecked_products,
-            'recent_products': recent_products,
-            'low_stock_products': low_stock_products,
-            'out_of_stock_products': out_of_stock_products,
+            'stats': stats,
+            'total_products': stats.total_products,
+            'checked_products': stats.checked_products,
+            'unchecked_products': stats.unchecked_products,
+            'recent_products': listings['recent'],
+            'low_stock_products': listings['low_stock'],
+            'out_of_stock_products': listings['out_of_stock'],
         }
         
         return render(request, 'marketplace/seller/dashboard.html', context)
@@ -78,7 +99,7 @@ def seller_products(request):
         
         context = {
             'seller': seller,
-            'products': products,
+            'cards': cards.product_cards(products),
             'status_filter': status_filter,
         }
         
@@ -157,7 +178,10 @@ def seller_product_edit(request, product_id):
             form = ProductForm(request.POST, request.FILES, instance=product)
             if form.is_valid():
                 product = form.save(commit=False)
-                # checked не изменяется через форму
+                # checked не изменяется через форму;
+                # отклоненный продукт после правки возвращается в очередь модерации
+                if not product.checked:
+                    product.moderated_at = None
                 product.save()
                 form.save_m2m()  # Сохраняем теги
                 
@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from .models import Product, Tag, Seller, Client
+from django.utils.crypto import get_random_string
+from . import passwords, seller_stats, webhooks
+from .models import Product, Tag, Seller, Client, SellerStats, WebhookEndpoint
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -176,10 +178,8 @@ class SellerRegistrationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data.pop('password_confirm')
         password = validated_data.pop('password')
-        seller = Seller.objects.create(**validated_data)
-        seller.set_password(password)
-        seller.save()
-        return seller
+        # Один INSERT с уже посчитанным хешем
+        return Seller.objects.create(password=passwords.hash_password(password), **validated_data)
 
 
 class ClientRegistrationSerializer(serializers.ModelSerializer):
@@ -227,10 +227,8 @@ class ClientRegistrationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data.pop('password_confirm')
         password = validated_data.pop('password')
-        client = Client.objects.create(**validated_data)
-        client.set_password(password)
-        client.save()
-        return client
+        # Один INSERT с уже посчитанным хешем
+        return Client.objects.create(password=passwords.hash_password(password), **validated_data)
 
 
 class SellerSerializer(serializers.ModelSerializer):
@@ -246,7 +244,11 @@ class SellerSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'date_joined']
     
     def get_products_count(self, obj):
-        return obj.products.count()
+        # Материализованный счетчик вместо COUNT(*) на каждую сериализацию
+        try:
+            return obj.stats.total_products
+        except SellerStats.DoesNotExist:
+            return seller_stats.get_for_seller(obj).total_products
 
 
 class ClientSerializer(serializers.ModelSerializer):
@@ -259,3 +261,39 @@ class ClientSerializer(serializers.ModelSerializer):
             'phone', 'date_joined'
         ]
         read_only_fields = ['id', 'date_joined']
+
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    """Сериализатор адреса вебхука продавца; секрет подписи выдается сервером"""
+    events = serializers.MultipleChoiceField(choices=WebhookEndpoint.EVENT_CHOICES)
+    
+    class Meta:
+        model = WebhookEndpoint
+        fields = ['id', 'url', 'events', 'is_active', 'secret', 'created_at']
+        read_only_fields = ['id', 'secret', 'created_at']
+    
+    def validate_url(self, value):
+        try:
+            webhooks.check_url(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+    
+    def validate_events(self, value):
+        if not value:
+            raise serializers.ValidationError("Выберите хотя бы одно событие")
+        return sorted(value)
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['events'] = sorted(data['events'])
+        return data
+    
+    def create(self, validated_data):
+        seller = self.context['request'].user
+        limit = webhooks.get_setting('MAX_ENDPOINTS')
+        if WebhookEndpoint.objects.filter(seller=seller).count() >= limit:
+            raise serializers.ValidationError(f"Не больше {limit} адресов вебхуков")
+        validated_data['seller'] = seller
+        validated_data['secret'] = get_random_string(48)
+        return super().create(validated_data)
@@ -0,0 +1,227 @@
+"""
+Хранилище сессий: кеш, затем БД, с отложенной записью.
+
+SESSION_ENGINE = 'marketplace.sessions'. Сессия читается из кеша
+SESSION_CACHE_ALIAS и только при промахе из таблицы django_session, так
+что base.html с client_name/seller_company не ходит в БД на каждой
+странице. Запись новой сессии (create, смена ключа при входе) идет в БД
+сразу - уникальность ключа проверяет INSERT. Изменения существующей
+сессии сразу попадают в кеш, а в БД - после ответа (сигнал
+request_finished) одним UPDATE на все накопленные сессии процесса. С
+WRITE_BEHIND_SECONDS > 0 запись идет не чаще раза в этот интервал.
+Отложенная запись только обновляет существующие строки: сессию, которую
+успели удалить (выход в другом процессе), она не восстанавливает, а
+убирает из кеша.
+
+Сессия записывается, только если изменилось ее содержимое (сравниваются
+сериализованные данные) или до истечения срока осталось меньше
+REFRESH_RATIO его длины. Присваивание тех же значений при каждом входе и
+modified=True без изменений ничего не пишут.
+
+clear_expired (manage.py clearsessions) удаляет просроченные строки
+пачками по CLEAR_CHUNK_SIZE с паузой CLEAR_PAUSE между ними, чтобы не
+держать длинных блокировок таблицы.
+
+Свежие данные до записи в БД есть только в кеше, поэтому он должен быть
+общим для процессов (Redis). С кешем отдельного процесса (LocMem) сессии
+читаются из БД и записываются в нее сразу: данные в нем могли устареть
+после записи другим процессом.
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends import db
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import request_finished
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger('marketplace.sessions')
+
+DEFAULTS = {
+    'WRITE_BEHIND_SECONDS': 0,
+    # При таком числе отложенных сессий запись идет сразу после ответа
+    'MAX_PENDING': 500,
+    'REFRESH_RATIO': 0.5,
+    'CLEAR_CHUNK_SIZE': 1000,
+    'CLEAR_PAUSE': 0.05,
+}
+
+KEY_PREFIX = 'marketplace.sessions.'
+
+# Отложенные записи процесса: ключ сессии -> (данные для кеша, session_data, expire_date)
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def get_setting(name):
+    return getattr(settings, 'SESSION_STORE', {}).get(name, DEFAULTS[name])
+
+
+def _cache():
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def is_shared():
+    """Кеш сессий виден всем процессам; LocMem у каждого процесса свой"""
+    return not isinstance(_cache(), LocMemCache)
+
+
+class SessionStore(db.SessionStore):
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # (сериализованные данные, срок в секундах эпохи) в том виде, как они сохранены
+        self._stored = None
+
+    @property
+    def cache_key(self):
+        return KEY_PREFIX + self._get_or_create_session_key()
+
+    def _remember(self, payload, expires):
+        self._stored = (payload, expires)
+        if is_shared():
+            _cache().set(self.cache_key, self._stored, max(1, int(expires - time.time())))
+
+    def load(self):
+        record = None
+        if self.session_key is not None and is_shared():
+            record = _cache().get(KEY_PREFIX + self.session_key)
+            if record is None and self.session_key in _pending:
+                record = _pending[self.session_key][0]
+        if record is None:
+            session = self._get_session_from_db()
+            if session is None:
+                return {}
+            data = self.decode(session.session_data)
+            self._remember(self.serializer().dumps(data), session.expire_date.timestamp())
+            return data
+        payload, expires = record
+        if expires <= time.time():
+            self._session_key = None
+            return {}
+        self._stored = record
+        return self.serializer().loads(payload)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        payload = self.serializer().dumps(data)
+        expire_date = self.get_expiry_date()
+        expires = expire_date.timestamp()
+        if not must_create and self._stored is not None and payload == self._stored[0]:
+            left = self._stored[1] - time.time()
+            if left > self.get_expiry_age() * get_setting('REFRESH_RATIO'):
+                return
+        if must_create or not is_shared():
+            # Без общего кеша отложенную запись другие процессы не увидят
+            super().save(must_create=must_create)
+        else:
+            _defer(self.session_key, (payload, expires), self.encode(data), expire_date)
+        self._remember(payload, expires)
+
+    def exists(self, session_key):
+        return (
+            is_shared() and _cache().get(KEY_PREFIX + session_key) is not None
+            or session_key in _pending
+            or super().exists(session_key)
+        )
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        with _pending_lock:
+            _pending.pop(session_key, None)
+        _cache().delete(KEY_PREFIX + session_key)
+        super().delete(session_key)
+
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create)
+
+    async def aexists(self, session_key):
+        return await sync_to_async(self.exists)(session_key)
+
+    async def adelete(self, session_key=None):
+        return await sync_to_async(self.delete)(session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        model = cls.get_model_class()
+        chunk_size = get_setting('CLEAR_CHUNK_SIZE')
+        pause = get_setting('CLEAR_PAUSE')
+        now = timezone.now()
+        deleted = 0
+        while True:
+            # Каждая пачка - отдельный короткий DELETE по первичному ключу
+            keys = list(
+                model.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:chunk_size]
+            )
+            if not keys:
+                break
+            deleted += model.objects.filter(session_key__in=keys).delete()[0]
+            if len(keys) < chunk_size:
+                break
+            time.sleep(pause)
+        logger.info('deleted %d expired sessions', deleted)
+        return deleted
+
+
+def _defer(session_key, record, session_data, expire_date):
+    with _pending_lock:
+        _pending[session_key] = (record, session_data, expire_date)
+
+
+def write_pending():
+    """
+    Записывает отложенные сессии процесса в БД одним UPDATE. Сессии, строк
+    которых уже нет (удалены при выходе), убираются из кеша, а не вставляются заново.
+    """
+    global _last_flush
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not batch:
+        return 0
+    model = SessionStore.get_model_class()
+    try:
+        updated = model.objects.bulk_update(
+            [
+                model(session_key=key, session_data=session_data, expire_date=expire_date)
+                for key, (record, session_data, expire_date) in batch.items()
+            ],
+            ['session_data', 'expire_date'],
+            batch_size=500,
+        )
+        if updated < len(batch):
+            existing = set(model.objects.filter(session_key__in=list(batch)).values_list('session_key', flat=True))
+            _cache().delete_many([KEY_PREFIX + key for key in batch if key not in existing])
+    except Exception:
+        logger.exception('failed to write %d sessions', len(batch))
+        with _pending_lock:
+            for key, entry in batch.items():
+                _pending.setdefault(key, entry)
+        return 0
+    return updated
+
+
+@receiver(request_finished)
+def _flush_after_response(**kwargs):
+    if not _pending:
+        return
+    if (
+        len(_pending) >= get_setting('MAX_PENDING')
+        or time.monotonic() - _last_flush >= get_setting('WRITE_BEHIND_SECONDS')
+    ):
+        write_pending()
@@ -0,0 +1,252 @@
+"""
+Обработчики сигналов моделей маркетплейса.
+Подключаются в MarketplaceConfig.ready().
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import events, live, metrics, page_cache, seller_stats, tasks, webhooks
+from .models import CartItem, Product, ProductPhoto, Seller, Tag, WebhookEndpoint
+
+# Поля продукта, изменения которых отслеживаются между загрузкой и сохранением
+TRACKED_PRODUCT_FIELDS = ('stock', 'price')
+
+# Захват на модерацию не меняет витрину
+MODERATION_CLAIM_FIELDS = ('moderation_claimed_by', 'moderation_claimed_until')
+
+
+def get_tracked_changes(instance):
+    """
+    Вернуть словарь {поле: новое значение} для отслеживаемых полей,
+    изменившихся с момента загрузки экземпляра из БД.
+    """
+    loaded = getattr(instance, '_loaded_state', None) or {}
+    changes = {}
+    for field in TRACKED_PRODUCT_FIELDS:
+        value = instance.__dict__.get(field)
+        if field in loaded and loaded[field] == value:
+            continue
+        changes[field] = value
+    return changes
+
+
+@receiver(post_init, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    # Берем значения из __dict__, чтобы не загружать отложенные (.only()) поля
+    instance._loaded_state = {
+        field: instance.__dict__[field]
+        for field in TRACKED_PRODUCT_FIELDS
+        if field in instance.__dict__
+    } if instance.pk else {}
+    instance._stats_state = seller_stats.product_state(instance) if instance.pk else None
+    instance._loaded_thumbnail = _file_name(instance.__dict__.get('thumbnail')) if instance.pk else None
+    instance._loaded_checked = instance.__dict__.get('checked') if instance.pk else None
+
+
+def _file_name(value):
+    # До первого обращения в __dict__ лежит строка, после - FieldFile
+    return getattr(value, 'name', value) or None
+
+
+@receiver(post_save, sender=Product)
+def handle_product_changes(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_loaded_state', None) or {}
+    changes = get_tracked_changes(instance)
+    instance._loaded_state = {field: instance.__dict__.get(field) for field in TRACKED_PRODUCT_FIELDS}
+    if created or not changes:
+        return
+    if changes.get('stock') == 0 and previous.get('stock'):
+        metrics.stock_out_events.inc()
+    if 'stock' in changes:
+        webhooks.product_stock_changed(instance, previous.get('stock'))
+    if not instance.checked:
+        # Непроверенный продукт не виден на витрине: его остаток и цену не транслируем
+        return
+    if 'price' in changes:
+        changes['price'] = str(changes['price'])
+    transaction.on_commit(lambda: live.publish_product_change(instance.pk, changes))
+
+
+@receiver(post_save, sender=Product)
+def update_seller_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new_state = seller_stats.product_state(instance)
+    old_state = None if created else getattr(instance, '_stats_state', None)
+    if not created and old_state is None:
+        # Продукт загружен с отложенными полями: прежний вклад неизвестен
+        seller_stats.refresh([instance.seller_id])
+    else:
+        seller_stats.record_product_change(old_state, new_state)
+    instance._stats_state = new_state
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_seller_stats(sender, instance, **kwargs):
+    state = getattr(instance, '_stats_state', None) or seller_stats.product_state(instance)
+    if state is not None:
+        seller_stats.record_product_change(state, None)
+
+
+@receiver(post_save, sender=Product)
+def schedule_thumbnail_processing(sender, instance, created, raw=False, **kwargs):
+    if raw or 'thumbnail' not in instance.__dict__:
+        return
+    name = _file_name(instance.__dict__['thumbnail'])
+    if name and name != getattr(instance, '_loaded_thumbnail', None):
+        tasks.schedule_image_processing(instance.pk)
+    instance._loaded_thumbnail = name
+
+
+@receiver(post_save, sender=Product)
+def emit_product_approved_webhook(sender, instance, created, raw=False, **kwargs):
+    # Одобрение из формы админки; пакетная модерация пишет события сама
+    if raw or 'checked' not in instance.__dict__:
+        return
+    if instance.checked and getattr(instance, '_loaded_checked', None) is False:
+        webhooks.products_approved([(instance.pk, instance.seller_id)])
+    instance._loaded_checked = instance.checked
+
+
+@receiver(post_save, sender=ProductPhoto)
+def schedule_photo_processing(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        tasks.schedule_image_processing(instance.product_id)
+
+
+@receiver(post_save, sender=Seller)
+@receiver(post_delete, sender=Seller)
+def rebuild_suggest_after_seller_change(sender, raw=False, update_fields=None, **kwargs):
+    # Вход продавца сохраняет только last_login - название компании не меняется
+    if raw or (update_fields is not None and 'company_name' not in update_fields):
+        return
+    transaction.on_commit(tasks.schedule_search_suggest_rebuild)
+
+
+@receiver(post_save, sender=CartItem)
+def emit_cart_added_webhook(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        webhooks.cart_item_added(instance)
+
+
+@receiver(webhooks.events_queued)
+def schedule_webhook_delivery(sender, **kwargs):
+    # Сигнал отправляется уже после коммита
+    tasks.schedule_webhook_delivery()
+
+
+@receiver(post_save, sender=WebhookEndpoint)
+@receiver(post_delete, sender=WebhookEndpoint)
+def forget_webhook_endpoints(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Сразу - для текущего процесса, после коммита - чтобы другие не закешировали старый список
+    webhooks.forget_endpoints(instance.seller_id)
+    transaction.on_commit(lambda: webhooks.forget_endpoints(instance.seller_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductPhoto)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=CartItem)
+def record_saved(sender, instance, created, raw=False, update_fields=None, using=None, **kwargs):
+    if raw:
+        return
+    if created:
+        events.record(sender, events.CREATED, [instance.pk], using=using)
+    else:
+        events.record(sender, events.UPDATED, [instance.pk], update_fields or (), using=using)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductPhoto)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=CartItem)
+def record_deleted(sender, instance, using=None, **kwargs):
+    events.record_deleted(sender, instance.pk, using=using)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def record_tags_changed(sender, instance, action, reverse, pk_set, using=None, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        events.record(Product, events.UPDATED, [instance.pk], ['tags'], using=using)
+    elif pk_set:
+        events.record(Product, events.UPDATED, sorted(pk_set), ['tags'], using=using)
+    else:
+        # tag.products.clear(): какие продукты потеряли тег, уже неизвестно
+        events.record(Tag, events.UPDATED, [instance.pk], ['products'], using=using)
+
+
+@receiver(events.events_recorded)
+def schedule_event_dispatch(sender, **kwargs):
+    # Сигнал отправляется уже после коммита
+    tasks.schedule_event_dispatch()
+
+
+CATALOG_MODELS = ('product', 'productphoto', 'tag')
+
+
+def _catalog_changed(batch):
+    return any(batch.ids(model, ignore_fields=MODERATION_CLAIM_FIELDS) for model in CATALOG_MODELS)
+
+
+@events.subscriber('page-cache', models=CATALOG_MODELS, local=True)
+def invalidate_page_cache(batch):
+    # Сразу после коммита в пишущем процессе: витрина не должна отдавать старые страницы
+    if not _catalog_changed(batch):
+        return
+    photo_ids = batch.ids('productphoto')
+    photo_products = dict(ProductPhoto.objects.filter(id__in=photo_ids).values_list('id', 'product_id'))
+    if batch.ids('tag') or len(photo_products) < len(photo_ids):
+        # Теги показываются на многих страницах, а продукт удаленной фотографии уже неизвестен
+        page_cache.invalidate()
+        return
+    page_cache.invalidate(
+        batch.ids('product', ignore_fields=MODERATION_CLAIM_FIELDS) | set(photo_products.values())
+    )
+
+
+# Поля продукта в событиях outbox, от которых зависят счетчики продавца
+SELLER_STATS_FIELDS = {'seller', 'seller_id', 'checked', 'stock', 'price'}
+
+
+@events.subscriber('seller-stats', models=('product',))
+def refresh_seller_stats(batch):
+    # Сохранения объектов (поля события неизвестны) учитывает update_seller_stats;
+    # здесь - QuerySet.update, bulk_update и bulk_create, которые сигналов не шлют.
+    # Прежнего продавца при массовой смене seller исправит reconcile_seller_stats
+    ids = {
+        pk
+        for pk, change in batch.changes('product').items()
+        if events.CREATED in change.actions or change.fields and change.fields & SELLER_STATS_FIELDS
+    }
+    if ids:
+        seller_stats.refresh(Product.objects.filter(id__in=ids).values_list('seller_id', flat=True).distinct())
+
+
+@events.subscriber('page-cache-warm', models=CATALOG_MODELS)
+def warm_page_cache(batch):
+    if _catalog_changed(batch):
+        tasks.schedule_page_cache_warming()
+
+
+@events.subscriber('search-suggest', models=CATALOG_MODELS)
+def rebuild_search_suggest(batch):
+    if _catalog_changed(batch):
+        tasks.schedule_search_suggest_rebuild()
+
+
+@events.subscriber('feeds', models=CATALOG_MODELS)
+def rebuild_feeds(batch):
+    if _catalog_changed(batch):
+        tasks.schedule_feeds_rebuild()
+
+
+@events.subscriber('recommendations', models=('cartitem',))
+def rebuild_recommendations(batch):
+    # Рекомендации строятся по новым строкам корзин; изменение количества не в счет
+    if batch.ids('cartitem', actions=[events.CREATED]):
+        tasks.schedule_recommendations_rebuild()
@@ -0,0 +1,163 @@
+"""
+Статика с хешированными именами, предсжатыми вариантами и раздачей из процесса.
+
+CompressedManifestStaticFilesStorage при collectstatic пишет файлы с хешем
+содержимого в имени (style.3f2a9c1b7e4d.css) и рядом - .gz, а если
+установлены пакеты Brotli и zstandard, то и .br/.zst (см. marketplace.compression).
+StaticFilesMiddleware раздает STATIC_ROOT без веб-сервера перед
+приложением: индекс файлов строится один раз при старте, вариант
+выбирается по Accept-Encoding, файл отдается через
+FileResponse (wsgi.file_wrapper/sendfile - без копирования в Python).
+Файлы с хешем в имени кешируются браузером навсегда (immutable).
+"""
+import mimetypes
+import os
+from email.utils import formatdate
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from . import compression
+
+# Форматы, которые имеет смысл сжимать; изображения и архивы уже сжаты
+COMPRESSIBLE_EXTENSIONS = frozenset({
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+    '.ttf', '.otf', '.eot', '.ico',
+})
+# Вариант сохраняется, только если он меньше оригинала хотя бы на 5%
+MIN_COMPRESSION_RATIO = 0.95
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DEFAULT_MAX_AGE = 60
+
+# Предпочтение кодировок при согласовании: (кодировка, расширение файла, уровень сжатия).
+# Сжатие выполняется один раз при сборке, поэтому уровни максимальные
+ENCODINGS = [('br', '.br', 11), ('zstd', '.zst', 19), ('gzip', '.gz', 9)]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Манифест с хешами имен плюс .gz/.br-варианты сжимаемых файлов"""
+
+    def url(self, name, force=False):
+        # Без collectstatic (разработка, тесты) манифеста нет - ссылки на исходные имена
+        if not self.hashed_files and not force:
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        # Манифест уже сохранен: сжимаем и исходные, и хешированные имена
+        for name in paths:
+            for variant in {name, self.stored_name(name)}:
+                self.compress(variant)
+
+    def compress(self, name):
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return
+        with self.open(name) as handle:
+            data = handle.read()
+        for encoding, suffix, level in ENCODINGS:
+            if encoding not in compression.CODECS:
+                continue
+            compressed = compression.compress(encoding, data, level)
+            if len(compressed) < len(data) * MIN_COMPRESSION_RATIO:
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+
+
+class StaticFile:
+    """Файл из STATIC_ROOT с предсжатыми вариантами и готовыми заголовками"""
+
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        self.path = path
+        content_type, file_encoding = mimetypes.guess_type(path)
+        # Архив (sitemap.xml.gz) отдается как есть, а не как сжатый text/xml
+        self.content_type = 'application/gzip' if file_encoding == 'gzip' else content_type or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'image/svg+xml'):
+            self.content_type += '; charset=utf-8'
+        self.etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.cache_control = (
+            f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if immutable else f'public, max-age={DEFAULT_MAX_AGE}'
+        )
+        self.variants = [
+            (encoding, path + suffix) for encoding, suffix, _ in ENCODINGS if os.path.exists(path + suffix)
+        ]
+
+    def choose(self, accepted):
+        for encoding, path in self.variants:
+            if encoding in accepted or '*' in accepted:
+                return encoding, path
+        return None, self.path
+
+
+class StaticFilesMiddleware:
+    """
+    Раздача собранной статики из процесса (см. модуль). Ставится сразу
+    после SecurityMiddleware. В DEBUG и без STATIC_ROOT отключается -
+    тогда статику отдает runserver из STATICFILES_DIRS.
+    """
+
+    def __init__(self, get_response):
+        root = getattr(settings, 'STATIC_ROOT', None)
+        if settings.DEBUG or not root or not os.path.isdir(root) or not settings.STATIC_URL:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = '/' + settings.STATIC_URL.strip('/') + '/'
+        self.files = self.scan(str(root))
+
+    @staticmethod
+    def scan(root):
+        storage = CompressedManifestStaticFilesStorage(location=root)
+        hashed = set(storage.hashed_files.values())
+        suffixes = tuple(suffix for _, suffix, _ in ENCODINGS)
+        files = {}
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.endswith(suffixes) and os.path.exists(path[:path.rindex('.')]):
+                    continue  # сжатый вариант - отдается вместе с оригиналом
+                relative = os.path.relpath(path, root).replace(os.sep, '/')
+                files[relative] = StaticFile(path, relative in hashed)
+        return files
+
+    def __call__(self, request):
+        if not request.path_info.startswith(self.prefix):
+            return self.get_response(request)
+        static_file = self.files.get(request.path_info[len(self.prefix):])
+        if static_file is None:
+            return self.get_response(request)
+        if request.method not in ('GET', 'HEAD'):
+            response = HttpResponse(status=405)
+            response['Allow'] = 'GET, HEAD'
+            return response
+        return self.serve(request, static_file)
+
+    def serve(self, request, static_file):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (static_file.etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponseNotModified()
+        else:
+            accepted = compression.parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            encoding, path = static_file.choose(accepted)
+            if request.method == 'HEAD':
+                response = HttpResponse(content_type=static_file.content_type)
+                response['Content-Length'] = os.path.getsize(path)
+            else:
+                response = FileResponse(open(path, 'rb'), content_type=static_file.content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = static_file.etag
+        response['Last-Modified'] = static_file.last_modified
+        response['Cache-Control'] = static_file.cache_control
+        if static_file.variants:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
@@ -0,0 +1,399 @@
+"""
+Подсказки поиска по префиксу: названия продуктов, теги и компании продавцов.
+
+Индекс - файл-снимок из отсортированных массивов (build), который каждый
+процесс открывает через mmap (SuggestIndex): страницы файла общие для
+всех воркеров в page cache ОС, память на процесс не дублируется. Ключи -
+нормализованные строки (нижний регистр, ё -> е, слова через пробел) для
+каждого суффикса названия по словам, поэтому "pro" находит и
+"iPhone 15 Pro". Поиск - два бинарных поиска по ключам; для "тяжелых"
+префиксов (больше SCAN_LIMIT ключей) лучшие K записей по популярности
+посчитаны при сборке, остальные диапазоны ранжируются на лету.
+
+Популярность: продукт - число строк в корзинах, тег - число проверенных
+продуктов с ним, продавец - число проверенных продуктов (SellerStats).
+
+Снимок пересобирается задачей rebuild_search_suggest после изменений
+каталога: записи продуктов берутся из прежнего снимка, из БД читаются
+только продукты с updated_at после его сборки. Полная пересборка с
+обновлением популярности - manage.py build_search_suggest --full.
+Новый файл записывается рядом и подменяется через os.replace - читатели
+старого снимка дочитывают его без блокировок.
+"""
+import heapq
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics
+from .cards import object_url
+from .models import CartItem, Product, Seller, SellerStats, Tag
+
+logger = logging.getLogger('marketplace.tasks')
+
+DEFAULTS = {
+    # По умолчанию - var/search_suggest.idx в BASE_DIR
+    'PATH': None,
+    # Сколько подсказок хранится для тяжелых префиксов и максимум в ответе
+    'TOP_K': 10,
+    # Диапазоны ключей не длиннее этого ранжируются при запросе
+    'SCAN_LIMIT': 256,
+    # Суффиксы названия начинаются не более чем с MAX_WORDS первых слов
+    'MAX_WORDS': 8,
+    'MAX_QUERY_LENGTH': 64,
+    # Cache-Control ответа: подсказки для префикса редко меняются
+    'MAX_AGE': 60,
+    # Как часто процесс проверяет, не заменен ли файл снимка
+    'RELOAD_INTERVAL': 2.0,
+    'REBUILD_DELAY': 15,
+    # Перекрытие окна updated_at: транзакция могла закоммититься позже сборки
+    'REBUILD_OVERLAP': 60,
+}
+
+MAGIC = b'MSUG'
+VERSION = 1
+# magic, версия, K, записей, ключей, тяжелых префиксов, байт строк, время сборки (мс)
+HEADER = struct.Struct('<4sHHIIIIQ')
+NO_ENTRY = 0xFFFFFFFF
+
+PRODUCT, TAG, SELLER = 0, 1, 2
+KINDS = {PRODUCT: 'product', TAG: 'tag', SELLER: 'seller'}
+
+WORD = re.compile(r'\w+')
+
+suggest_duration = metrics.Histogram(
+    'marketplace_search_suggest_seconds',
+    'Время поиска подсказок по индексу',
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'SEARCH_SUGGEST', {}).get(name, DEFAULTS[name])
+
+
+def get_path():
+    return str(get_setting('PATH') or Path(settings.BASE_DIR) / 'var' / 'search_suggest.idx')
+
+
+def normalize(text):
+    """Слова в нижнем регистре через один пробел; ё приравнивается к е"""
+    return ' '.join(WORD.findall(text.casefold().replace('ё', 'е')))
+
+
+def entry_keys(text, max_words):
+    words = normalize(text).split(' ')
+    return {' '.join(words[start:]) for start in range(min(len(words), max_words)) if words[start]}
+
+
+def _array(values):
+    # Нативный порядок байт: снимок читается на той же машине через memoryview.cast('I')
+    return struct.pack(f'={len(values)}I', *values)
+
+
+class Entry:
+    __slots__ = ('kind', 'object_id', 'weight', 'text')
+
+    def __init__(self, kind, object_id, weight, text):
+        self.kind = kind
+        self.object_id = object_id
+        self.weight = weight
+        self.text = text
+
+    def rank(self):
+        # Популярные выше; при равенстве - короче и по алфавиту
+        return (-self.weight, len(self.text), self.text)
+
+
+def _heavy_prefixes(keys, rank_of, scan_limit, top_k):
+    """
+    Префиксы, под которые попадает больше scan_limit ключей, и лучшие
+    top_k записей для каждого: [(префикс, [номер записи, ...]), ...]
+    """
+    heavy = []
+    ranges = [(0, len(keys))] if len(keys) > scan_limit else []
+    length = 1
+    while ranges:
+        next_ranges = []
+        for lo, hi in ranges:
+            start = lo
+            while start < hi:
+                if len(keys[start][0]) < length:
+                    start += 1
+                    continue
+                prefix = keys[start][0][:length]
+                end = start + 1
+                while end < hi and keys[end][0].startswith(prefix):
+                    end += 1
+                if end - start > scan_limit:
+                    entries = {entry for _, entry in keys[start:end]}
+                    heavy.append((prefix, heapq.nsmallest(top_k, entries, key=rank_of)))
+                    next_ranges.append((start, end))
+                start = end
+        ranges = next_ranges
+        length += 1
+    heavy.sort()
+    return heavy
+
+
+def write_snapshot(path, entries, built_at, top_k=None, scan_limit=None, max_words=None):
+    """Записать снимок индекса для списка Entry атомарной заменой файла"""
+    top_k = top_k or get_setting('TOP_K')
+    scan_limit = scan_limit or get_setting('SCAN_LIMIT')
+    max_words = max_words or get_setting('MAX_WORDS')
+
+    blob = bytearray()
+
+    def add_string(value):
+        offset = len(blob)
+        blob.extend(value)
+        return offset, len(value)
+
+    entry_text = [add_string(entry.text.encode()) for entry in entries]
+    keys = sorted(
+        (key.encode(), index)
+        for index, entry in enumerate(entries)
+        for key in entry_keys(entry.text, max_words)
+    )
+    ranks = [entry.rank() for entry in entries]
+    heavy = _heavy_prefixes(keys, ranks.__getitem__, scan_limit, top_k)
+    key_strings = [add_string(key) for key, _ in keys]
+    # Префиксы тяжелых диапазонов режутся по байтам и могут обрываться посреди символа
+    heavy_strings = [add_string(prefix) for prefix, _ in heavy]
+    heavy_top = []
+    for _, top in heavy:
+        heavy_top.extend(top + [NO_ENTRY] * (top_k - len(top)))
+
+    sections = [
+        [entry.kind for entry in entries],
+        [entry.object_id for entry in entries],
+        [min(int(entry.weight), NO_ENTRY - 1) for entry in entries],
+        [offset for offset, _ in entry_text],
+        [length for _, length in entry_text],
+        [offset for offset, _ in key_strings],
+        [length for _, length in key_strings],
+        [entry for _, entry in keys],
+        [offset for offset, _ in heavy_strings],
+        [length for _, length in heavy_strings],
+        heavy_top,
+    ]
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix='.suggest-')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(HEADER.pack(
+                MAGIC, VERSION, top_k, len(entries), len(keys), len(heavy), len(blob),
+                int(built_at.timestamp() * 1000),
+            ))
+            for values in sections:
+                output.write(_array(values))
+            output.write(blob)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(entries), len(keys), len(heavy)
+
+
+class SuggestIndex:
+    """Снимок индекса, открытый через mmap; массивы - memoryview без копирования"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            stat = os.fstat(handle.fileno())
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, version, self.top_k, entries, keys, heavy, blob_size, built_ms = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path}: неизвестный формат снимка подсказок')
+        self.built_at = datetime.fromtimestamp(built_ms / 1000, tz=dt_timezone.utc)
+        self.entry_count, self.key_count, self.heavy_count = entries, keys, heavy
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+
+        def take(count):
+            nonlocal offset
+            array = view[offset:offset + count * 4].cast('I')
+            offset += count * 4
+            return array
+
+        (self.kinds, self.object_ids, self.weights, self.text_offsets, self.text_lengths) = (
+            take(entries) for _ in range(5)
+        )
+        self.key_offsets, self.key_lengths, self.key_entries = (take(keys) for _ in range(3))
+        self.heavy_offsets, self.heavy_lengths = take(heavy), take(heavy)
+        self.heavy_top = take(heavy * self.top_k)
+        self.blob = view[offset:offset + blob_size]
+
+    def _bytes(self, offset, length):
+        return self.blob[offset:offset + length].tobytes()
+
+    def key(self, index):
+        return self._bytes(self.key_offsets[index], self.key_lengths[index])
+
+    def text(self, entry):
+        return self._bytes(self.text_offsets[entry], self.text_lengths[entry]).decode()
+
+    def entry(self, index):
+        return Entry(self.kinds[index], self.object_ids[index], self.weights[index], self.text(index))
+
+    def entries(self):
+        return [self.entry(index) for index in range(self.entry_count)]
+
+    def _bisect(self, count, getter, value):
+        lo, hi = 0, count
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if getter(middle) < value:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def heavy_prefix(self, index):
+        return self._bytes(self.heavy_offsets[index], self.heavy_lengths[index])
+
+    def search(self, query, limit):
+        """Номера лучших записей для префикса query (уже нормализованного)"""
+        prefix = query.encode()
+        # Байт 0xFF не встречается в UTF-8: все ключи с префиксом меньше prefix + 0xFF
+        lo = self._bisect(self.key_count, self.key, prefix)
+        hi = self._bisect(self.key_count, self.key, prefix + b'\xff')
+        if hi - lo > get_setting('SCAN_LIMIT'):
+            heavy = self._bisect(self.heavy_count, self.heavy_prefix, prefix)
+            if heavy < self.heavy_count and self.heavy_prefix(heavy) == prefix:
+                start = heavy * self.top_k
+                return [entry for entry in self.heavy_top[start:start + limit] if entry != NO_ENTRY]
+            # Снимок собран с меньшим SCAN_LIMIT - ранжируем весь диапазон
+        candidates = {self.key_entries[index] for index in range(lo, hi)}
+        return heapq.nsmallest(limit, candidates, key=lambda entry: self.entry(entry).rank())
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'checked': 0.0}
+
+
+def get_index():
+    """Текущий снимок процесса; замена файла замечается не реже RELOAD_INTERVAL"""
+    now = time.monotonic()
+    index = _state['index']
+    if index is not None and now - _state['checked'] < get_setting('RELOAD_INTERVAL'):
+        return index
+    with _lock:
+        _state['checked'] = now
+        path = get_path()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _state['index'] = None
+            return None
+        if index is None or index.identity != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            _state['index'] = SuggestIndex(path)
+        return _state['index']
+
+
+def reset():
+    with _lock:
+        _state.update(index=None, checked=0.0)
+
+
+def result_url(kind, object_id):
+    if kind == PRODUCT:
+        return object_url('product_detail', object_id)
+    if kind == TAG:
+        return f"{reverse('catalog')}?{urlencode({'tags': object_id})}"
+    return None
+
+
+def suggest(query, limit=None):
+    """Подсказки для введенной строки: [{'type', 'id', 'title', 'url'}, ...]"""
+    limit = min(limit or get_setting('TOP_K'), get_setting('TOP_K'))
+    prefix = normalize(query[:get_setting('MAX_QUERY_LENGTH')])
+    index = get_index()
+    if not prefix or index is None:
+        return []
+    started = time.perf_counter()
+    found = index.search(prefix, limit)
+    suggest_duration.observe(time.perf_counter() - started)
+    results = []
+    for entry in found:
+        kind, object_id, text = index.kinds[entry], index.object_ids[entry], index.text(entry)
+        results.append({
+            'type': KINDS[kind],
+            'id': object_id,
+            'title': text,
+            'url': result_url(kind, object_id),
+        })
+    return results
+
+
+def product_entries(filters=Q()):
+    """Записи проверенных продуктов; популярность - число строк в корзинах"""
+    rows = Product.objects.filter(filters, checked=True).values_list('id', 'title')
+    carts = dict(
+        CartItem.objects.filter(product__in=Product.objects.filter(filters, checked=True).values('id'))
+        .values('product_id').annotate(lines=Count('id')).values_list('product_id', 'lines')
+    )
+    return [Entry(PRODUCT, product_id, carts.get(product_id, 0), title) for product_id, title in rows]
+
+
+def tag_entries():
+    rows = Tag.objects.annotate(
+        checked_products=Count('products', filter=Q(products__checked=True)),
+    ).values_list('id', 'tagtitle', 'checked_products')
+    return [Entry(TAG, tag_id, products, title) for tag_id, title, products in rows]
+
+
+def seller_entries():
+    stats = dict(SellerStats.objects.values_list('seller_id', 'checked_products'))
+    rows = Seller.objects.filter(is_active=True).values_list('id', 'company_name')
+    return [Entry(SELLER, seller_id, stats.get(seller_id, 0), name) for seller_id, name in rows if name]
+
+
+def build(full=False, path=None):
+    """
+    Пересобрать снимок. Без full записи продуктов берутся из прежнего
+    снимка, а из БД перечитываются только измененные с его сборки.
+    Возвращает (записей, ключей, тяжелых префиксов).
+    """
+    path = path or get_path()
+    started = timezone.now()
+    previous = None
+    if not full and os.path.exists(path):
+        try:
+            previous = SuggestIndex(path)
+        except ValueError:
+            previous = None
+
+    if previous is None:
+        products = product_entries()
+    else:
+        since = previous.built_at - timedelta(seconds=get_setting('REBUILD_OVERLAP'))
+        changed = {entry.object_id: entry for entry in product_entries(Q(updated_at__gte=since))}
+        live_ids = set(Product.objects.filter(checked=True).values_list('id', flat=True))
+        products = [
+            changed.pop(entry.object_id, entry)
+            for entry in previous.entries()
+            if entry.kind == PRODUCT and entry.object_id in live_ids
+        ]
+        products.extend(changed.values())
+
+    entries = products + tag_entries() + seller_entries()
+    counts = write_snapshot(path, entries, started)
+    logger.info('search suggest index: %s entries, %s keys, %s heavy prefixes', *counts)
+    return counts
@@ -0,0 +1,26 @@
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from . import suggest
+
+
+@require_http_methods(["GET"])
+def search_suggest(request):
+    """
+    Подсказки поиска по префиксу из индекса marketplace.suggest.
+    GET /api/search/suggest?q=смар&limit=5
+
+    Не обращается к БД и сессии; пока снимок индекса не собран
+    (manage.py build_search_suggest), список подсказок пуст.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = max(int(request.GET.get('limit', 0)), 0)
+    except ValueError:
+        limit = 0
+    response = JsonResponse(
+        {'query': query, 'results': suggest.suggest(query, limit or None)},
+        json_dumps_params={'ensure_ascii': False},
+    )
+    response['Cache-Control'] = f"public, max-age={suggest.get_setting('MAX_AGE')}"
+    return response
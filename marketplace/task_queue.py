@@ -0,0 +1,259 @@
+"""
+Фоновые задачи с брокером в БД проекта - без Redis и RabbitMQ.
+
+Задача объявляется декоратором @task в marketplace/tasks.py и ставится
+в очередь вызовом .enqueue(**kwargs): в таблицу Task пишется строка
+в той же транзакции, что и изменения данных, поэтому воркер не увидит
+задачу, если транзакция откатилась.
+
+Воркеры (manage.py run_workers) забирают задачи по приоритету:
+на PostgreSQL через SELECT ... FOR UPDATE SKIP LOCKED, на SQLite -
+опросом и условным UPDATE. Задача арендуется на LEASE_SECONDS; задачи
+упавшего воркера возвращаются в работу после истечения аренды.
+Ошибка приводит к повтору с экспоненциальной задержкой, после
+max_attempts попыток задача помечается failed.
+"""
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Task
+
+logger = logging.getLogger('marketplace.tasks')
+
+DEFAULTS = {
+    'LEASE_SECONDS': 300,
+    'POLL_INTERVAL': 1.0,
+    'RETRY_BACKOFF': 5,
+    'RETRY_BACKOFF_MAX': 3600,
+    'KEEP_FINISHED_HOURS': 24,
+}
+
+task_duration = metrics.Histogram(
+    'marketplace_task_duration_seconds',
+    'Время выполнения фоновой задачи',
+    ['task', 'status'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0),
+)
+task_wait = metrics.Histogram(
+    'marketplace_task_wait_seconds',
+    'Время от постановки (или времени повтора) до начала выполнения',
+    ['task'],
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 1800.0),
+)
+
+_registry = {}
+
+
+def get_setting(name):
+    return getattr(settings, 'TASK_QUEUE', {}).get(name, DEFAULTS[name])
+
+
+class TaskDefinition:
+    """Зарегистрированная задача: вызов напрямую выполняет ее синхронно"""
+
+    def __init__(self, func, name, priority, max_attempts):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def enqueue(self, dedup_key=None, priority=None, delay=None, **kwargs):
+        """
+        Поставить задачу в очередь. Аргументы должны сериализоваться в JSON.
+        Если в очереди уже ждет задача с тем же dedup_key, новая не создается
+        и возвращается ожидающая.
+        """
+        task = Task(
+            name=self.name,
+            kwargs=kwargs,
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts,
+            dedup_key=dedup_key,
+            run_after=timezone.now() + (delay or timedelta()),
+        )
+        if dedup_key is None:
+            task.save()
+            return task
+        try:
+            with transaction.atomic():
+                task.save()
+            return task
+        except IntegrityError:
+            return Task.objects.filter(dedup_key=dedup_key, status=Task.QUEUED).first()
+
+
+def task(name=None, priority=0, max_attempts=3):
+    """Декоратор объявления фоновой задачи"""
+    def decorator(func):
+        definition = TaskDefinition(func, name or f'{func.__module__}.{func.__name__}', priority, max_attempts)
+        _registry[definition.name] = definition
+        return definition
+    return decorator
+
+
+def get_task(name):
+    return _registry.get(name)
+
+
+def registered_tasks():
+    return dict(_registry)
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _claimable(now):
+    ready = Q(status=Task.QUEUED, run_after__lte=now)
+    # Аренда упавшего воркера истекла - задача возвращается в работу
+    abandoned = Q(status=Task.RUNNING, locked_until__lt=now)
+    return ready | abandoned
+
+
+def claim(worker_id, limit=1):
+    """Забрать до limit готовых задач; возвращает список арендованных Task"""
+    now = timezone.now()
+    lease = {
+        'status': Task.RUNNING,
+        'locked_by': worker_id,
+        'locked_until': now + timedelta(seconds=get_setting('LEASE_SECONDS')),
+        'started_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    candidates = Task.objects.filter(_claimable(now)).order_by('-priority', 'run_after', 'id')
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Task.objects.filter(id__in=ids).update(**lease)
+        else:
+            # SQLite: запись сериализуется; условие в UPDATE отсекает задачи,
+            # которые успел забрать другой воркер между SELECT и UPDATE
+            ids = [
+                task_id
+                for task_id in candidates.values_list('id', flat=True)[:limit]
+                if Task.objects.filter(_claimable(now), id=task_id).update(**lease)
+            ]
+    if not ids:
+        return []
+    return list(Task.objects.filter(id__in=ids, locked_by=worker_id).order_by('-priority', 'run_after', 'id'))
+
+
+def backoff_delay(attempts):
+    """Экспоненциальная задержка повтора со случайным разбросом"""
+    base = get_setting('RETRY_BACKOFF') * 2 ** max(attempts - 1, 0)
+    return min(base, get_setting('RETRY_BACKOFF_MAX')) * random.uniform(0.8, 1.2)
+
+
+def execute(task_obj):
+    """Выполнить арендованную задачу и записать результат"""
+    definition = get_task(task_obj.name)
+    if task_obj.attempts > task_obj.max_attempts:
+        # Воркеры падали на этой задаче, не успевая записать результат
+        _finish(task_obj, Task.FAILED, task_obj.last_error or 'Превышено число попыток (аренда истекала)')
+        return Task.FAILED
+    task_wait.observe((task_obj.started_at - task_obj.run_after).total_seconds(), task=task_obj.name)
+    started = time.perf_counter()
+    try:
+        if definition is None:
+            raise LookupError(f'Задача {task_obj.name} не зарегистрирована')
+        definition.func(**task_obj.kwargs)
+    except Exception:
+        elapsed = time.perf_counter() - started
+        error = traceback.format_exc()
+        if task_obj.attempts < task_obj.max_attempts and definition is not None:
+            status = _retry(task_obj, error)
+        else:
+            status = Task.FAILED
+            _finish(task_obj, Task.FAILED, error)
+        logger.warning('task %s #%s failed (attempt %s/%s): %s', task_obj.name, task_obj.pk,
+                       task_obj.attempts, task_obj.max_attempts, error.strip().splitlines()[-1])
+    else:
+        elapsed = time.perf_counter() - started
+        status = Task.DONE
+        _finish(task_obj, Task.DONE, '')
+        logger.info('task %s #%s done in %.3f s', task_obj.name, task_obj.pk, elapsed)
+    task_duration.observe(elapsed, task=task_obj.name, status=status)
+    return status
+
+
+def _finish(task_obj, status, error):
+    Task.objects.filter(pk=task_obj.pk, locked_by=task_obj.locked_by).update(
+        status=status,
+        last_error=error,
+        finished_at=timezone.now(),
+        locked_until=None,
+    )
+
+
+def _retry(task_obj, error):
+    try:
+        with transaction.atomic():
+            Task.objects.filter(pk=task_obj.pk, locked_by=task_obj.locked_by).update(
+                status=Task.QUEUED,
+                last_error=error,
+                run_after=timezone.now() + timedelta(seconds=backoff_delay(task_obj.attempts)),
+                locked_by='',
+                locked_until=None,
+            )
+        return 'retry'
+    except IntegrityError:
+        # Пока задача выполнялась, поставили новую с тем же dedup_key - она и выполнит работу
+        _finish(task_obj, Task.DONE, error + '\nПовтор не нужен: в очереди задача с тем же ключом')
+        return 'superseded'
+
+
+def run_worker(worker_id=None, burst=False, stop=None, batch=1):
+    """
+    Цикл воркера: забрать задачи, выполнить, при пустой очереди подождать.
+    burst=True - выйти, как только очередь опустеет. stop - функция,
+    возвращающая True, когда нужно завершиться. Возвращает число выполненных задач.
+    """
+    worker_id = worker_id or default_worker_id()
+    poll_interval = get_setting('POLL_INTERVAL')
+    processed = 0
+    while not (stop and stop()):
+        tasks = claim(worker_id, limit=batch)
+        if not tasks:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        for task_obj in tasks:
+            execute(task_obj)
+            processed += 1
+    return processed
+
+
+def purge_finished(older_than=None):
+    """Удалить выполненные задачи старше KEEP_FINISHED_HOURS (упавшие остаются для разбора)"""
+    older_than = older_than or timedelta(hours=get_setting('KEEP_FINISHED_HOURS'))
+    deleted, _ = Task.objects.filter(status=Task.DONE, finished_at__lt=timezone.now() - older_than).delete()
+    return deleted
+
+
+@metrics.register_collector
+def queue_depth(totals):
+    rows = (
+        Task.objects.filter(status__in=[Task.QUEUED, Task.RUNNING])
+        .values('name', 'status')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    values = [({'task': row['name'], 'status': row['status']}, row['total']) for row in rows]
+    return [('marketplace_task_queue_depth', 'gauge', 'Задачи в очереди и в работе', values)]
@@ -0,0 +1,200 @@
+"""
+Фоновые задачи маркетплейса. Выполняются воркерами manage.py run_workers
+(см. marketplace/task_queue.py).
+"""
+import logging
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from . import events, feeds, page_cache, recommendations, suggest, webhooks
+from .models import Product, Task
+from .task_queue import task
+
+logger = logging.getLogger('marketplace.tasks')
+
+
+def get_image_max_size():
+    return getattr(settings, 'PRODUCT_IMAGE_MAX_SIZE', 1600)
+
+
+def _shrink_image(field_file, max_size):
+    """Уменьшить изображение по большей стороне до max_size, сохранив формат и имя файла"""
+    from PIL import Image, ImageOps
+
+    with field_file.storage.open(field_file.name, 'rb') as handle:
+        image = Image.open(handle)
+        image.load()
+    if max(image.size) <= max_size:
+        return False
+
+    image_format = image.format or 'JPEG'
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    save_options = {'quality': 85, 'optimize': True} if image_format == 'JPEG' else {'optimize': True}
+    image.save(buffer, image_format, **save_options)
+
+    # Перезаписываем файл под тем же именем: ссылки в БД не меняются
+    storage, name = field_file.storage, field_file.name
+    storage.delete(name)
+    storage.save(name, ContentFile(buffer.getvalue()))
+    return True
+
+
+@task(priority=5, max_attempts=5)
+def optimize_product_images(product_id):
+    """Уменьшить загруженные миниатюру и фотографии продукта до PRODUCT_IMAGE_MAX_SIZE"""
+    product = Product.objects.filter(pk=product_id).only('id', 'thumbnail').first()
+    if product is None:
+        return
+    files = [product.thumbnail] if product.thumbnail else []
+    files.extend(photo.photo for photo in product.product_photos.all())
+    max_size = get_image_max_size()
+    for field_file in files:
+        if field_file.storage.exists(field_file.name) and _shrink_image(field_file, max_size):
+            logger.info('resized %s to %spx', field_file.name, max_size)
+
+
+def schedule_image_processing(product_id):
+    """Поставить обработку изображений продукта; повторные загрузки схлопываются в одну задачу"""
+    return optimize_product_images.enqueue(dedup_key=f'product-images:{product_id}', product_id=product_id)
+
+
+@task(priority=1, max_attempts=2)
+def warm_page_cache():
+    """Отрендерить популярные страницы витрины после изменения каталога"""
+    page_cache.warm()
+    page_cache.trim()
+
+
+def schedule_page_cache_warming():
+    """
+    Поставить прогрев через WARM_DELAY секунд: серия правок каталога
+    за это время схлопывается в один прогрев по ключу дедупликации.
+    """
+    return warm_page_cache.enqueue(
+        dedup_key='page-cache-warm',
+        delay=timedelta(seconds=page_cache.get_setting('WARM_DELAY')),
+    )
+
+
+@task(priority=3, max_attempts=3)
+def rebuild_search_suggest(full=False):
+    """Пересобрать снимок индекса подсказок поиска"""
+    suggest.build(full=full)
+
+
+def schedule_search_suggest_rebuild():
+    """Поставить инкрементальную пересборку подсказок; правки за REBUILD_DELAY схлопываются"""
+    return rebuild_search_suggest.enqueue(
+        dedup_key='search-suggest-rebuild',
+        delay=timedelta(seconds=suggest.get_setting('REBUILD_DELAY')),
+    )
+
+
+@task(priority=1, max_attempts=3)
+def rebuild_feeds(full=False):
+    """Переписать изменившиеся файлы sitemap и товарного фида"""
+    feeds.build(full=full)
+
+
+def schedule_feeds_rebuild():
+    """Поставить инкрементальную пересборку sitemap и фида; правки за REBUILD_DELAY схлопываются"""
+    return rebuild_feeds.enqueue(
+        dedup_key='feeds-rebuild',
+        delay=timedelta(seconds=feeds.get_setting('REBUILD_DELAY')),
+    )
+
+
+@task(priority=2, max_attempts=3)
+def rebuild_recommendations(full=False):
+    """Добавить новые строки корзин к матрице совместных добавлений и обновить рекомендации"""
+    recommendations.build(full=full)
+
+
+_recommendations_scheduled_at = [float('-inf')]
+
+
+def schedule_recommendations_rebuild():
+    """
+    Поставить пересборку рекомендаций через REBUILD_DELAY секунд. Процесс
+    ставит ее не чаще раза в REBUILD_DELAY: добавление в корзину не должно
+    каждый раз писать в очередь задач.
+    """
+    delay = recommendations.get_setting('REBUILD_DELAY')
+    now = time.monotonic()
+    if now - _recommendations_scheduled_at[0] < delay:
+        return None
+    _recommendations_scheduled_at[0] = now
+    return rebuild_recommendations.enqueue(dedup_key='recommendations-rebuild', delay=timedelta(seconds=delay))
+
+
+@task(priority=4, max_attempts=3)
+def deliver_webhooks():
+    """Отправить события вебхуков, время которых подошло; поставить себя на следующую попытку"""
+    webhooks.deliver_due()
+    retry_at = webhooks.next_attempt_at()
+    if retry_at is not None:
+        deliver_webhooks.enqueue(dedup_key='webhooks-deliver', delay=max(retry_at - timezone.now(), timedelta()))
+
+
+_webhook_delivery_at = [None]
+
+
+def schedule_webhook_delivery():
+    """
+    Поставить доставку вебхуков через DELIVERY_DELAY секунд. Пока задача,
+    поставленная этим процессом, еще не началась (с запасом в секунду),
+    новые события попадут в нее же, и очередь задач не трогается.
+    """
+    now = timezone.now()
+    run_after = _webhook_delivery_at[0]
+    if run_after is not None and run_after - now > timedelta(seconds=1):
+        return None
+    delay = timedelta(seconds=webhooks.get_setting('DELIVERY_DELAY'))
+    queued = deliver_webhooks.enqueue(dedup_key='webhooks-deliver', delay=delay)
+    if queued is not None and queued.run_after > now + delay + timedelta(seconds=1):
+        # В очереди ждет отложенный повтор - новые события не должны ждать его
+        Task.objects.filter(pk=queued.pk, status=Task.QUEUED).update(run_after=now + delay)
+        queued.run_after = now + delay
+    _webhook_delivery_at[0] = queued.run_after if queued is not None else None
+    return queued
+
+
+@task(priority=3, max_attempts=5)
+def dispatch_domain_events():
+    """Передать накопившиеся доменные события подписчикам; если остались еще не видимые - поставить себя снова"""
+    events.dispatch()
+    if events.backlog():
+        dispatch_domain_events.enqueue(
+            dedup_key='domain-events-dispatch',
+            delay=timedelta(seconds=events.get_setting('DISPATCH_DELAY')),
+        )
+
+
+_event_dispatch_at = [None]
+
+
+def schedule_event_dispatch():
+    """
+    Поставить рассылку доменных событий через DISPATCH_DELAY секунд. Как и
+    доставка вебхуков, процесс не трогает очередь, пока поставленная им
+    задача еще не началась.
+    """
+    now = timezone.now()
+    run_after = _event_dispatch_at[0]
+    if run_after is not None and run_after - now > timedelta(seconds=1):
+        return None
+    queued = dispatch_domain_events.enqueue(
+        dedup_key='domain-events-dispatch',
+        delay=timedelta(seconds=events.get_setting('DISPATCH_DELAY')),
+    )
+    _event_dispatch_at[0] = queued.run_after if queued is not None else None
+    return queued
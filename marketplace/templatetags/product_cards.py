@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from marketplace import cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_cards(card_list, variant='catalog'):
+    """Отрендерить список карточек (marketplace.cards.product_cards) в заданном варианте"""
+    return mark_safe(cards.render_cards(card_list, variant))
@@ -0,0 +1,78 @@
+"""
+Небольшой, но реалистичный набор данных для тестов производительности:
+достаточно строк, чтобы N+1 проявлялись в количестве запросов.
+"""
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from marketplace.models import CartItem, Client, Product, ProductPhoto, Seller, Tag
+
+PASSWORD = 'Str0ng-pass-123'
+
+
+def seed_dataset(sellers=4, tags=12, products_per_seller=15, photos_per_product=2,
+                 tags_per_product=3, clients=3, cart_lines=6):
+    seller_objs = Seller.objects.bulk_create([
+        Seller(
+            email=f'seller{i}@example.com',
+            company_name=f'Компания {i}',
+            contact_person=f'Контакт {i}',
+            phone=f'+7999000000{i}',
+        )
+        for i in range(sellers)
+    ])
+    tag_objs = Tag.objects.bulk_create([Tag(tagtitle=f'Тег {i:02d}') for i in range(tags)])
+
+    product_objs = Product.objects.bulk_create([
+        Product(
+            title=f'Товар {seller.pk}-{i}',
+            description=f'Описание товара {i} продавца {seller.pk}',
+            price=Decimal(100 + i * 10),
+            stock=(i * 7) % 25,
+            seller=seller,
+            checked=i % 5 != 0,
+        )
+        for seller in seller_objs
+        for i in range(products_per_seller)
+    ])
+
+    Through = Product.tags.through
+    Through.objects.bulk_create([
+        Through(product_id=product.pk, tag_id=tag_objs[(index + offset) % tags].pk)
+        for index, product in enumerate(product_objs)
+        for offset in range(tags_per_product)
+    ])
+    ProductPhoto.objects.bulk_create([
+        ProductPhoto(product=product, photo=f'products/photos/{product.pk}-{order}.jpg', order=order)
+        for product in product_objs
+        for order in range(photos_per_product)
+    ])
+
+    client_objs = []
+    for i in range(clients):
+        client = Client(email=f'client{i}@example.com', first_name=f'Имя{i}', last_name=f'Фамилия{i}')
+        client.set_password(PASSWORD)
+        client_objs.append(client)
+    Client.objects.bulk_create(client_objs)
+
+    checked_products = [product for product in product_objs if product.checked]
+    CartItem.objects.bulk_create([
+        CartItem(client=client, product=checked_products[(c * cart_lines + i) % len(checked_products)], quantity=1 + i % 3)
+        for c, client in enumerate(client_objs)
+        for i in range(cart_lines)
+    ])
+
+    for seller in seller_objs:
+        seller.set_password(PASSWORD)
+    Seller.objects.bulk_update(seller_objs, ['password'])
+
+    admin = User.objects.create_superuser('admin', 'admin@example.com', PASSWORD)
+    return {
+        'sellers': seller_objs,
+        'tags': tag_objs,
+        'products': product_objs,
+        'checked_products': checked_products,
+        'clients': client_objs,
+        'admin': admin,
+    }
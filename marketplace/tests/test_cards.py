@@ -0,0 +1,66 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import cards
+from marketplace.models import Product
+
+from .fixtures import seed_dataset
+
+CARD = {
+    'id': 7,
+    'title': '<script>alert(1)</script>',
+    'description': 'Описание & "кавычки"',
+    'price': 1250,
+    'stock': 0,
+    'checked': False,
+    'image_url': '',
+    'tags': ['Тег <b>', 'Второй', 'Третий'],
+    'url': '/products/7/',
+}
+
+
+class RenderCardTests(SimpleTestCase):
+
+    def test_object_url_matches_reverse(self):
+        for product_id in (1, 42, 987654):
+            self.assertEqual(cards.object_url('product_detail', product_id), reverse('product_detail', args=[product_id]))
+        self.assertEqual(cards.object_url('seller_product_edit', 5), reverse('seller_product_edit', args=[5]))
+
+    def test_escapes_user_content(self):
+        for variant in cards.VARIANTS:
+            html = cards.render_card(CARD, variant)
+            self.assertNotIn('<script>', html, variant)
+            self.assertIn('&lt;script&gt;', html, variant)
+        catalog = cards.render_card(CARD, 'catalog')
+        self.assertIn('Описание &amp; &quot;кавычки&quot;', catalog)
+        self.assertIn('Тег &lt;b&gt;, Второй</p>', catalog)
+        self.assertIn('Нет в наличии', catalog)
+        self.assertIn('Нет фото', catalog)
+
+    def test_seller_variant(self):
+        html = cards.render_card(dict(CARD, stock=3), 'seller')
+        self.assertIn(f'href="{reverse("seller_product_edit", args=[7])}"', html)
+        self.assertIn('Остаток: 3 шт.', html)
+        self.assertIn('На проверке', html)
+
+
+@override_settings(PAGE_CACHE={'ENABLED': False})
+class CardPagesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2, products_per_seller=5)
+
+    def test_catalog_renders_cards(self):
+        response = self.client.get(reverse('catalog'))
+        self.assertEqual(len(response.context['cards']), len(self.data['checked_products']))
+        for product in self.data['checked_products']:
+            self.assertContains(response, f'href="{reverse("product_detail", args=[product.pk])}"', count=2)
+            self.assertContains(response, product.product_photos.first().photo.url)
+
+    def test_product_cards_from_prefetched_queryset(self):
+        products = Product.objects.filter(checked=True).prefetch_related('tags', 'product_photos')
+        with self.assertNumQueries(3):
+            card_list = cards.product_cards(products)
+        self.assertEqual(len(card_list[0]['tags']), 3)
+        self.assertEqual(card_list[0]['url'], reverse('product_detail', args=[card_list[0]['id']]))
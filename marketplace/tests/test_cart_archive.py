@@ -0,0 +1,67 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Count, F, Sum
+from django.test import TestCase
+from django.utils import timezone
+
+from marketplace import cart_archive
+from marketplace.models import AbandonedCartStats, ArchivedCartItem, CartItem
+
+from .fixtures import seed_dataset
+
+
+class CartArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(sellers=2, products_per_seller=6, clients=4, cart_lines=5)
+        cls.stale_at = timezone.now() - timedelta(days=45)
+        # Каждая вторая строка брошена полтора месяца назад
+        cls.stale_ids = list(CartItem.objects.order_by('id').values_list('id', flat=True)[::2])
+        CartItem.objects.filter(id__in=cls.stale_ids).update(updated_at=cls.stale_at)
+
+    def expected_totals(self):
+        return CartItem.objects.filter(id__in=self.stale_ids).aggregate(
+            rows=Count('id'), units=Sum('quantity'), total=Sum(F('quantity') * F('product__price')),
+        )
+
+    def test_moves_stale_lines_in_chunks(self):
+        expected = self.expected_totals()
+        fresh = set(CartItem.objects.exclude(id__in=self.stale_ids).values_list('id', flat=True))
+        chunks = []
+        progress = cart_archive.archive_stale_carts(days=30, chunk_size=3, pause=0, on_chunk=chunks.append)
+
+        self.assertEqual(progress.moved, len(self.stale_ids))
+        self.assertEqual(len(chunks), -(-progress.scanned // 3))
+        self.assertEqual(set(CartItem.objects.values_list('id', flat=True)), fresh)
+        archived = ArchivedCartItem.objects.order_by('id')
+        self.assertEqual([row.id for row in archived], self.stale_ids)
+        self.assertEqual(archived[0].updated_at, self.stale_at)
+
+        stats = AbandonedCartStats.objects.aggregate(rows=Sum('lines'), units=Sum('quantity'), total=Sum('amount'))
+        self.assertEqual(stats, expected)
+        self.assertEqual(set(AbandonedCartStats.objects.values_list('day', flat=True)), {timezone.localdate(self.stale_at)})
+
+        # Повторный запуск ничего не переносит и не задваивает агрегаты
+        self.assertEqual(cart_archive.archive_stale_carts(days=30, chunk_size=3, pause=0).moved, 0)
+        self.assertEqual(AbandonedCartStats.objects.aggregate(rows=Sum('lines'))['rows'], expected['rows'])
+
+    def test_delete_mode_keeps_aggregates(self):
+        expected = self.expected_totals()
+        out = StringIO()
+        call_command('archive_carts', '--delete', '--days', '30', '--chunk-size', '4', '--pause', '0', stdout=out)
+        self.assertIn(f'Удалено строк: {len(self.stale_ids)}', out.getvalue())
+        self.assertFalse(ArchivedCartItem.objects.exists())
+        self.assertFalse(CartItem.objects.filter(id__in=self.stale_ids).exists())
+        self.assertEqual(AbandonedCartStats.objects.aggregate(rows=Sum('lines'))['rows'], expected['rows'])
+
+    def test_chunk_is_short_transaction_by_id_range(self):
+        low = self.stale_ids[0]
+        # Выборка с блокировкой, цены, архив, чтение и upsert агрегатов, DELETE;
+        # выборка удаляемых строк и строка outbox доменных событий;
+        # плюс SAVEPOINT и RELEASE внутри транзакции теста
+        with self.assertNumQueries(6 + 2 + 2):
+            moved = cart_archive.archive_range(low, low + 3, timezone.now() - timedelta(days=30))
+        self.assertEqual(moved, 2)
@@ -0,0 +1,88 @@
+import gzip
+import json
+from io import BytesIO
+from unittest import mock
+
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import compression, page_cache
+
+from .fixtures import seed_dataset
+from .test_page_cache import PAGE_CACHE, isolate_page_cache
+
+PRODUCTS = {'results': [{'id': index, 'title': f'Товар {index}', 'price': '100.00'} for index in range(200)]}
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+
+    def process(self, response, accept='gzip, deflate, br'):
+        middleware = compression.CompressionMiddleware(lambda request: response)
+        return middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept))
+
+    def test_compresses_large_json(self):
+        original = JsonResponse(PRODUCTS)
+        original['ETag'] = '"abc"'
+        body = original.content
+        response = self.process(original, accept='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content) * 8, len(body))
+        self.assertEqual(json.loads(gzip.decompress(response.content)), PRODUCTS)
+
+    def test_skips_small_binary_and_file_responses(self):
+        small = self.process(HttpResponse('<p>ok</p>'))
+        self.assertNotIn('Content-Encoding', small)
+        image = self.process(HttpResponse(b'\xff' * 5000, content_type='image/jpeg'))
+        self.assertNotIn('Content-Encoding', image)
+        media = self.process(FileResponse(BytesIO(b'a' * 5000), content_type='text/plain'))
+        self.assertNotIn('Content-Encoding', media)
+        events = self.process(StreamingHttpResponse(iter([b'data: 1\n\n']), content_type='text/event-stream'))
+        self.assertNotIn('Content-Encoding', events)
+
+    def test_vary_without_accept_encoding(self):
+        response = self.process(JsonResponse(PRODUCTS), accept='')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_stream_compresses_streaming_response(self):
+        rows = [f'{index};Товар {index};100.00\n'.encode() for index in range(2000)]
+        response = self.process(StreamingHttpResponse(iter(rows), content_type='text/csv'), accept='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(rows))
+
+
+@override_settings(PAGE_CACHE=PAGE_CACHE)
+class CompressedPageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(sellers=2, products_per_seller=5)
+
+    def setUp(self):
+        isolate_page_cache(self)
+        patcher = mock.patch.object(page_cache, 'recorder', page_cache.TrafficRecorder())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compressed_variant_cached_with_page(self):
+        url = reverse('catalog')
+        first = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            with self.assertNumQueries(0):
+                second = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            compress.assert_not_called()
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second['Content-Encoding'], 'gzip')
+        self.assertEqual(second.content, first.content)
+
+        plain = self.client.get(url)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(plain.content, gzip.decompress(second.content))
@@ -0,0 +1,61 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import db_router
+from marketplace.models import Product
+
+from .fixtures import seed_dataset
+
+# В тестах "репликой" служит основная база: проверяется выбор алиаса, а не репликация
+ROUTING = {
+    'REPLICAS': ['default'],
+    'READ_ONLY_VIEWS': ['index', 'catalog', 'product_detail'],
+    'STICKY_SECONDS': 5,
+    'STICKY_COOKIE': 'db_primary',
+}
+
+
+@override_settings(DATABASE_ROUTING=ROUTING, PAGE_CACHE={'ENABLED': False})
+class PrimaryReplicaRouterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2)
+
+    def test_reads_go_to_replica_until_first_write(self):
+        router = db_router.PrimaryReplicaRouter()
+        token = db_router.begin_request()
+        try:
+            self.assertIsNone(router.db_for_read(Product))
+            db_router.use_replica()
+            # TestCase держит транзакцию основной базы - имитируем запрос вне ее
+            with mock.patch.object(db_router.connections['default'], 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(Product), 'default')
+                self.assertEqual(router.db_for_write(Product), 'default')
+                self.assertIsNone(router.db_for_read(Product))
+        finally:
+            self.assertTrue(db_router.end_request(token))
+
+    def test_read_only_view_uses_replica(self):
+        with mock.patch.object(db_router, 'use_replica', wraps=db_router.use_replica) as use_replica:
+            self.client.get(reverse('catalog'))
+            use_replica.assert_called_once()
+            self.client.get(reverse('cart'))
+            use_replica.assert_called_once()
+
+    def test_write_pins_client_to_primary(self):
+        client_user = self.data['clients'][0]
+        session = self.client.session
+        session['client_id'] = client_user.pk
+        session['client_email'] = client_user.email
+        session['client_name'] = client_user.first_name
+        session.save()
+        product = self.data['checked_products'][0]
+        response = self.client.post(reverse('add_to_cart', args=[product.pk]), {'quantity': 1})
+        self.assertEqual(response.cookies['db_primary']['max-age'], 5)
+
+        with mock.patch.object(db_router, 'use_replica') as use_replica:
+            self.client.get(reverse('catalog'))
+            use_replica.assert_not_called()
@@ -0,0 +1,171 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from marketplace import events, page_cache
+from marketplace.models import CartItem, DomainEvent, EventCursor, Product, ProductPhoto, Tag
+
+from .fixtures import seed_dataset
+
+
+class EventBusTestMixin:
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=1, products_per_seller=6, tags=3, photos_per_product=0, clients=1, cart_lines=2)
+        DomainEvent.objects.all().delete()
+
+    def subscribe(self, name, models=(), fail=False):
+        """Временный подписчик, собирающий полученные пачки"""
+        received = []
+
+        def func(batch):
+            if fail:
+                raise RuntimeError('boom')
+            received.append(batch)
+
+        events.subscriber(name, models)(func)
+        self.addCleanup(events._subscribers.pop, name, None)
+        return received
+
+    def rows(self):
+        return list(DomainEvent.objects.order_by('id').values_list('model', 'action', 'object_ids', 'fields'))
+
+
+class OutboxRecordingTests(EventBusTestMixin, TestCase):
+    """Каждая операция записи дает одну строку outbox в своей транзакции"""
+
+    def test_bulk_paths_write_one_row(self):
+        products = list(Product.objects.order_by('id'))
+        ids = [product.pk for product in products]
+        Product.objects.filter(id__in=ids).update(stock=7)
+        for product in products:
+            product.price += 1
+        Product.objects.bulk_update(products, ['price'], batch_size=2)
+        tags = Tag.objects.bulk_create([Tag(tagtitle='Новый 1'), Tag(tagtitle='Новый 2')])
+        self.assertEqual(self.rows(), [
+            ('product', events.UPDATED, ids, ['stock']),
+            ('product', events.UPDATED, ids, ['price']),
+            ('tag', events.CREATED, [tag.pk for tag in tags], []),
+        ])
+
+    def test_delete_cascade_writes_row_per_model(self):
+        product = CartItem.objects.first().product
+        photo = ProductPhoto.objects.create(product=product, photo='products/photos/a.jpg')
+        cart_ids = list(product.cart_items.values_list('id', flat=True))
+        Product.objects.filter(pk=product.pk).delete()
+        self.assertEqual(sorted(self.rows()[1:]), sorted([
+            ('cartitem', events.DELETED, cart_ids, []),
+            ('product', events.DELETED, [product.pk], []),
+            ('productphoto', events.DELETED, [photo.pk], []),
+        ]))
+
+    def test_saves_and_tags(self):
+        product = Product.objects.first()
+        tag = Tag.objects.first()
+        product.save(update_fields=['title'])
+        product.tags.add(tag)
+        tag.products.clear()
+        self.assertEqual(self.rows(), [
+            ('product', events.UPDATED, [product.pk], ['title']),
+            ('product', events.UPDATED, [product.pk], ['tags']),
+            ('tag', events.UPDATED, [tag.pk], ['products']),
+        ])
+
+    def test_rollback_discards_events(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Product.objects.update(stock=1)
+            raise RuntimeError
+        self.assertFalse(DomainEvent.objects.exists())
+
+
+class LocalSubscriberTests(EventBusTestMixin, TestCase):
+    """Кеш страниц сбрасывается один раз на транзакцию после коммита"""
+
+    def test_page_cache_invalidated_once_per_transaction(self):
+        products = list(Product.objects.all())
+        with mock.patch.object(page_cache, 'invalidate') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                for product in products:
+                    product.stock += 1
+                    product.save()
+                Product.objects.update(stock=3)
+                self.assertFalse(invalidate.called)
+            self.assertEqual(invalidate.call_count, 1)
+
+            # Захват на модерацию витрину не меняет
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.update(moderation_claimed_until=timezone.now())
+            with self.captureOnCommitCallbacks(execute=True):
+                CartItem.objects.update(quantity=2)
+            self.assertEqual(invalidate.call_count, 1)
+
+
+class DispatchTests(EventBusTestMixin, TestCase):
+    """Рассылка подписчикам из outbox по позициям"""
+
+    def test_many_updates_coalesce_per_object(self):
+        received = self.subscribe('test-products', models=('product',))
+        product = Product.objects.first()
+        for stock in range(30):
+            Product.objects.filter(pk=product.pk).update(stock=stock)
+        product.title = 'Новое название'
+        product.save(update_fields=['title'])
+        CartItem.objects.update(quantity=3)
+
+        processed = events.dispatch()
+        self.assertEqual(processed['test-products'], 31)
+        batch, = received
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(batch.changes('product')[product.pk].fields, {'stock', 'title'})
+        self.assertEqual(batch.ids('product', ignore_fields=['stock', 'title']), set())
+        self.assertEqual(EventCursor.objects.get(name='test-products').position, DomainEvent.objects.latest('id').pk)
+
+        # Новых событий нет - подписчик не вызывается
+        events.dispatch()
+        self.assertEqual(len(received), 1)
+
+    def test_pages_and_visibility_horizon(self):
+        received = self.subscribe('test-products', models=('product',))
+        for product in Product.objects.order_by('id'):
+            product.save()
+        # Как на PostgreSQL: событие с меньшим id записала транзакция, которая
+        # еще не завершена (xid не ниже xmin снимка), остальные - завершенные
+        late = DomainEvent.objects.earliest('id')
+        DomainEvent.objects.update(xid=10)
+        DomainEvent.objects.filter(pk=late.pk).update(xid=30)
+        with mock.patch.object(events, '_visible_xmin', return_value=20):
+            events.dispatch(batch_size=4)
+        self.assertEqual([len(batch) for batch in received], [4, 1])
+        self.assertNotIn(late.object_ids[0], set().union(*(batch.ids('product') for batch in received)))
+        # Позиция не обогнала незавершенную транзакцию: ее событие придет следующей рассылкой
+        self.assertTrue(events.backlog())
+        with mock.patch.object(events, '_visible_xmin', return_value=40):
+            events.dispatch(batch_size=4)
+        self.assertEqual(received[-1].ids('product'), set(late.object_ids))
+        self.assertFalse(events.backlog())
+        self.assertEqual(
+            EventCursor.objects.values_list('position_xid', 'position').get(name='test-products'), (30, late.pk),
+        )
+
+    def test_failed_subscriber_keeps_position(self):
+        failing = self.subscribe('test-failing', fail=True)
+        received = self.subscribe('test-ok')
+        Product.objects.update(stock=5)
+        with self.assertLogs('marketplace.events', 'ERROR'), self.assertRaises(RuntimeError):
+            events.dispatch()
+        self.assertEqual(failing, [])
+        self.assertEqual(len(received), 1)
+        cursors = dict(EventCursor.objects.values_list('name', 'position'))
+        self.assertEqual(cursors['test-failing'], 0)
+        self.assertEqual(cursors['test-ok'], DomainEvent.objects.get().pk)
+        self.assertFalse(EventCursor.objects.filter(locked_until__isnull=False).exists())
+
+        # Пока подписчик отстает, его события не удаляются
+        DomainEvent.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(events.purge(), 0)
+        events._subscribers.pop('test-failing')
+        self.assertEqual(events.purge(), 1)
@@ -0,0 +1,139 @@
+import gzip
+import shutil
+import tempfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+from django.test import TestCase, override_settings
+
+from marketplace import events, feeds
+from marketplace.models import Product, ProductPhoto, Tag, Task
+
+from .fixtures import seed_dataset
+
+NS = {'sm': feeds.SITEMAP_NS}
+
+
+class FeedBuildTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2, products_per_seller=8, tags=5)
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(
+            FEEDS={'ROOT': str(self.root), 'CHUNK_SIZE': 4, 'BASE_URL': 'https://shop.example'},
+            THROTTLING={'ENABLED': False},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def read_xml(self, name):
+        data = (self.root / name).read_bytes()
+        return ElementTree.fromstring(gzip.decompress(data) if name.endswith('.gz') else data)
+
+    def product_urls(self):
+        urls = set()
+        for loc in self.read_xml('sitemap.xml').iterfind('sm:sitemap/sm:loc', NS):
+            name = loc.text.removeprefix('https://shop.example/')
+            if name.startswith('sitemaps/products-'):
+                urls |= {url.text for url in self.read_xml(name).iterfind('sm:url/sm:loc', NS)}
+        return urls
+
+    def offers(self):
+        return {offer.get('id'): offer for offer in self.read_xml('feeds/products.yml.gz').iter('offer')}
+
+    def test_sitemaps_and_feed(self):
+        chunks, rewritten = feeds.build()
+        self.assertEqual(chunks, rewritten)
+        checked = list(Product.objects.filter(checked=True).order_by('id'))
+        self.assertEqual(
+            self.product_urls(),
+            {f'https://shop.example/products/{product.id}/' for product in checked},
+        )
+        self.assertIn('sitemaps/pages.xml.gz', (self.root / 'sitemap.xml').read_text())
+        # Теги делятся на файлы по CHUNK_SIZE адресов
+        tag_urls = [
+            url.text
+            for name in ('sitemaps/tags-0.xml.gz', 'sitemaps/tags-1.xml.gz')
+            for url in self.read_xml(name).iterfind('sm:url/sm:loc', NS)
+        ]
+        self.assertEqual(len(tag_urls), Tag.objects.count())
+
+        offers = self.offers()
+        self.assertEqual(set(offers), {str(product.id) for product in checked})
+        offer = offers[str(checked[0].id)]
+        self.assertEqual(offer.findtext('name'), checked[0].title)
+        self.assertEqual(offer.findtext('price'), str(checked[0].price))
+        catalog = self.read_xml('feeds/products.yml.gz')
+        self.assertEqual(len(catalog.findall('shop/categories/category')), Tag.objects.count())
+
+    def test_incremental_rebuild_rewrites_changed_chunks_only(self):
+        feeds.build()
+        self.assertEqual(feeds.build()[1], 0)
+
+        product = Product.objects.filter(checked=True).order_by('id').first()
+        untouched = self.root / 'sitemaps' / f'products-{product.id // 4 + 1}.xml.gz'
+        untouched_mtime = untouched.stat().st_mtime_ns
+        product.title = 'Новое название'
+        product.save()
+        self.assertEqual(feeds.build()[1], 1)
+        self.assertEqual(self.offers()[str(product.id)].findtext('name'), 'Новое название')
+        self.assertEqual(untouched.stat().st_mtime_ns, untouched_mtime)
+
+        Product.objects.filter(pk=product.pk).update(checked=False)
+        self.assertEqual(feeds.build()[1], 1)
+        self.assertNotIn(str(product.id), self.offers())
+
+    def test_photo_and_tag_changes_rewrite_chunk(self):
+        # Фотографии и теги не меняют updated_at продукта, но попадают в оффер
+        product = Product.objects.filter(checked=True).order_by('id').first()
+        product.tags.clear()
+        product.product_photos.all().delete()
+        feeds.build()
+
+        ProductPhoto.objects.create(product=product, photo='products/photos/new.jpg', order=0)
+        self.assertEqual(feeds.build()[1], 1)
+        self.assertTrue(self.offers()[str(product.id)].findtext('picture').endswith('products/photos/new.jpg'))
+
+        ProductPhoto.objects.create(product=product, photo='products/photos/first.jpg', order=1)
+        feeds.build()
+        ProductPhoto.objects.filter(product=product, photo='products/photos/first.jpg').update(order=0)
+        ProductPhoto.objects.filter(product=product, photo='products/photos/new.jpg').update(order=1)
+        self.assertEqual(feeds.build()[1], 1)
+        self.assertTrue(self.offers()[str(product.id)].findtext('picture').endswith('products/photos/first.jpg'))
+
+        tag = Tag.objects.order_by('id').first()
+        product.tags.add(tag)
+        self.assertEqual(feeds.build()[1], 1)
+        self.assertEqual(self.offers()[str(product.id)].findtext('categoryId'), str(tag.id))
+
+        other = Tag.objects.order_by('id').last()
+        product.tags.set([other])
+        self.assertEqual(feeds.build()[1], 1)
+        self.assertEqual(self.offers()[str(product.id)].findtext('categoryId'), str(other.id))
+
+    def test_served_as_files_without_queries(self):
+        self.assertEqual(self.client.get('/sitemap.xml').status_code, 404)
+        feeds.build()
+        with self.assertNumQueries(0):
+            index = self.client.get('/sitemap.xml', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(index['Content-Encoding'], 'gzip')
+        self.assertIn(b'sitemapindex', gzip.decompress(b''.join(index.streaming_content)))
+
+        with self.assertNumQueries(0):
+            feed = self.client.get('/feeds/products.yml.gz')
+        self.assertEqual(feed['Content-Type'], 'application/gzip')
+        self.assertNotIn('Content-Encoding', feed)
+        self.assertIn(b'<yml_catalog', gzip.decompress(b''.join(feed.streaming_content)))
+        self.assertEqual(self.client.get('/feeds/.state.json').status_code, 404)
+
+    def test_catalog_change_schedules_rebuild(self):
+        product = Product.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.stock += 1
+            product.save()
+        events.dispatch()
+        self.assertTrue(Task.objects.filter(dedup_key='feeds-rebuild', status=Task.QUEUED).exists())
@@ -0,0 +1,95 @@
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import instrumentation
+from marketplace.middleware import PerformanceMiddleware
+from marketplace.models import Product
+
+from .fixtures import seed_dataset
+
+INSTRUMENTATION = {'ENABLED': True, 'SAMPLE_RATE': 0.5, 'N_PLUS_ONE_THRESHOLD': 5, 'SERVER_TIMING': True}
+
+
+@override_settings(PERF_INSTRUMENTATION=INSTRUMENTATION, THROTTLING={'ENABLED': False})
+class PerformanceMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=1, products_per_seller=8, clients=0, cart_lines=0)
+
+    def setUp(self):
+        instrumentation.reset_url_stats()
+        self.addCleanup(instrumentation.reset_url_stats)
+
+    def run_view(self, view, roll=0.1):
+        request = RequestFactory().get('/n-plus-one/')
+        request.resolver_match = mock.Mock(view_name='n_plus_one')
+        with mock.patch('marketplace.middleware.random.random', return_value=roll):
+            return PerformanceMiddleware(view)(request)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            instrumentation.normalize_sql("SELECT * FROM t WHERE  a = 'x''y' AND b IN (1, 2, 3) LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?',
+        )
+
+    def test_sampling_decision(self):
+        skipped = self.run_view(lambda request: HttpResponse(), roll=0.7)
+        self.assertNotIn('Server-Timing', skipped)
+        self.assertEqual(instrumentation.get_url_stats(), {})
+
+        sampled = self.run_view(lambda request: HttpResponse(), roll=0.3)
+        self.assertTrue(sampled['Server-Timing'].startswith('db;dur=0.0;desc="0 queries"'))
+        self.assertEqual(instrumentation.get_url_stats()['n_plus_one']['requests'], 1)
+
+    def test_n_plus_one_detected(self):
+        ids = list(Product.objects.values_list('id', flat=True))
+
+        def view(request):
+            for pk in ids[:6]:
+                Product.objects.filter(pk=pk).first()
+            return HttpResponse()
+
+        with self.assertLogs('marketplace.perf', 'WARNING') as logs:
+            response = self.run_view(view)
+        self.assertIn('6 queries', response['Server-Timing'])
+        record, = logs.records
+        self.assertIn('probable N+1', record.getMessage())
+        shape, = record.n_plus_one
+        self.assertEqual(shape['count'], 6)
+        self.assertIn('WHERE "marketplace_product"."id" = %s', shape['sql'])
+
+        # Разные формы запросов ниже порога - не N+1
+        def distinct_view(request):
+            Product.objects.count()
+            Product.objects.filter(checked=True).exists()
+            return HttpResponse()
+
+        with self.assertLogs('marketplace.perf', 'INFO') as logs:
+            self.run_view(distinct_view)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        stats = instrumentation.get_url_stats()['n_plus_one']
+        self.assertEqual((stats['requests'], stats['n_plus_one_requests']), (2, 1))
+        self.assertEqual((stats['avg_queries'], stats['max_queries']), (4.0, 6))
+
+    def test_aggregated_per_url_and_served_to_staff(self):
+        url = reverse('catalog')
+        with mock.patch('marketplace.middleware.random.random', return_value=0.1):
+            for _ in range(2):
+                self.client.get(url)
+        stats = instrumentation.get_url_stats()['catalog']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['avg_queries'], 0)
+        self.assertGreaterEqual(stats['max_queries'], stats['avg_queries'])
+        self.assertGreater(stats['avg_ms'], 0)
+
+        perf_url = reverse('perf_stats')
+        self.assertEqual(self.client.get(perf_url).status_code, 302)
+        self.client.force_login(self.data['admin'])
+        with mock.patch('marketplace.middleware.random.random', return_value=0.9):
+            body = self.client.get(perf_url).json()
+        self.assertEqual(body['sample_rate'], 0.5)
+        self.assertEqual(body['urls']['catalog']['requests'], 2)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from marketplace import live
+from marketplace.live_views import parse_product_ids, stream_product_events
+from marketplace.models import Product
+
+from .fixtures import seed_dataset
+
+
+def parse_events(chunks):
+    return [
+        json.loads(line.removeprefix('data: '))
+        for chunk in chunks
+        for line in chunk.splitlines()
+        if line.startswith('data: ')
+    ]
+
+
+class ProductHubTests(SimpleTestCase):
+
+    def test_parse_product_ids(self):
+        self.assertEqual(parse_product_ids('3,x,3,-1,0,7,9', limit=2), [3, 7])
+
+    async def test_dispatch_coalesces_per_product(self):
+        hub = live.ProductHub()
+        subscription = hub.subscribe([1, 2])
+        other = hub.subscribe([2])
+        for stock in (5, 4, 3):
+            hub.dispatch({'id': 1, 'stock': stock})
+        hub.dispatch({'id': 3, 'stock': 1})
+        await asyncio.wait_for(subscription.ready.wait(), timeout=1)
+        # Клиент получает только последнее значение остатка
+        self.assertEqual(subscription.drain(), [{'id': 1, 'stock': 3}])
+        self.assertFalse(other.ready.is_set())
+
+        hub.narrow(subscription, [1])
+        hub.dispatch({'id': 2, 'stock': 8})
+        await asyncio.wait_for(other.ready.wait(), timeout=1)
+        await asyncio.sleep(0)
+        self.assertEqual(subscription.drain(), [])
+        self.assertEqual(other.drain(), [{'id': 2, 'stock': 8}])
+
+        hub.unsubscribe(subscription)
+        hub.unsubscribe(other)
+        self.assertEqual(hub.subscriber_count(), 0)
+
+    def test_local_broadcast_dispatches_to_hub(self):
+        hub = mock.Mock()
+        live.LocalBroadcast(hub).publish({'id': 1, 'stock': 2})
+        hub.dispatch.assert_called_once_with({'id': 1, 'stock': 2})
+
+    def test_format_event(self):
+        self.assertEqual(
+            live.format_event({'id': 1, 'price': '10.00'}),
+            'event: product\ndata: {"id":1,"price":"10.00"}\n\n',
+        )
+
+
+class ProductStreamTests(TestCase):
+    """Поток отдает только проверенные продукты"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(sellers=1, products_per_seller=5, clients=0, cart_lines=0)
+        cls.checked = Product.objects.filter(checked=True).order_by('id').first()
+        cls.unchecked = Product.objects.filter(checked=False).order_by('id').first()
+
+    async def test_stream_skips_unchecked_products(self):
+        stream = stream_product_events([self.checked.pk, self.unchecked.pk], subscribe=True)
+        self.assertTrue((await anext(stream)).startswith('retry: '))
+        snapshot = parse_events([await anext(stream)])
+        self.assertEqual([event['id'] for event in snapshot], [self.checked.pk])
+
+        next_chunk = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        live.hub.dispatch({'id': self.unchecked.pk, 'stock': 1})
+        live.hub.dispatch({'id': self.checked.pk, 'stock': 2})
+        self.assertEqual(parse_events([await asyncio.wait_for(next_chunk, timeout=1)]),
+                         [{'id': self.checked.pk, 'stock': 2}])
+        await stream.aclose()
+        self.assertEqual(live.hub.subscriber_count(), 0)
+
+    def test_wsgi_returns_snapshot(self):
+        response = self.client.get('/api/products/stream/', {'ids': f'{self.unchecked.pk},{self.checked.pk}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        # Под WSGI Django сам потребляет асинхронный поток и предупреждает об этом
+        with self.assertWarnsMessage(Warning, 'must consume asynchronous iterators'):
+            chunks = [chunk.decode() for chunk in response]
+        self.assertEqual([event['id'] for event in parse_events(chunks)], [self.checked.pk])
+        self.assertEqual(self.client.get('/api/products/stream/', {'ids': 'x'}).status_code, 400)
+
+    def test_unchecked_changes_are_not_published(self):
+        with mock.patch.object(live, 'publish_product_change') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                for product in (self.unchecked, self.checked):
+                    product.stock += 1
+                    product.save()
+        publish.assert_called_once_with(self.checked.pk, {'stock': self.checked.stock})
@@ -0,0 +1,115 @@
+import shutil
+import tempfile
+import threading
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import metrics
+
+
+class MetricsDirMixin:
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(MARKETPLACE_METRICS={'DIR': directory})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Файл процесса привязан к каталогу - заводим новый
+        metrics.reset_store()
+        self.addCleanup(metrics.reset_store)
+
+    def register(self, metric):
+        self.addCleanup(metrics._registry.pop, metric.name, None)
+        return metric
+
+
+class MmapStoreTests(MetricsDirMixin, TestCase):
+
+    def test_counter_increments(self):
+        counter = self.register(metrics.Counter('test_events_total', 'Тест', ['kind']))
+        counter.inc(kind='a')
+        counter.inc(2.5, kind='a')
+        counter.inc(kind='b')
+        totals = metrics.collect_values()
+        self.assertEqual(totals[metrics._key('test_events_total', {'kind': 'a'})], 3.5)
+        self.assertEqual(totals[metrics._key('test_events_total', {'kind': 'b'})], 1)
+
+    def test_store_grows_and_reopens(self):
+        store = metrics._get_store()
+        keys = [f'key-{index}' * 20 for index in range(500)]
+        for key in keys:
+            store.add(key, 1)
+        # Повторное открытие файла (перезапуск воркера) видит все записи
+        store.close()
+        reopened = metrics.MmapValueStore(store.path)
+        self.addCleanup(reopened.close)
+        reopened.add(keys[0], 1)
+        self.assertEqual(metrics.collect_values()[keys[0]], 2)
+        self.assertEqual(len(metrics.collect_values()), 500)
+
+    def test_file_of_live_process_is_not_shared(self):
+        store = metrics._get_store()
+        with self.assertRaises(BlockingIOError):
+            metrics.MmapValueStore(store.path)
+
+    def test_file_of_dead_process_is_reused(self):
+        counter = self.register(metrics.Counter('test_restarts_total', 'Тест'))
+        counter.inc()
+        path = metrics._get_store().path
+        # Закрытие файла снимает flock - как при завершении воркера
+        metrics.reset_store()
+        counter.inc()
+        self.assertEqual(metrics._get_store().path, path)
+        self.assertEqual(list(metrics.get_metrics_dir().glob('*.db')), [path])
+        self.assertIn('test_restarts_total 2\n', metrics.generate_latest())
+
+    def test_threads_share_process_file(self):
+        counter = self.register(metrics.Counter('test_threads_total', 'Тест'))
+
+        def work():
+            for _ in range(100):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc()
+        self.assertEqual(len(list(metrics.get_metrics_dir().glob('*.db'))), 1)
+        self.assertIn('test_threads_total 401\n', metrics.generate_latest())
+
+    def test_histogram_exposition_is_cumulative(self):
+        histogram = self.register(metrics.Histogram('test_latency_seconds', 'Тест', buckets=(0.1, 1.0)))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        text = metrics.generate_latest()
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 3\n', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('test_latency_seconds_count 4\n', text)
+        self.assertIn('test_latency_seconds_sum 4.25\n', text)
+
+
+class MetricsViewTests(MetricsDirMixin, TestCase):
+    """/metrics закрыт по умолчанию"""
+
+    def get(self, **extra):
+        return self.client.get(reverse('metrics'), **extra)
+
+    def test_loopback_only_by_default(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('# TYPE marketplace_cart_adds_total counter', response.content.decode())
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.5').status_code, 403)
+
+    def test_token(self):
+        with override_settings(MARKETPLACE_METRICS={'ALLOWED_IPS': [], 'TOKEN': 's3cret'}):
+            self.assertEqual(self.get().status_code, 403)
+            self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(
+                self.get(REMOTE_ADDR='10.0.0.5', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200,
+            )
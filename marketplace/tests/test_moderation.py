@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from marketplace import moderation
+from marketplace.models import ModerationDecision, Product
+
+from .fixtures import PASSWORD, seed_dataset
+
+
+class ModerationQueueTests(TestCase):
+    """Очередь модерации: закрепление пачек и пакетные решения"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset()
+        cls.moderator = cls.data['admin']
+        cls.other = User.objects.create_superuser('moderator2', 'moderator2@example.com', PASSWORD)
+
+    def test_batches_do_not_overlap(self):
+        first = moderation.claim_batch(self.moderator, size=5)
+        second = moderation.claim_batch(self.other, size=5)
+        self.assertEqual(len(first), 5)
+        self.assertEqual(len(second), 5)
+        self.assertFalse({p.pk for p in first} & {p.pk for p in second})
+        # Повторный запрос возвращает ту же незавершенную пачку
+        self.assertEqual({p.pk for p in moderation.claim_batch(self.moderator, size=5)}, {p.pk for p in first})
+
+    def test_decide_applies_single_update(self):
+        batch = moderation.claim_batch(self.moderator, size=5)
+        ids = [product.pk for product in batch]
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as captured:
+                applied = moderation.decide(self.moderator, ids, ModerationDecision.APPROVED)
+        self.assertEqual(sorted(applied), sorted(ids))
+        updates = [q for q in captured.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Product.objects.filter(pk__in=ids, checked=True).count(), 5)
+        self.assertEqual(ModerationDecision.objects.filter(product_id__in=ids).count(), 5)
+
+    def test_foreign_claim_is_ignored(self):
+        batch = moderation.claim_batch(self.other, size=3)
+        applied = moderation.decide(self.moderator, [p.pk for p in batch], ModerationDecision.REJECTED)
+        self.assertEqual(applied, [])
+
+    def test_signal_sent_once_per_batch(self):
+        calls = []
+
+        def receiver(sender, product_ids, decision, **kwargs):
+            calls.append((sorted(product_ids), decision))
+
+        moderation.products_moderated.connect(receiver)
+        self.addCleanup(moderation.products_moderated.disconnect, receiver)
+        ids = [p.pk for p in moderation.claim_batch(self.moderator, size=4)]
+        with self.captureOnCommitCallbacks(execute=True):
+            moderation.decide(self.moderator, ids, ModerationDecision.REJECTED)
+        self.assertEqual(calls, [(sorted(ids), ModerationDecision.REJECTED)])
+
+    def test_admin_moderation_view(self):
+        self.client.force_login(self.moderator)
+        url = reverse('admin:marketplace_product_moderation')
+        # Просмотр страницы ничего не закрепляет
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['batch'], [])
+        self.assertFalse(Product.objects.filter(moderation_claimed_by=self.moderator).exists())
+
+        response = self.client.post(url, {'claim': '1'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        ids = [product.pk for product in self.client.get(url).context['batch']]
+        self.assertTrue(ids)
+        response = self.client.post(url, {'approved': ids[:2], 'rejected': ids[2:]})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertEqual(Product.objects.filter(pk__in=ids, moderated_at__isnull=False).count(), len(ids))
+        self.assertEqual(Product.objects.filter(pk__in=ids[:2], checked=True).count(), 2)
+
+    def test_admin_action_revokes_approval(self):
+        product_id = moderation.queue_queryset().values_list('id', flat=True).first()
+        moderation.decide(self.moderator, [product_id], ModerationDecision.APPROVED, require_claim=False)
+        self.client.force_login(self.moderator)
+        response = self.client.post(
+            reverse('admin:marketplace_product_changelist'),
+            {'action': 'reject_selected', '_selected_action': [product_id]},
+            follow=True,
+        )
+        self.assertContains(response, 'Отклонено: 1')
+        self.assertFalse(Product.objects.get(pk=product_id).checked)
+        self.assertEqual(
+            list(ModerationDecision.objects.filter(product_id=product_id).values_list('decision', flat=True)
+                 .order_by('id')),
+            [ModerationDecision.APPROVED, ModerationDecision.REJECTED],
+        )
+        # Пакетная модерация уже проверенные продукты не трогает
+        self.assertEqual(moderation.decide(self.moderator, [product_id], ModerationDecision.APPROVED), [])
@@ -0,0 +1,160 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import events, page_cache
+from marketplace.models import HotPage, Task
+
+from .fixtures import seed_dataset
+
+PAGE_CACHE = {
+    'ENABLED': True,
+    'CACHE': 'pages',
+    'FLUSH_INTERVAL': 3600,
+    'TOP_K': 3,
+    'WARM_CONCURRENCY': 1,
+    'WARM_PAUSE': 0,
+}
+
+
+def isolate_page_cache(test_case):
+    """
+    Кеш страниц в файлах временного каталога: clear() не трогает var/page_cache
+    и общий Redis. LocMem не подходит - вне DEBUG кеш страниц в нем отключается.
+    """
+    directory = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, directory)
+    pages = {'BACKEND': 'marketplace.cache_backends.InstrumentedFileBasedCache', 'LOCATION': directory}
+    settings_override = override_settings(CACHES={**settings.CACHES, 'pages': pages})
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+
+
+class SketchTests(TestCase):
+
+    def test_count_min_never_underestimates(self):
+        sketch = page_cache.CountMinSketch(width=16, depth=3)
+        counts = {f'/catalog/?q={index}': index % 7 + 1 for index in range(50)}
+        for key, count in counts.items():
+            sketch.add(key, count)
+        for key, count in counts.items():
+            self.assertGreaterEqual(sketch.estimate(key), count)
+
+    def test_top_k_keeps_heavy_hitters(self):
+        sketch = page_cache.CountMinSketch(width=1024, depth=4)
+        top = page_cache.TopK(2)
+        stream = ['/'] * 30 + [f'/products/{index}/' for index in range(20)] + ['/catalog/'] * 20
+        for key in stream:
+            top.offer(key, sketch.add(key), key)
+        self.assertEqual(set(top.items), {'/', '/catalog/'})
+
+
+@override_settings(PAGE_CACHE=PAGE_CACHE)
+class PageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2, products_per_seller=5)
+        cls.product = cls.data['checked_products'][0]
+
+    def setUp(self):
+        isolate_page_cache(self)
+        patcher = mock.patch.object(page_cache, 'recorder', page_cache.TrafficRecorder())
+        self.recorder = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_pages_served_from_cache(self):
+        url = reverse('catalog')
+        first = self.client.get(url, {'sort': 'name', 'q': 'Товар'})
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        # Другой порядок параметров и лишний параметр - та же сигнатура
+        with self.assertNumQueries(0):
+            second = self.client.get(f'{url}?q=Товар&utm_source=mail&sort=name')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+
+    def test_visitors_with_session_bypass_cache(self):
+        session = self.client.session
+        session['client_id'] = self.data['clients'][0].pk
+        session['client_email'] = self.data['clients'][0].email
+        session.save()
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Page-Cache', response)
+
+    def test_catalog_change_invalidates_and_schedules_warming(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Новое название'
+            self.product.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Новое название')
+        # Прогрев ставит подписчик outbox при рассылке
+        events.dispatch()
+        self.assertEqual(Task.objects.filter(name__endswith='warm_page_cache', status=Task.QUEUED).count(), 1)
+
+    def test_product_change_invalidates_dependent_pages_only(self):
+        shown = {}
+        for product in self.data['checked_products']:
+            response = self.client.get(reverse('product_detail', args=[product.pk]))
+            shown[product.pk] = set(response.wsgi_request.page_cache_products)
+        self.client.get(reverse('index'))
+        related = {pk for pk, products in shown.items() if self.product.pk in products}
+        unrelated = set(shown) - related - {self.product.pk}
+        self.assertTrue(unrelated)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price += 1
+            self.product.save()
+
+        for pk in shown:
+            expected = 'hit' if pk in unrelated else 'miss'
+            self.assertEqual(self.client.get(reverse('product_detail', args=[pk]))['X-Page-Cache'], expected)
+        self.assertEqual(self.client.get(reverse('index'))['X-Page-Cache'], 'miss')
+
+    def test_tag_change_invalidates_everything(self):
+        other = self.data['checked_products'][-1]
+        urls = [reverse('index'), reverse('product_detail', args=[other.pk])]
+        for url in urls:
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = self.data['tags'][0]
+            tag.tagtitle = 'Новый тег'
+            tag.save()
+        for url in urls:
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+
+    def test_local_cache_disabled_outside_debug(self):
+        locmem = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'pages': {'BACKEND': 'marketplace.cache_backends.InstrumentedLocMemCache', 'LOCATION': 'pages'},
+        }
+        with override_settings(CACHES=locmem):
+            with self.assertLogs('marketplace.page_cache', 'WARNING'):
+                self.assertFalse(page_cache.PageCacheMiddleware(lambda request: None).enabled)
+            with override_settings(DEBUG=True):
+                self.assertTrue(page_cache.PageCacheMiddleware(lambda request: None).enabled)
+
+    def test_warm_renders_hot_pages(self):
+        hot_url = reverse('product_detail', args=[self.product.pk])
+        for _ in range(3):
+            self.client.get(hot_url)
+        self.client.get(reverse('catalog'), {'sort': 'price_asc'})
+        self.recorder.flush()
+        self.assertEqual(HotPage.objects.get(path=hot_url).hits, 3)
+        self.assertEqual(page_cache.hot_pages(1)[0][1], hot_url)
+
+        page_cache.get_cache().clear()
+        with self.assertLogs('marketplace.page_cache', 'INFO'):
+            self.assertEqual(page_cache.warm(limit=3), 3)
+        self.assertEqual(self.client.get(hot_url)['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(reverse('index'))['X-Page-Cache'], 'hit')
@@ -0,0 +1,73 @@
+import threading
+from unittest import mock
+
+from django.contrib.auth import hashers
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from marketplace import passwords
+from marketplace.models import Client, Seller
+
+from .fixtures import PASSWORD, seed_dataset
+
+
+@override_settings(THROTTLING={'ENABLED': False})
+class PasswordHashingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=1, products_per_seller=2, clients=1, cart_lines=1)
+
+    def setUp(self):
+        self.client_obj = self.data['clients'][0]
+        self.seller = self.data['sellers'][0]
+
+    def test_authenticate(self):
+        self.assertTrue(self.client_obj.password.startswith('scrypt$'))
+        self.assertEqual(passwords.authenticate(Client, self.client_obj.email, PASSWORD), self.client_obj)
+        self.assertIsNone(passwords.authenticate(Client, self.client_obj.email, 'wrong'))
+        # Продавец не входит формой клиента
+        self.assertIsNone(passwords.authenticate(Client, self.seller.email, PASSWORD))
+
+    def test_unknown_email_does_same_hashing_work(self):
+        with mock.patch.object(hashers, 'check_password', wraps=hashers.check_password) as check:
+            self.assertIsNone(passwords.authenticate(Seller, 'nobody@example.com', PASSWORD))
+        check.assert_called_once()
+        self.assertTrue(check.call_args.args[1].startswith('scrypt$'))
+
+    def test_hashing_runs_in_bounded_pool(self):
+        self.assertTrue(passwords.run(lambda: threading.current_thread().name).startswith('password-hash'))
+
+    def test_legacy_hash_rehashed_on_login(self):
+        Seller.objects.filter(pk=self.seller.pk).update(password=hashers.make_password(PASSWORD, hasher='pbkdf2_sha256'))
+        response = self.client.post(reverse('seller_login'), {'email': self.seller.email, 'password': PASSWORD})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.seller.refresh_from_db()
+        self.assertTrue(self.seller.password.startswith('scrypt$16384$'))
+        self.assertTrue(self.seller.check_password(PASSWORD))
+
+        with override_settings(PASSWORD_HASHING={'SCRYPT': {'work_factor': 2 ** 13, 'block_size': 8, 'parallelism': 1}}):
+            self.assertEqual(passwords.authenticate(Seller, self.seller.email, PASSWORD), self.seller)
+        self.seller.refresh_from_db()
+        self.assertTrue(self.seller.password.startswith('scrypt$8192$'))
+
+    def test_login_error_does_not_reveal_email(self):
+        url = reverse('client_login')
+        unknown = self.client.post(url, {'email': 'nobody@example.com', 'password': PASSWORD})
+        wrong = self.client.post(url, {'email': self.client_obj.email, 'password': 'wrong'})
+        self.assertContains(unknown, 'Неверный email или пароль')
+        self.assertContains(wrong, 'Неверный email или пароль')
+
+    def test_registration_is_single_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('client_register_api'), {
+                'email': 'new@example.com', 'first_name': 'Иван', 'last_name': 'Петров',
+                'password': PASSWORD, 'password_confirm': PASSWORD,
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        writes = [query['sql'] for query in queries if not query['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+        self.assertIsNotNone(passwords.authenticate(Client, 'new@example.com', PASSWORD))
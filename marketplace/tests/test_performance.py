@@ -0,0 +1,265 @@
+"""
+Бюджеты производительности для представлений из marketplace/urls.py.
+
+Каждому представлению назначен бюджет: максимальное число SQL-запросов
+и время ответа на тестовом наборе данных. Превышение бюджета валит сборку,
+поэтому исправленные N+1 не возвращаются незаметно.
+
+Время зависит от машины; множитель PERF_BUDGET_TIME_FACTOR (по умолчанию 1)
+позволяет ослабить временные бюджеты на медленном CI, не трогая бюджеты запросов.
+"""
+import os
+import shutil
+import tempfile
+import time
+from typing import NamedTuple
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from marketplace import suggest
+from marketplace.models import ProductRecommendation
+
+from .fixtures import seed_dataset
+
+
+class Budget(NamedTuple):
+    queries: int
+    ms: float
+
+
+PERF_BUDGETS = {
+    # Витрина
+    'index': Budget(queries=3, ms=250),
+    'catalog': Budget(queries=4, ms=400),
+    'catalog_filtered': Budget(queries=4, ms=400),
+    'product_detail': Budget(queries=6, ms=250),
+    'product_stream': Budget(queries=1, ms=150),
+    'search_suggest': Budget(queries=0, ms=20),
+    # Аутентификация
+    'client_register': Budget(queries=0, ms=150),
+    'client_login': Budget(queries=0, ms=150),
+    'seller_login': Budget(queries=0, ms=150),
+    # Корзина
+    'cart': Budget(queries=4, ms=250),
+    # +1: адреса вебхуков продавца при холодном кеше (cart.added пишется в outbox);
+    # у изменений корзины +1: строка outbox доменных событий
+    'add_to_cart': Budget(queries=9, ms=200),
+    'update_cart_item': Budget(queries=6, ms=150),
+    'remove_from_cart': Budget(queries=6, ms=150),
+    # Панель продавца
+    'seller_dashboard': Budget(queries=4, ms=300),
+    'seller_products': Budget(queries=5, ms=300),
+    'seller_product_create': Budget(queries=3, ms=250),
+    'seller_product_edit': Budget(queries=7, ms=250),
+    # API
+    'product-list': Budget(queries=3, ms=250),
+    'product-detail': Budget(queries=2, ms=150),
+    'product-similar': Budget(queries=4, ms=150),
+    'product-also-added': Budget(queries=2, ms=150),
+    'tag-list': Budget(queries=2, ms=150),
+    'tag-detail': Budget(queries=1, ms=150),
+    # Админка
+    'admin:marketplace_product_changelist': Budget(queries=7, ms=800),
+    'admin:marketplace_tag_changelist': Budget(queries=5, ms=500),
+    'admin:marketplace_seller_changelist': Budget(queries=5, ms=500),
+    'admin:marketplace_client_changelist': Budget(queries=5, ms=500),
+    'admin:marketplace_productphoto_changelist': Budget(queries=6, ms=800),
+    'admin:marketplace_cartitem_changelist': Budget(queries=6, ms=500),
+}
+
+TIME_FACTOR = float(os.environ.get('PERF_BUDGET_TIME_FACTOR', '1'))
+
+
+# Бюджеты меряют рендер представлений, а не попадания в кеш страниц
+@override_settings(PERF_INSTRUMENTATION={'ENABLED': False}, PAGE_CACHE={'ENABLED': False})
+class ViewBudgetTests(TestCase):
+    """Проверка бюджетов запросов и времени для каждого представления"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset()
+        cls.product = cls.data['checked_products'][0]
+        cls.seller = cls.product.seller
+        cls.client_user = cls.data['clients'][0]
+        # Рекомендации для проверки бюджетов с непустым блоком "также добавляют"
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(product=cls.product, recommended=recommended, rank=rank, score=1.0 / (rank + 1))
+            for rank, recommended in enumerate(cls.data['checked_products'][1:6])
+        ])
+
+    def login_client(self):
+        # Те же ключи сессии, что выставляет auth_views.client_login
+        session = self.client.session
+        session['client_id'] = self.client_user.pk
+        session['client_email'] = self.client_user.email
+        session['client_name'] = f'{self.client_user.first_name} {self.client_user.last_name}'
+        session.save()
+
+    def login_seller(self):
+        session = self.client.session
+        session['seller_id'] = self.seller.pk
+        session['seller_email'] = self.seller.email
+        session['seller_company'] = self.seller.company_name
+        session.save()
+
+    def assertWithinBudget(self, budget_name, url, method='get', data=None, expected_status=200):
+        budget = PERF_BUDGETS[budget_name]
+        # Прогрев: кеши URL-резолвера, шаблонов, ContentType и т.п.
+        # не должны попадать в измерение
+        if method == 'get':
+            self.client.get(url, data)
+
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(url, data)
+            if response.streaming:
+                b''.join(response)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        self.assertEqual(response.status_code, expected_status, f'{budget_name}: неожиданный статус')
+        queries = '\n'.join(query['sql'] for query in captured.captured_queries)
+        self.assertLessEqual(
+            len(captured), budget.queries,
+            f'{budget_name}: {len(captured)} SQL-запросов при бюджете {budget.queries}\n{queries}',
+        )
+        self.assertLessEqual(
+            elapsed_ms, budget.ms * TIME_FACTOR,
+            f'{budget_name}: {elapsed_ms:.1f} мс при бюджете {budget.ms * TIME_FACTOR:.0f} мс',
+        )
+        return response
+
+    # Витрина
+
+    def test_index(self):
+        self.assertWithinBudget('index', reverse('index'))
+
+    def test_catalog(self):
+        self.assertWithinBudget('catalog', reverse('catalog'))
+
+    def test_catalog_filtered(self):
+        tags = [tag.pk for tag in self.data['tags'][:3]]
+        for params in (
+            {'q': 'Товар', 'sort': 'price_asc'},
+            {'tags': tags, 'in_stock': 'true', 'sort': 'name'},
+            {'min_price': '100', 'max_price': '200', 'sort': 'price_desc'},
+        ):
+            with self.subTest(params=params):
+                self.assertWithinBudget('catalog_filtered', reverse('catalog'), data=params)
+
+    def test_product_detail(self):
+        self.assertWithinBudget('product_detail', reverse('product_detail', args=[self.product.pk]))
+
+    def test_product_stream(self):
+        ids = ','.join(str(product.pk) for product in self.data['checked_products'][:10])
+        self.assertWithinBudget('product_stream', reverse('product_stream') + f'?ids={ids}')
+
+    def test_search_suggest(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(suggest.reset)
+        with override_settings(SEARCH_SUGGEST={'PATH': os.path.join(directory, 'suggest.idx')}):
+            with self.assertLogs('marketplace.tasks', 'INFO'):
+                suggest.build(full=True)
+            suggest.reset()
+            self.assertWithinBudget('search_suggest', reverse('search_suggest'), data={'q': 'товар 1'})
+
+    # Аутентификация
+
+    def test_auth_pages(self):
+        for name in ('client_register', 'client_login', 'seller_login'):
+            with self.subTest(view=name):
+                self.assertWithinBudget(name, reverse(name))
+
+    # Корзина
+
+    def test_cart(self):
+        self.login_client()
+        self.assertWithinBudget('cart', reverse('cart'))
+
+    def test_add_to_cart(self):
+        self.login_client()
+        product = self.data['checked_products'][-1]
+        product.stock = 10
+        product.save()
+        self.assertWithinBudget(
+            'add_to_cart', reverse('add_to_cart', args=[product.pk]),
+            method='post', data={'quantity': 1}, expected_status=302,
+        )
+
+    def test_update_and_remove_cart_item(self):
+        self.login_client()
+        cart_item = self.client_user.cart_items.first()
+        self.assertWithinBudget(
+            'update_cart_item', reverse('update_cart_item', args=[cart_item.pk]),
+            method='post', data={'quantity': 1}, expected_status=302,
+        )
+        self.assertWithinBudget(
+            'remove_from_cart', reverse('remove_from_cart', args=[cart_item.pk]),
+            method='post', expected_status=302,
+        )
+
+    # Панель продавца
+
+    def test_seller_dashboard(self):
+        self.login_seller()
+        self.assertWithinBudget('seller_dashboard', reverse('seller_dashboard'))
+
+    def test_seller_products(self):
+        self.login_seller()
+        for status_filter in ('all', 'checked', 'unchecked'):
+            with self.subTest(status=status_filter):
+                self.assertWithinBudget('seller_products', reverse('seller_products'), data={'status': status_filter})
+
+    def test_seller_product_forms(self):
+        self.login_seller()
+        self.assertWithinBudget('seller_product_create', reverse('seller_product_create'))
+        self.assertWithinBudget('seller_product_edit', reverse('seller_product_edit', args=[self.product.pk]))
+
+    # API
+
+    def test_api_products(self):
+        self.assertWithinBudget('product-list', reverse('product-list'))
+        self.assertWithinBudget('product-detail', reverse('product-detail', args=[self.product.pk]))
+        self.assertWithinBudget('product-similar', reverse('product-similar', args=[self.product.pk]))
+        self.assertWithinBudget('product-also-added', reverse('product-also-added', args=[self.product.pk]))
+
+    def test_api_tags(self):
+        self.assertWithinBudget('tag-list', reverse('tag-list'))
+        self.assertWithinBudget('tag-detail', reverse('tag-detail', args=[self.data['tags'][0].pk]))
+
+    # Админка
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.data['admin'])
+        for model in ('product', 'tag', 'seller', 'client', 'productphoto', 'cartitem'):
+            name = f'admin:marketplace_{model}_changelist'
+            with self.subTest(changelist=name):
+                self.assertWithinBudget(name, reverse(name))
+
+    def test_admin_changelists_sorted_by_annotations(self):
+        # Колонки-счетчики сортируются по аннотациям, не выходя за бюджет
+        self.client.force_login(self.data['admin'])
+        for model, column in (('product', 8), ('tag', 2), ('seller', 5), ('cartitem', 4)):
+            name = f'admin:marketplace_{model}_changelist'
+            with self.subTest(changelist=name):
+                response = self.assertWithinBudget(name, reverse(name), data={'o': f'-{column}'})
+                self.assertEqual(response.context['cl'].get_ordering_field_columns(), {column: 'desc'})
+
+
+class BudgetCoverageTests(TestCase):
+    """Каждое представление витрины, корзины и панели продавца должно иметь бюджет"""
+
+    def test_every_marketplace_view_has_budget(self):
+        from marketplace import urls
+
+        exempt = {
+            'logout', 'seller_product_delete', 'perf_stats', 'metrics',
+            'client_register_api', 'seller_register_api', 'seller_profile', 'client_profile',
+            'api-root', 'api-root-format',
+        }
+        names = {pattern.name for pattern in urls.urlpatterns if getattr(pattern, 'name', None)}
+        missing = sorted(names - exempt - set(PERF_BUDGETS))
+        self.assertEqual(missing, [], f'Нет бюджета производительности для: {missing}')
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace import events, recommendations, tasks
+from marketplace.models import CartItem, Client, ProductRecommendation, Task
+
+from .fixtures import seed_dataset
+
+BASKETS = [([], [1, 2, 3]), ([], [1, 2]), ([], [2, 4]), ([], [5, 1])]
+
+
+class CooccurrenceMatrixTests(SimpleTestCase):
+
+    def test_scores_normalized_by_popularity(self):
+        matrix = recommendations.CooccurrenceMatrix()
+        matrix.add(BASKETS)
+        # 1 и 2 добавляли по три раза, вместе - дважды
+        self.assertEqual(matrix.rows[1][2], 2)
+        self.assertEqual(matrix.counts[2], 3)
+        top = matrix.top(1, 10, allowed={2, 3, 4, 5})
+        self.assertEqual([product for product, _ in top], [2, 3, 5])
+        self.assertAlmostEqual(top[0][1], 2 / 3)
+        self.assertEqual(matrix.top(1, 10, allowed={3}), [(3, top[1][1])])
+
+    def test_decay_prunes_and_state_round_trip(self):
+        matrix = recommendations.CooccurrenceMatrix()
+        matrix.add(BASKETS)
+        matrix.decay(0.04, prune=0.05)
+        self.assertNotIn(3, matrix.rows[1])
+        self.assertIn(2, matrix.rows[1])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'state.bin')
+        recommendations.save_state(path, matrix, 42, timezone.now())
+        loaded, watermark, _ = recommendations.load_state(path, recommendations.CooccurrenceMatrix)
+        self.assertEqual(watermark, 42)
+        self.assertEqual(dict(loaded.rows), dict(matrix.rows))
+        self.assertEqual(dict(loaded.counts), dict(matrix.counts))
+
+    @unittest.skipIf(recommendations.sparse is None, 'NumPy/SciPy не установлены')
+    def test_sparse_matrix_matches_dictionaries(self):
+        plain, sparse = recommendations.CooccurrenceMatrix(), recommendations.SparseCooccurrenceMatrix()
+        for matrix in (plain, sparse):
+            matrix.add(BASKETS[:2])
+            matrix.decay(0.5, prune=0.05)
+            matrix.add(BASKETS[2:])
+        allowed = {1, 2, 3, 4, 5}
+        for product in allowed:
+            expected = plain.top(product, 3, allowed)
+            actual = sparse.top(product, 3, allowed)
+            self.assertEqual([item for item, _ in actual], [item for item, _ in expected])
+            for (_, left), (_, right) in zip(actual, expected):
+                self.assertAlmostEqual(left, right)
+
+
+@override_settings(PAGE_CACHE={'ENABLED': False})
+class RecommendationBuildTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2, products_per_seller=8, clients=4, cart_lines=4)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'state.bin')
+        settings_override = override_settings(RECOMMENDATIONS={'STATE_PATH': self.path, 'CHUNK_SIZE': 5})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def build(self, full=False):
+        with self.assertLogs('marketplace.tasks', 'INFO'):
+            return recommendations.build(full=full)
+
+    def stored(self):
+        return {
+            (row.product_id, row.rank): (row.recommended_id, round(row.score, 5))
+            for row in ProductRecommendation.objects.all()
+        }
+
+    def test_incremental_matches_full_rebuild(self):
+        events, _ = self.build()
+        self.assertEqual(events, CartItem.objects.count())
+        self.assertTrue(ProductRecommendation.objects.exists())
+
+        products = self.data['checked_products']
+        client = Client.objects.create(email='new@example.com', first_name='Новый', last_name='Клиент')
+        CartItem.objects.bulk_create([
+            CartItem(client=client, product=product, quantity=1) for product in products[:3]
+        ] + [CartItem(client=self.data['clients'][0], product=products[-1], quantity=1)])
+        events, affected = self.build()
+        self.assertEqual(events, 4)
+        self.assertLess(affected, len(products))
+        incremental = self.stored()
+
+        self.build(full=True)
+        # Оценки могут разойтись в последних знаках: затухание за секунды между сборками
+        self.assertEqual(incremental, self.stored())
+
+    def test_old_carts_decay(self):
+        product, first, second = self.data['checked_products'][:3]
+        clients = Client.objects.bulk_create([
+            Client(email=f'decay{index}@example.com', first_name='Имя', last_name='Фамилия') for index in range(3)
+        ])
+        CartItem.objects.all().delete()
+        CartItem.objects.bulk_create([
+            CartItem(client=clients[0], product=product, quantity=1),
+            CartItem(client=clients[0], product=first, quantity=1),
+            CartItem(client=clients[1], product=product, quantity=1),
+            CartItem(client=clients[1], product=first, quantity=1),
+        ])
+        CartItem.objects.update(created_at=timezone.now() - timedelta(days=120))
+        CartItem.objects.bulk_create([
+            CartItem(client=clients[2], product=product, quantity=1),
+            CartItem(client=clients[2], product=second, quantity=1),
+        ])
+        self.build(full=True)
+        # Две старые корзины весят меньше одной свежей
+        self.assertEqual(
+            list(recommendations.also_added(product.pk).values_list('id', flat=True)), [second.pk, first.pk],
+        )
+
+    def test_api_and_product_page(self):
+        self.build()
+        product_id = ProductRecommendation.objects.values_list('product_id', flat=True).first()
+        expected = list(recommendations.also_added(product_id).values_list('id', flat=True))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product-also-added', args=[product_id]))
+        self.assertEqual([item['id'] for item in response.json()], expected)
+        self.assertEqual(self.client.get(reverse('product-also-added', args=[10 ** 9])).json(), [])
+
+        page = self.client.get(reverse('product_detail', args=[product_id]))
+        self.assertContains(page, 'С этим товаром также добавляют')
+        self.assertContains(page, reverse('product_detail', args=[expected[0]]))
+
+    def test_cart_add_schedules_rebuild_once(self):
+        client, product = self.data['clients'][0], self.data['checked_products'][-1]
+        with mock.patch.object(tasks, '_recommendations_scheduled_at', [float('-inf')]):
+            with self.captureOnCommitCallbacks(execute=True):
+                CartItem.objects.create(client=client, product=product, quantity=1)
+            with self.captureOnCommitCallbacks(execute=True):
+                CartItem.objects.create(client=client, product=self.data['checked_products'][-2], quantity=1)
+            # Обе строки корзин приходят подписчику одной пачкой
+            events.dispatch()
+        self.assertEqual(Task.objects.filter(dedup_key='recommendations-rebuild').count(), 1)
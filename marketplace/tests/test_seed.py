@@ -0,0 +1,68 @@
+from io import StringIO
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import LiveServerTestCase, TestCase, override_settings
+
+from marketplace.models import CartItem, Client, Product, Seller, SellerStats, Tag
+
+SEED_OPTIONS = {
+    'sellers': 3, 'tags': 5, 'products': 40, 'clients': 4, 'cart_lines': 30,
+    'chunk_size': 7, 'photos_per_product': 0,
+}
+
+
+def seed(**options):
+    call_command('seed_marketplace', stdout=StringIO(), **dict(SEED_OPTIONS, **options))
+
+
+class SeedMarketplaceTests(TestCase):
+
+    def test_generates_requested_rows(self):
+        seed()
+        self.assertEqual(Seller.objects.count(), 3)
+        self.assertEqual(Tag.objects.count(), 5)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Product.tags.through.objects.count(), 40 * 3)
+        self.assertTrue(0 < CartItem.objects.count() <= 30)
+        # Счетчики продавцов пересчитаны после bulk_create
+        stats = SellerStats.objects.get(seller=Product.objects.first().seller)
+        self.assertEqual(stats.total_products, Product.objects.filter(seller=stats.seller).count())
+
+    def test_second_run_appends(self):
+        seed()
+        seed(seed=7)
+        self.assertEqual(Seller.objects.count(), 6)
+        self.assertEqual(Client.objects.count(), 8)
+        self.assertEqual(Tag.objects.count(), 10)
+        self.assertEqual(Product.objects.count(), 80)
+        self.assertTrue(Seller.objects.filter(email='seller5@seed.local').exists())
+        self.assertTrue(Client.objects.filter(email='client7@seed.local').exists())
+
+
+@override_settings(THROTTLING={'ENABLED': False}, PERF_INSTRUMENTATION={'ENABLED': False})
+class LoadtestTests(LiveServerTestCase):
+    """Нагрузочный тест против живого сервера на сгенерированных данных"""
+
+    def setUp(self):
+        # Сброс БД между TransactionTestCase не трогает кеши: адреса вебхуков и
+        # сессии прошлых тестов указывали бы на строки с теми же id
+        for cache in caches.all():
+            cache.clear()
+
+    def test_reports_percentiles(self):
+        seed(products=20, checked_ratio=1.0)
+        out = StringIO()
+        # Один пользователь: тестовая SQLite в памяти - одно соединение на все потоки сервера
+        call_command(
+            'loadtest', base_url=self.live_server_url, users=1, duration=1, seed=1,
+            scenario=['browse:3', 'search:1', 'cart:1'], stdout=out,
+        )
+        report = out.getvalue()
+        rows = {line.split()[0]: line.split()[1:] for line in report.splitlines()[2:] if line and line[0] != '-'}
+        for name in ('index', 'catalog', 'product_detail', 'catalog_search'):
+            self.assertIn(name, rows)
+        count, errors = int(rows['ИТОГО'][0]), int(rows['ИТОГО'][1])
+        self.assertGreater(count, 0)
+        self.assertEqual(errors, 0, report)
+        self.assertIn('RPS', report)
@@ -0,0 +1,78 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from marketplace import events, seller_stats
+from marketplace.models import Product, SellerStats
+from marketplace.serializers import SellerSerializer
+
+from .fixtures import seed_dataset
+
+
+class SellerStatsTests(TestCase):
+    """Инкрементальные счетчики продавца совпадают с пересчетом по таблице продуктов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2, products_per_seller=8)
+        cls.seller, cls.other_seller = cls.data['sellers']
+        # seed_dataset использует bulk_create - начальные счетчики строятся пересчетом
+        seller_stats.refresh([cls.seller.pk, cls.other_seller.pk])
+
+    def assertCountersExact(self, seller):
+        stored = SellerStats.objects.values(*seller_stats.COUNTER_FIELDS).get(seller=seller)
+        self.assertEqual(stored, seller_stats.aggregate_counters([seller.pk])[seller.pk])
+
+    def test_incremental_updates(self):
+        product = Product.objects.create(
+            title='Новый товар', description='-', price=Decimal('10.50'), stock=3, seller=self.seller,
+        )
+        self.assertCountersExact(self.seller)
+
+        product = Product.objects.get(pk=product.pk)
+        product.stock = 0
+        product.checked = True
+        product.price = Decimal('99.99')
+        product.save()
+        self.assertCountersExact(self.seller)
+
+        product.seller = self.other_seller
+        product.save()
+        self.assertCountersExact(self.seller)
+        self.assertCountersExact(self.other_seller)
+
+        product.delete()
+        self.assertCountersExact(self.other_seller)
+
+    def test_deferred_fields_fall_back_to_refresh(self):
+        product = Product.objects.filter(seller=self.seller).only('id', 'title', 'seller').first()
+        product.title = 'Переименован'
+        product.save()
+        self.assertCountersExact(self.seller)
+
+    def test_bulk_update_refreshed_by_subscriber(self):
+        products = Product.objects.filter(seller=self.seller)
+        products.update(stock=0)
+        self.assertNotEqual(SellerStats.objects.get(seller=self.seller).out_of_stock_products, products.count())
+        events.dispatch()
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).out_of_stock_products, products.count())
+        self.assertCountersExact(self.seller)
+
+        product = products.first()
+        product.price = Decimal('1.00')
+        Product.objects.bulk_update([product], ['price'])
+        events.dispatch()
+        self.assertCountersExact(self.seller)
+
+    def test_reconcile_repairs_drift(self):
+        SellerStats.objects.filter(seller=self.seller).update(total_products=999, inventory_value=0)
+        call_command('reconcile_seller_stats', stdout=StringIO())
+        self.assertCountersExact(self.seller)
+
+    def test_serializer_reads_counter(self):
+        seller = type(self.seller).objects.select_related('stats').get(pk=self.seller.pk)
+        with self.assertNumQueries(0):
+            data = SellerSerializer(seller).data
+        self.assertEqual(data['products_count'], 8)
@@ -0,0 +1,156 @@
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace import sessions
+
+from .fixtures import PASSWORD, seed_dataset
+
+
+class SharedCacheMixin:
+    """Общий для процессов кеш сессий (файлы во временном каталоге)"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = {'BACKEND': 'marketplace.cache_backends.InstrumentedFileBasedCache', 'LOCATION': directory}
+        settings_override = override_settings(CACHES={**settings.CACHES, 'sessions': shared})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        sessions._pending.clear()
+        self.addCleanup(sessions._pending.clear)
+
+
+class SessionStoreTests(SharedCacheMixin, TestCase):
+
+    def create(self, **data):
+        store = sessions.SessionStore()
+        store.update(data)
+        store.create()
+        return store.session_key
+
+    def test_unchanged_session_is_not_written(self):
+        key = self.create(client_id=1, client_name='Иван Петров')
+        store = sessions.SessionStore(key)
+        with self.assertNumQueries(0):
+            store['client_id'] = 1
+            store['client_name'] = 'Иван Петров'
+            self.assertTrue(store.modified)
+            store.save()
+        self.assertEqual(sessions._pending, {})
+
+    def test_changes_go_to_cache_then_database(self):
+        key = self.create(client_id=1)
+        store = sessions.SessionStore(key)
+        with self.assertNumQueries(0):
+            store['cart_hint'] = 3
+            store.save()
+        self.assertEqual(sessions.SessionStore(key)['cart_hint'], 3)
+        # Без кеша данные берутся из очереди отложенных записей
+        sessions._cache().clear()
+        self.assertEqual(sessions.SessionStore(key)['cart_hint'], 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sessions.write_pending(), 1)
+        sessions._cache().clear()
+        self.assertEqual(Session.objects.get(session_key=key).get_decoded()['cart_hint'], 3)
+        self.assertEqual(sessions.SessionStore(key)['cart_hint'], 3)
+
+    def test_session_near_expiry_is_refreshed(self):
+        key = self.create(client_id=1)
+        store = sessions.SessionStore(key)
+        store.load()
+        store._stored = (store._stored[0], store._stored[1] - store.get_expiry_age() * 0.75)
+        store.modified = True
+        store.save()
+        self.assertIn(key, sessions._pending)
+
+    def test_delete_drops_pending_write(self):
+        key = self.create(client_id=1)
+        store = sessions.SessionStore(key)
+        store['client_id'] = 2
+        store.save()
+        store.flush()
+        self.assertEqual(sessions._pending, {})
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        self.assertEqual(sessions.SessionStore(key).load(), {})
+
+    def test_pending_write_does_not_resurrect_deleted_session(self):
+        key = self.create(client_id=1)
+        store = sessions.SessionStore(key)
+        store['client_id'] = 2
+        store.save()
+        # Выход в другом процессе: строка удалена, отложенная запись осталась здесь
+        Session.objects.filter(session_key=key).delete()
+        with self.assertNumQueries(2):
+            self.assertEqual(sessions.write_pending(), 0)
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        self.assertEqual(sessions.SessionStore(key).load(), {})
+
+    @override_settings(SESSION_STORE={'CLEAR_CHUNK_SIZE': 2, 'CLEAR_PAUSE': 0})
+    def test_clear_expired_in_chunks(self):
+        expired = timezone.now() - timedelta(days=1)
+        Session.objects.bulk_create(
+            [Session(session_key=f'expired{index:02d}', session_data='', expire_date=expired) for index in range(5)]
+        )
+        alive = self.create(client_id=1)
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertLogs('marketplace.sessions', 'INFO'):
+                call_command('clearsessions')
+        deletes = [query for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [alive])
+
+
+class LocalCacheTests(TestCase):
+    """С кешем отдельного процесса БД остается источником данных сессии"""
+
+    def setUp(self):
+        local = {'BACKEND': 'marketplace.cache_backends.InstrumentedLocMemCache', 'LOCATION': 'sessions'}
+        settings_override = override_settings(CACHES={**settings.CACHES, 'sessions': local})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_reads_and_writes_go_to_database(self):
+        self.assertFalse(sessions.is_shared())
+        store = sessions.SessionStore()
+        store['client_id'] = 1
+        store.create()
+        # Запись другого процесса видна сразу
+        other = sessions.SessionStore(store.session_key)
+        other['client_id'] = 2
+        other.save()
+        self.assertEqual(sessions._pending, {})
+        self.assertEqual(sessions.SessionStore(store.session_key)['client_id'], 2)
+
+        Session.objects.filter(session_key=store.session_key).delete()
+        self.assertEqual(sessions.SessionStore(store.session_key).load(), {})
+
+
+@override_settings(PAGE_CACHE={'ENABLED': False}, THROTTLING={'ENABLED': False})
+class SessionMiddlewareTests(SharedCacheMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=1, products_per_seller=2, clients=1, cart_lines=1)
+
+    def test_logged_in_pages_read_session_from_cache(self):
+        client = self.data['clients'][0]
+        self.client.post(reverse('client_login'), {'email': client.email, 'password': PASSWORD})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog'))
+        self.assertContains(response, client.first_name)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+        self.assertEqual(
+            Session.objects.get(session_key=self.client.session.session_key).get_decoded()['client_id'],
+            client.id,
+        )
@@ -0,0 +1,76 @@
+import gzip
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from marketplace.compression import parse_accept_encoding
+from marketplace.staticfiles import StaticFilesMiddleware
+
+CSS = 'body { font-family: "Rennie"; }\n' * 50 + '@font-face { src: url("../fonts/Rennie.ttf"); }\n'
+
+
+class StaticPipelineTests(SimpleTestCase):
+    """collectstatic с хешами и сжатыми вариантами, раздача с согласованием кодировки"""
+
+    def setUp(self):
+        self.source = Path(tempfile.mkdtemp())
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        (self.source / 'css').mkdir()
+        (self.source / 'fonts').mkdir()
+        (self.source / 'css' / 'site.css').write_text(CSS)
+        (self.source / 'fonts' / 'Rennie.ttf').write_bytes(b'\0\1' * 4096)
+        (self.source / 'logo.jpg').write_bytes(bytes(range(256)) * 8)
+
+        settings_override = override_settings(STATICFILES_DIRS=[str(self.source)], STATIC_ROOT=str(self.root))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+        self.css_name = staticfiles_storage.stored_name('css/site.css')
+
+    def get(self, path, **headers):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse('app'))
+        return middleware(RequestFactory().get(path, **headers))
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        self.assertRegex(self.css_name, r'^css/site\.[0-9a-f]{12}\.css$')
+        hashed_css = (self.root / self.css_name).read_text()
+        # Ссылки внутри CSS переписаны на хешированные имена
+        self.assertIn(staticfiles_storage.stored_name('fonts/Rennie.ttf').split('/')[-1], hashed_css)
+        self.assertEqual(gzip.decompress((self.root / f'{self.css_name}.gz').read_bytes()).decode(), hashed_css)
+        self.assertTrue((self.root / 'css' / 'site.css.gz').exists())
+        self.assertFalse((self.root / 'logo.jpg.gz').exists())
+        self.assertEqual(staticfiles_storage.url('css/site.css'), f'/static/{self.css_name}')
+
+    def test_serves_negotiated_variant_with_immutable_caching(self):
+        response = self.get(f'/static/{self.css_name}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['Content-Type'].startswith('text/css'))
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(body, (self.root / self.css_name).read_bytes())
+
+        identity = self.get(f'/static/{self.css_name}', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', identity)
+        self.assertEqual(identity['Content-Length'], str((self.root / self.css_name).stat().st_size))
+
+        not_modified = self.get(f'/static/{self.css_name}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_unhashed_names_and_unknown_paths(self):
+        response = self.get('/static/css/site.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.get('/static/missing.css').content, b'app')
+        self.assertEqual(self.get('/catalog/').content, b'app')
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('br;q=1.0, gzip;q=0.5, zstd;q=0'), {'br', 'gzip'})
+        self.assertEqual(parse_accept_encoding(''), set())
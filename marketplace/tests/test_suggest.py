@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace import events, suggest
+from marketplace.models import Product, Task
+
+from .fixtures import seed_dataset
+
+
+class SuggestIndexMixin:
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'suggest.idx')
+        settings_override = override_settings(SEARCH_SUGGEST={'PATH': self.path, 'RELOAD_INTERVAL': 0})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        suggest.reset()
+        self.addCleanup(suggest.reset)
+
+    def titles(self, query, limit=None):
+        return [item['title'] for item in suggest.suggest(query, limit)]
+
+
+class SuggestIndexTests(SuggestIndexMixin, SimpleTestCase):
+
+    def write(self, entries, **options):
+        suggest.write_snapshot(self.path, entries, timezone.now(), **options)
+
+    def test_prefix_of_any_word(self):
+        self.write([
+            suggest.Entry(suggest.PRODUCT, 1, 5, 'Смартфон Galaxy S24'),
+            suggest.Entry(suggest.PRODUCT, 2, 9, 'Смарт-часы Ёлка'),
+            suggest.Entry(suggest.TAG, 3, 1, 'Электроника'),
+            suggest.Entry(suggest.SELLER, 4, 0, 'ООО Смарт'),
+        ])
+        self.assertEqual(self.titles('смар'), ['Смарт-часы Ёлка', 'Смартфон Galaxy S24', 'ООО Смарт'])
+        self.assertEqual(self.titles('GALAXY s'), ['Смартфон Galaxy S24'])
+        self.assertEqual(self.titles('елк'), ['Смарт-часы Ёлка'])
+        self.assertEqual(self.titles('часы  ёл'), ['Смарт-часы Ёлка'])
+        self.assertEqual(self.titles('смар', limit=1), ['Смарт-часы Ёлка'])
+        self.assertEqual(self.titles('ноутбук'), [])
+        self.assertEqual(self.titles('  '), [])
+        tag = suggest.suggest('элек')[0]
+        self.assertEqual((tag['type'], tag['url']), ('tag', f"{reverse('catalog')}?tags=3"))
+
+    def test_heavy_prefixes_match_full_ranking(self):
+        entries = [
+            suggest.Entry(suggest.PRODUCT, index, (index * 37) % 11, f'Товар {index} модель {index % 7}')
+            for index in range(300)
+        ]
+        self.write(entries, top_k=5, scan_limit=8)
+        index = suggest.get_index()
+        self.assertGreater(index.heavy_count, 0)
+        for query in ('т', 'товар', 'товар 1', 'модель 3', 'м'):
+            expected = sorted(
+                (entry for entry in entries if any(
+                    key.startswith(suggest.normalize(query)) for key in suggest.entry_keys(entry.text, 8)
+                )),
+                key=suggest.Entry.rank,
+            )[:5]
+            self.assertEqual(self.titles(query, 5), [entry.text for entry in expected], query)
+
+    def test_replaced_snapshot_is_reloaded(self):
+        self.write([suggest.Entry(suggest.PRODUCT, 1, 0, 'Старое название')])
+        self.assertEqual(self.titles('стар'), ['Старое название'])
+        self.write([suggest.Entry(suggest.PRODUCT, 1, 0, 'Новое название')])
+        self.assertEqual(self.titles('стар'), [])
+        self.assertEqual(self.titles('нов'), ['Новое название'])
+
+
+class SuggestBuildTests(SuggestIndexMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=2, products_per_seller=5)
+
+    def build(self, full=False):
+        with self.assertLogs('marketplace.tasks', 'INFO'):
+            suggest.build(full=full)
+
+    def test_endpoint_without_queries(self):
+        self.build(full=True)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('search_suggest'), {'q': 'тов'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), len(self.data['checked_products']))
+        self.assertTrue(all(item['type'] == 'product' for item in results))
+        checked = {product.pk for product in self.data['checked_products']}
+        self.assertLessEqual({item['id'] for item in results}, checked)
+        self.assertEqual(self.client.get(reverse('search_suggest'), {'q': 'компания 1'}).json()['results'][0]['type'], 'seller')
+
+    def test_incremental_rebuild(self):
+        self.build(full=True)
+        renamed, hidden = self.data['checked_products'][:2]
+        Product.objects.filter(pk=renamed.pk).update(title='Кофемолка ручная', updated_at=timezone.now())
+        Product.objects.filter(pk=hidden.pk).update(checked=False, updated_at=timezone.now())
+        self.build()
+        self.assertEqual(self.titles('кофе'), ['Кофемолка ручная'])
+        self.assertNotIn(hidden.title, self.titles(hidden.title))
+        self.assertNotIn(renamed.title, self.titles(renamed.title))
+
+    def test_catalog_change_schedules_rebuild(self):
+        product = self.data['checked_products'][0]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.title = 'Новое название'
+            product.save()
+        events.dispatch()
+        self.assertTrue(Task.objects.filter(dedup_key='search-suggest-rebuild', status=Task.QUEUED).exists())
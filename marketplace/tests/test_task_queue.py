@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from marketplace import task_queue
+from marketplace.models import Product, Seller, Task
+
+calls = []
+
+
+@task_queue.task(name='tests.record', priority=1)
+def record(value):
+    calls.append(value)
+
+
+@task_queue.task(name='tests.fail', max_attempts=2)
+def fail():
+    raise RuntimeError('boom')
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_dedup_key_collapses_queued_tasks(self):
+        first = record.enqueue(dedup_key='same', value=1)
+        second = record.enqueue(dedup_key='same', value=2)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_claim_respects_priority_and_run_after(self):
+        low = record.enqueue(priority=0, value='low')
+        high = record.enqueue(priority=10, value='high')
+        record.enqueue(delay=timedelta(hours=1), priority=100, value='later')
+        claimed = task_queue.claim('w1', limit=5)
+        self.assertEqual([task.pk for task in claimed], [high.pk, low.pk])
+        self.assertEqual(task_queue.claim('w2', limit=5), [])
+
+    def test_run_worker_executes_and_records_status(self):
+        record.enqueue(value='a')
+        record.enqueue(value='b')
+        self.assertEqual(task_queue.run_worker('w1', burst=True), 2)
+        self.assertEqual(sorted(calls), ['a', 'b'])
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 2)
+
+    def test_failure_retries_with_backoff_then_fails(self):
+        task = fail.enqueue()
+        with self.assertLogs('marketplace.tasks', 'WARNING'):
+            task_queue.run_worker('w1', burst=True)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertGreater(task.run_after, timezone.now())
+        self.assertIn('boom', task.last_error)
+
+        Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+        with self.assertLogs('marketplace.tasks', 'WARNING'):
+            task_queue.run_worker('w1', burst=True)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+
+    def test_expired_lease_is_reclaimed(self):
+        task = record.enqueue(value='x')
+        task_queue.claim('crashed')
+        self.assertEqual(task_queue.claim('w2'), [])
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = task_queue.claim('w2')
+        self.assertEqual([t.locked_by for t in reclaimed], ['w2'])
+
+
+class ImagePipelineTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def test_uploaded_thumbnail_is_resized_in_background(self):
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', (2400, 1200), 'red').save(buffer, 'JPEG')
+        seller = Seller.objects.create(email='s@example.com', company_name='S', contact_person='C', phone='1')
+        with override_settings(MEDIA_ROOT=self.media_root, PRODUCT_IMAGE_MAX_SIZE=800):
+            product = Product.objects.create(
+                title='Большое фото', description='-', seller=seller,
+                thumbnail=SimpleUploadedFile('big.jpg', buffer.getvalue(), content_type='image/jpeg'),
+            )
+            self.assertTrue(Task.objects.filter(dedup_key=f'product-images:{product.pk}').exists())
+            task_queue.run_worker('w1', burst=True)
+            with Image.open(product.thumbnail.path) as image:
+                self.assertEqual(image.size, (800, 400))
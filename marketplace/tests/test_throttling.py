@@ -0,0 +1,135 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from marketplace import throttling
+
+from .fixtures import PASSWORD, seed_dataset
+
+
+# Начало эпохи корзин для лимитов в минуту, час и сутки
+EPOCH_START = 86400 * 8 * 1000
+
+
+def freeze_clock(test_case):
+    """Часы корзин стоят на секунде после начала эпохи: пополнение не зависит от скорости теста"""
+    clock = mock.Mock(time=mock.Mock(return_value=EPOCH_START + 1.0))
+    patcher = mock.patch.object(throttling, 'time', clock)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+
+
+def isolate_cache(test_case):
+    """Корзины в отдельном LocMem: clear() не трогает общий Redis с REDIS_URL"""
+    local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttling-tests'}
+    settings_override = override_settings(CACHES={**settings.CACHES, 'throttling': local})
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+    throttling.get_cache().clear()
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        isolate_cache(self)
+
+    def take(self, now, capacity=3, interval=60):
+        return throttling.consume('throttle:test', capacity, interval, now=now)
+
+    def test_burst_then_refill(self):
+        start = 1_000_000 * 480
+        self.assertEqual([self.take(start + 1) for _ in range(3)], [0, 0, 0])
+        # Токен пополняется раз в 20 секунд: ждать 20 - 1 = 19 секунд
+        self.assertAlmostEqual(self.take(start + 1), 19)
+        self.assertAlmostEqual(self.take(start + 11), 9)
+        self.assertEqual(self.take(start + 21), 0)
+        self.assertGreater(self.take(start + 21), 0)
+
+    def test_idle_does_not_overfill(self):
+        start = 1_000_000 * 480
+        self.assertEqual(self.take(start), 0)
+        # После простоя в корзине не больше capacity токенов
+        self.assertEqual([self.take(start + 400) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.take(start + 400), 0)
+
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('5/min'), (5, 60))
+        self.assertEqual(throttling.parse_rate('100/hour'), (100, 3600))
+
+
+@override_settings(PAGE_CACHE={'ENABLED': False})
+class ThrottleMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_dataset(sellers=1, products_per_seller=4, clients=1, cart_lines=1)
+
+    def setUp(self):
+        isolate_cache(self)
+        freeze_clock(self)
+
+    def test_login_attempts_limited_per_email_before_db(self):
+        url = reverse('client_login')
+        email = self.data['clients'][0].email
+        for _ in range(5):
+            response = self.client.post(url, {'email': email, 'password': 'wrong'})
+            self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {'email': email.upper(), 'password': PASSWORD})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # Другой email с того же адреса проверяется отдельной корзиной
+        response = self.client.post(url, {'email': 'other@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        # GET страницы входа не ограничивается
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(THROTTLING={'POLICIES': {'catalog': {'methods': ['GET'], 'limits': {'ip': '2/min'}}}})
+    def test_catalog_limited_per_ip(self):
+        url = reverse('catalog')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url, {'page': 2}).status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        response = self.client.get(url, {'page': 3})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+    def test_local_cache_reported_once_outside_debug(self):
+        with mock.patch.object(throttling, '_local_cache_reported', False):
+            with self.assertLogs('marketplace.throttling', 'ERROR') as logs:
+                throttling.ThrottleMiddleware(lambda request: None)
+                throttling.ThrottleMiddleware(lambda request: None)
+            self.assertEqual(len(logs.records), 1)
+        with mock.patch.object(throttling, '_local_cache_reported', False), override_settings(DEBUG=True):
+            with self.assertNoLogs('marketplace.throttling'):
+                throttling.ThrottleMiddleware(lambda request: None)
+
+    @override_settings(THROTTLING={'ENABLED': False})
+    def test_disabled(self):
+        url = reverse('client_login')
+        for _ in range(7):
+            self.assertEqual(self.client.post(url, {'email': 'a@example.com', 'password': 'x'}).status_code, 200)
+
+
+@override_settings(THROTTLING={'POLICIES': {'api_register': {'limits': {'ip': '2/hour'}}}})
+class ApiThrottleTests(TestCase):
+
+    def setUp(self):
+        isolate_cache(self)
+        freeze_clock(self)
+
+    def test_registration_limited_with_retry_after(self):
+        url = reverse('client_register_api')
+        for index in range(2):
+            response = self.client.post(url, {
+                'email': f'client{index}@example.com', 'name': 'Клиент',
+                'password': PASSWORD, 'password_confirm': PASSWORD,
+            }, content_type='application/json')
+            self.assertNotEqual(response.status_code, 429)
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        # Токен раз в 30 минут, с начала эпохи прошла секунда
+        self.assertEqual(response['Retry-After'], '1799')
@@ -0,0 +1,244 @@
+"""
+Ограничение частоты запросов: корзины токенов в кеше Django.
+
+Корзина ёмкостью N пополняется N токенами за интервал лимита ('5/min' -
+пять попыток подряд и дальше одна раз в 12 секунд). Состояние - один
+счетчик взятых токенов в кеше (CACHE): запрос атомарно делает incr, а
+заработанные к этому моменту токены считаются от начала эпохи, поэтому
+для проверки не нужны ни блокировки, ни чтение-изменение-запись. Эпоха
+длится EPOCH_INTERVALS интервалов лимита, с новой эпохой корзина снова
+полная (за эпоху допускается не больше одного лишнего всплеска).
+
+Лимиты задаются политиками (POLICIES) по имени маршрута или scope DRF и
+ключам: 'ip' - адрес клиента, 'principal' - email из формы входа, токен
+API или аутентифицированный пользователь DRF. Каждая пара маршрут/ключ -
+отдельная корзина.
+
+ThrottleMiddleware стоит до кеша страниц и сессий и отвечает 429 с
+Retry-After раньше любых запросов к БД и проверки пароля.
+Представления DRF подключают BucketThrottle с атрибутом throttle_scope.
+
+Кеш должен быть общим для процессов (Redis): в LocMem у каждого воркера
+свои корзины и фактический лимит умножается на число воркеров. Вне DEBUG
+об этом при запуске пишется ошибка в лог.
+"""
+import hashlib
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+logger = logging.getLogger('marketplace.throttling')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    # Заголовок с адресом клиента от доверенного прокси (например,
+    # 'HTTP_X_REAL_IP'); по умолчанию REMOTE_ADDR
+    'IP_HEADER': None,
+    'EPOCH_INTERVALS': 8,
+    # Поля формы, по которым определяется principal для входа и регистрации
+    'PRINCIPAL_FIELDS': ['email'],
+    'POLICIES': {
+        'client_login': {'methods': ['POST'], 'limits': {'ip': '20/min', 'principal': '5/min'}},
+        'seller_login': {'methods': ['POST'], 'limits': {'ip': '20/min', 'principal': '5/min'}},
+        'client_register': {'methods': ['POST'], 'limits': {'ip': '20/hour'}},
+        'catalog': {'methods': ['GET', 'HEAD'], 'limits': {'ip': '300/min'}},
+        'search_suggest': {'methods': ['GET'], 'limits': {'ip': '600/min'}},
+        # scope DRF (throttle_scope представлений API)
+        'api_register': {'limits': {'ip': '20/hour'}},
+        'api_products': {'limits': {'ip': '600/min', 'principal': '1200/min'}},
+    },
+}
+
+UNITS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+throttled_requests = metrics.Counter(
+    'marketplace_throttled_requests_total',
+    'Запросы, отклоненные ограничением частоты',
+    ['route', 'key'],
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'THROTTLING', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting('CACHE')]
+
+
+def is_shared(cache):
+    """Кеш виден всем процессам; LocMem у каждого процесса свой"""
+    return not isinstance(cache, LocMemCache)
+
+
+_local_cache_reported = False
+
+
+def report_local_cache():
+    # Один раз на процесс: middleware создается каждым обработчиком запросов
+    global _local_cache_reported
+    if not _local_cache_reported:
+        _local_cache_reported = True
+        logger.error(
+            'throttling cache %r is local to the process: limits are multiplied by the number of workers',
+            get_setting('CACHE'),
+        )
+
+
+def parse_rate(rate):
+    """'5/min' -> (5, 60): ёмкость корзины и интервал полного пополнения в секундах"""
+    count, _, unit = rate.partition('/')
+    return int(count), UNITS[unit.strip()]
+
+
+def consume(key, capacity, interval, now=None):
+    """
+    Берет токен из корзины key. Возвращает 0, если токен взят, иначе
+    число секунд до появления следующего токена.
+    """
+    now = time.time() if now is None else now
+    epoch_length = interval * get_setting('EPOCH_INTERVALS')
+    epoch = int(now // epoch_length)
+    elapsed = now - epoch * epoch_length
+    earned = capacity + int(elapsed * capacity / interval)
+    key = f'{key}:{epoch}'
+    cache = get_cache()
+    try:
+        taken = cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=math.ceil(epoch_length - elapsed) + 1)
+        taken = cache.incr(key)
+
+    if taken > earned:
+        # Отказ не расходует токен: Retry-After остается точным
+        cache.decr(key)
+        return (taken - capacity) * interval / capacity - elapsed
+
+    left = earned - taken
+    if left >= capacity:
+        # Простой не копит токены сверх ёмкости корзины
+        cache.incr(key, left - capacity + 1)
+    return 0
+
+
+def client_ip(request):
+    header = get_setting('IP_HEADER')
+    if header and request.META.get(header):
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def request_principal(request):
+    """Учетная запись, к которой обращается запрос: email из формы или токен API"""
+    if request.method == 'POST' and request.content_type in (
+        'application/x-www-form-urlencoded', 'multipart/form-data',
+    ):
+        for field in get_setting('PRINCIPAL_FIELDS'):
+            value = request.POST.get(field, '').strip().lower()
+            if value:
+                return f'{field}:{value}'
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    if auth_header.startswith('Token '):
+        return f'token:{auth_header[6:].strip()}'
+    return None
+
+
+def _digest(value):
+    # Ключ кеша фиксированной длины без email и токенов в открытом виде
+    return hashlib.blake2b(value.encode(), digest_size=12).hexdigest()
+
+
+def check(route, ip, principal=None, policy=None):
+    """Проверяет лимиты политики route; возвращает секунды ожидания или 0"""
+    policy = policy or get_setting('POLICIES').get(route)
+    if not policy:
+        return 0
+    identities = {'ip': ip, 'principal': principal}
+    for key, rate in policy['limits'].items():
+        identity = identities[key]
+        if not identity:
+            continue
+        capacity, interval = parse_rate(rate)
+        wait = consume(f'throttle:{route}:{key}:{_digest(identity)}', capacity, interval)
+        if wait:
+            throttled_requests.inc(route=route, key=key)
+            return wait
+    return 0
+
+
+def retry_after_header(wait):
+    return str(max(1, math.ceil(wait)))
+
+
+class ThrottleMiddleware:
+    """Ответ 429 для маршрутов из POLICIES до сессий, кеша страниц и представлений"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = get_setting('ENABLED')
+        self.policies = {
+            route: policy for route, policy in get_setting('POLICIES').items()
+            if policy.get('methods')
+        }
+        if self.enabled and not settings.DEBUG and not is_shared(get_cache()):
+            report_local_cache()
+
+    def __call__(self, request):
+        if self.enabled and self.policies:
+            wait = self.check(request)
+            if wait:
+                return self.throttled(request, wait)
+        return self.get_response(request)
+
+    def check(self, request):
+        try:
+            route = resolve(request.path_info).url_name
+        except Resolver404:
+            return 0
+        policy = self.policies.get(route)
+        if not policy or request.method not in policy['methods']:
+            return 0
+        principal = request_principal(request) if 'principal' in policy['limits'] else None
+        return check(route, client_ip(request), principal, policy)
+
+    def throttled(self, request, wait):
+        message = 'Слишком много запросов. Повторите попытку позже.'
+        if request.path_info.startswith('/api/'):
+            response = JsonResponse({'detail': message}, status=429, json_dumps_params={'ensure_ascii': False})
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = retry_after_header(wait)
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Throttle DRF на тех же корзинах: политика выбирается по throttle_scope
+    представления. principal - аутентифицированный продавец или клиент.
+    """
+
+    def allow_request(self, request, view):
+        self.wait_seconds = 0
+        if not get_setting('ENABLED'):
+            return True
+        scope = getattr(view, 'throttle_scope', None)
+        user = getattr(request, 'user', None)
+        principal = None
+        if getattr(user, 'pk', None) is not None:
+            principal = f'{user._meta.model_name}:{user.pk}'
+        self.wait_seconds = check(scope, client_ip(request), principal)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds or None
@@ -4,8 +4,11 @@ from . import views
 from . import auth_views
 from . import cart_views
 from . import seller_views
+from . import live_views
+from . import ops_views
+from . import suggest_views
 from .api_views import (
-    ProductViewSet, TagViewSet,
+    ProductViewSet, TagViewSet, WebhookEndpointViewSet,
     SellerRegistrationView, ClientRegistrationView,
     SellerProfileView, ClientProfileView
 )
@@ -14,6 +17,7 @@ from .api_views import (
 router = DefaultRouter()
 router.register(r'api/products', ProductViewSet, basename='product')
 router.register(r'api/tags', TagViewSet, basename='tag')
+router.register(r'api/webhooks', WebhookEndpointViewSet, basename='webhook')
 
 urlpatterns = [
     # Веб-страницы
@@ -40,7 +44,14 @@ urlpatterns = [
     path("seller/products/<int:product_id>/edit/", seller_views.seller_product_edit, name="seller_product_edit"),
     path("seller/products/<int:product_id>/delete/", seller_views.seller_product_delete, name="seller_product_delete"),
     
+    # Служебные страницы (только персонал)
+    path("ops/perf/", ops_views.perf_stats, name="perf_stats"),
+    path("metrics", ops_views.metrics_view, name="metrics"),
+    
     # API маршруты
+    # Поток живых обновлений объявлен до роутера, иначе "stream" совпадет с {pk}
+    path('api/products/stream/', live_views.product_stream, name='product_stream'),
+    path('api/search/suggest', suggest_views.search_suggest, name='search_suggest'),
     path('', include(router.urls)),
     
     # API Регистрация (клиенты могут регистрироваться через веб или API)
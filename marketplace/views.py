@@ -1,5 +1,6 @@
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Q
+from django.db.models import Count, Q, prefetch_related_objects
+from . import cards, page_cache, recommendations
 from .models import Product, Tag
 
 
@@ -14,7 +15,7 @@ def index(request):
     tags = Tag.objects.all()[:10]
     
     context = {
-        'products': products,
+        'cards': cards.product_cards(products),
         'tags': tags,
     }
     
@@ -26,24 +27,34 @@ def product_detail(request, product_id: int):
     Детальная страница продукта
     """
     product = get_object_or_404(
-        Product.objects.select_related('seller').prefetch_related('tags', 'product_photos'),
+        Product.objects.select_related('seller'),
         id=product_id,
         checked=True  # Только проверенные продукты
     )
     
-    # Получаем фотографии продукта, отсортированные по порядку
-    photos = product.product_photos.all().order_by('order', 'created_at')
-    
-    # Похожие продукты (по тегам) с фотографиями
-    similar = Product.objects.filter(
+    # Похожие продукты (по тегам)
+    similar = list(Product.objects.filter(
         tags__in=product.tags.all(),
         checked=True
-    ).exclude(id=product.id).select_related('seller').prefetch_related('tags', 'product_photos').distinct()[:3]
+    ).exclude(id=product.id).distinct()[:3])
+    
+    # С этим товаром также добавляют (по корзинам покупателей)
+    also_added = list(recommendations.also_added(product.id)[:3])
+    
+    # Теги и фотографии продукта и обоих блоков - одной парой запросов
+    prefetch_related_objects([product, *similar, *also_added], 'tags', 'product_photos')
+    
+    # Кеш страниц сбрасывает эту страницу и при изменении продуктов из блоков
+    page_cache.depends_on(request, [item.id for item in (*similar, *also_added)])
+    
+    # Фотографии уже отсортированы по Meta.ordering (order, created_at) и взяты из prefetch
+    photos = product.product_photos.all()
     
     context = {
         'product': product,
         'photos': photos,
-        'similar': similar,
+        'similar': cards.product_cards(similar),
+        'also_added': cards.product_cards(also_added),
     }
     
     return render(request, "marketplace/product_detail.html", context)
@@ -111,21 +122,16 @@ def catalog(request):
     else:  # newest (по умолчанию)
         products = products.order_by('-created_at')
     
-    # Получаем все теги для фильтров с количеством продуктов
-    all_tags = Tag.objects.all().order_by('tagtitle')
-    
-    # Подсчитываем количество продуктов для каждого тега
-    tags_with_counts = []
-    for tag in all_tags:
-        count = Product.objects.filter(checked=True, tags=tag).count()
-        if count > 0:
-            tags_with_counts.append({
-                'tag': tag,
-                'count': count
-            })
+    # Теги для фильтров с количеством проверенных продуктов - одним запросом
+    tags_with_counts = [
+        {'tag': tag, 'count': tag.checked_count}
+        for tag in Tag.objects.annotate(
+            checked_count=Count('products', filter=Q(products__checked=True))
+        ).filter(checked_count__gt=0).order_by('tagtitle')
+    ]
     
     context = {
-        'products': products,
+        'cards': cards.product_cards(products),
         'tags_with_counts': tags_with_counts,
         'search_query': search_query,
         'selected_tags': valid_tag_ids,  # Список только отмеченных тегов из GET-запроса
@@ -0,0 +1,512 @@
+"""
+Вебхуки продавцов: product.approved, product.stock_low,
+product.out_of_stock и cart.added.
+
+События пишутся в таблицу WebhookEvent (outbox) в той же транзакции, что
+и изменение, которое их вызвало: откат транзакции отменяет и событие,
+а закоммиченное событие не теряется при падении процесса. Адреса
+продавца читаются из кеша, поэтому добавление в корзину у продавца без
+вебхуков не делает лишних запросов.
+
+После коммита ставится задача deliver_webhooks (с задержкой
+DELIVERY_DELAY, за которую события копятся в пачки). Задача арендует
+события, к которым подошло время, и отправляет их на каждый адрес
+пачками до BATCH_SIZE событий одним POST-запросом. Соединения keep-alive
+берутся из пула на http.client. Тело подписывается HMAC-SHA256 секретом
+адреса: заголовок X-Marketplace-Signature: sha256=<hex> от
+"<X-Marketplace-Timestamp>.<тело>". Ответ не 2xx или ошибка сети
+откладывают пачку с экспоненциальной задержкой; после MAX_ATTEMPTS
+попыток события помечаются failed.
+
+Адрес вебхука задает продавец, поэтому запросы не должны уходить во
+внутреннюю сеть: адрес - только https (http - при DEBUG или ALLOW_HTTP),
+а хост не должен разрешаться в loopback, частные, link-local и
+зарезервированные адреса. Проверка выполняется при сохранении адреса и
+повторно перед каждым новым соединением: соединение открывается на
+проверенный IP, поэтому подмена DNS-ответа после проверки не сработает.
+"""
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import logging
+import random
+import socket
+import ssl
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models import F
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import metrics, seller_stats
+from .models import CartItem, Product, WebhookEndpoint, WebhookEvent
+
+logger = logging.getLogger('marketplace.webhooks')
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'ENDPOINTS_CACHE_TIMEOUT': 60,
+    'MAX_ENDPOINTS': 5,
+    'DELIVERY_DELAY': 5,
+    'BATCH_SIZE': 100,
+    'TIMEOUT': 10,
+    'MAX_IDLE_CONNECTIONS': 4,
+    'MAX_ATTEMPTS': 12,
+    'RETRY_BACKOFF': 30,
+    'RETRY_BACKOFF_MAX': 6 * 3600,
+    'LEASE_SECONDS': 300,
+    'KEEP_DELIVERED_HOURS': 72,
+    'SIGNATURE_TOLERANCE': 300,
+    # None - как DEBUG; внутренние адреса разрешаются только для локальной разработки
+    'ALLOW_HTTP': None,
+    'ALLOW_PRIVATE_ADDRESSES': False,
+}
+
+# Тело ответа получателя не нужно; читается не больше этого, иначе соединение закрывается
+MAX_RESPONSE_BYTES = 64 * 1024
+
+# Отправляется после коммита транзакции, записавшей события (подписан marketplace.signals)
+events_queued = Signal()
+
+webhook_events = metrics.Counter(
+    'marketplace_webhook_events_total',
+    'События вебхуков, записанные в outbox',
+    ['event'],
+)
+webhook_batches = metrics.Counter(
+    'marketplace_webhook_batches_total',
+    'Отправленные пачки событий вебхуков',
+    ['status'],
+)
+webhook_request_duration = metrics.Histogram(
+    'marketplace_webhook_request_duration_seconds',
+    'Время POST-запроса с пачкой событий',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'WEBHOOKS', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting('CACHE')]
+
+
+def _endpoints_key(seller_id):
+    return f'webhooks:endpoints:{seller_id}'
+
+
+def endpoints_for(seller_ids):
+    """{seller_id: [(endpoint_id, events), ...]} активных адресов продавцов"""
+    cache = get_cache()
+    keys = {seller_id: _endpoints_key(seller_id) for seller_id in set(seller_ids)}
+    cached = cache.get_many(keys.values())
+    result = {seller_id: cached[key] for seller_id, key in keys.items() if key in cached}
+    missing = set(keys) - set(result)
+    if missing:
+        loaded = {seller_id: [] for seller_id in missing}
+        rows = WebhookEndpoint.objects.filter(seller_id__in=missing, is_active=True).values_list(
+            'id', 'seller_id', 'events',
+        )
+        for endpoint_id, seller_id, events in rows:
+            loaded[seller_id].append((endpoint_id, events))
+        cache.set_many(
+            {keys[seller_id]: endpoints for seller_id, endpoints in loaded.items()},
+            get_setting('ENDPOINTS_CACHE_TIMEOUT'),
+        )
+        result.update(loaded)
+    return result
+
+
+def forget_endpoints(seller_id):
+    get_cache().delete(_endpoints_key(seller_id))
+
+
+def emit_many(items):
+    """
+    Записать события [(seller_id, event, payload), ...] в outbox для
+    подписанных адресов - одним INSERT в текущей транзакции. Возвращает
+    число записанных строк.
+    """
+    items = list(items)
+    if not items:
+        return 0
+    endpoints = endpoints_for(seller_id for seller_id, _, _ in items)
+    now = timezone.now()
+    objs = [
+        WebhookEvent(endpoint_id=endpoint_id, event=event, payload=payload, created_at=now, next_attempt_at=now)
+        for seller_id, event, payload in items
+        for endpoint_id, events in endpoints[seller_id]
+        if event in events
+    ]
+    if not objs:
+        return 0
+    # Кеш процесса мог пережить удаление адреса другим воркером: вставка с
+    # таким endpoint_id нарушила бы внешний ключ и откатила бы всю транзакцию
+    cached = {obj.endpoint_id for obj in objs}
+    active = set(WebhookEndpoint.objects.filter(id__in=cached, is_active=True).values_list('id', flat=True))
+    if active != cached:
+        for seller_id in {seller_id for seller_id, _, _ in items}:
+            forget_endpoints(seller_id)
+        objs = [obj for obj in objs if obj.endpoint_id in active]
+        if not objs:
+            return 0
+    WebhookEvent.objects.bulk_create(objs)
+    for obj in objs:
+        webhook_events.inc(event=obj.event)
+    transaction.on_commit(lambda: events_queued.send(sender=WebhookEvent, count=len(objs)))
+    return len(objs)
+
+
+def emit(seller_id, event, payload):
+    return emit_many([(seller_id, event, payload)])
+
+
+def products_approved(rows):
+    """rows - [(product_id, seller_id), ...] одобренных продуктов"""
+    return emit_many(
+        (seller_id, WebhookEndpoint.PRODUCT_APPROVED, {'product_id': product_id})
+        for product_id, seller_id in rows
+    )
+
+
+def product_stock_changed(product, previous):
+    """Остаток перешел порог низкого остатка или стал нулевым"""
+    stock = product.__dict__.get('stock')
+    if stock is None or previous is None or stock == previous:
+        return 0
+    threshold = seller_stats.LOW_STOCK_THRESHOLD
+    if stock == 0:
+        event = WebhookEndpoint.PRODUCT_OUT_OF_STOCK
+    elif stock <= threshold < previous:
+        event = WebhookEndpoint.PRODUCT_STOCK_LOW
+    else:
+        return 0
+    return emit(product.seller_id, event, {'product_id': product.pk, 'stock': stock})
+
+
+def cart_item_added(cart_item):
+    if CartItem.product.is_cached(cart_item):
+        seller_id = cart_item.product.seller_id
+    else:
+        seller_id = Product.objects.filter(pk=cart_item.product_id).values_list('seller_id', flat=True).first()
+    if seller_id is None:
+        return 0
+    return emit(seller_id, WebhookEndpoint.CART_ADDED, {
+        'product_id': cart_item.product_id,
+        'quantity': cart_item.quantity,
+    })
+
+
+def signature(secret, timestamp, body):
+    mac = hmac.new(secret.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256)
+    return f'sha256={mac.hexdigest()}'
+
+
+def verify_signature(secret, timestamp, body, header, now=None):
+    """Проверка подписи на стороне получателя: подпись совпадает и пачка не старше SIGNATURE_TOLERANCE"""
+    try:
+        age = abs((now or time.time()) - int(timestamp))
+    except (TypeError, ValueError):
+        return False
+    return age <= get_setting('SIGNATURE_TOLERANCE') and hmac.compare_digest(signature(secret, timestamp, body), header)
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def resolve_host(host, port):
+    """
+    IP-адреса хоста для соединения. ValueError, если имя не разрешается или
+    хотя бы один адрес внутренний (loopback, частный, link-local, зарезервированный).
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as exc:
+        raise ValueError(f'Не удалось разрешить имя хоста {host}') from exc
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    if not get_setting('ALLOW_PRIVATE_ADDRESSES') and not all(map(_is_public, addresses)):
+        raise ValueError(f'Адрес вебхука указывает во внутреннюю сеть: {host}')
+    return addresses
+
+
+def parse_url(url):
+    """Разбирает адрес вебхука; ValueError для недопустимой схемы"""
+    parts = urlsplit(url)
+    allow_http = get_setting('ALLOW_HTTP')
+    schemes = ('http', 'https') if (settings.DEBUG if allow_http is None else allow_http) else ('https',)
+    if parts.scheme not in schemes or not parts.hostname:
+        raise ValueError(f'Адрес вебхука должен начинаться с {" или ".join(f"{s}://" for s in schemes)}')
+    if parts.username or parts.password:
+        raise ValueError('Адрес вебхука не должен содержать логин и пароль')
+    return parts
+
+
+def check_url(url):
+    """Проверка адреса при сохранении: схема и хост вне внутренней сети"""
+    parts = parse_url(url)
+    resolve_host(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    """Соединение на заранее проверенный IP (address); Host - по имени из адреса"""
+    address = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout, self.source_address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection, PinnedHTTPConnection):
+    """TLS поверх PinnedHTTPConnection: SNI и проверка сертификата - по имени хоста"""
+
+
+class ConnectionPool:
+    """
+    Соединения keep-alive на http.client: для каждого (схема, хост, порт)
+    хранится до max_idle свободных соединений, поэтому пачки к одному
+    адресу идут без новых TCP- и TLS-рукопожатий.
+    """
+
+    def __init__(self, timeout, max_idle):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def _connect(self, scheme, host, port):
+        # Имя разрешается и проверяется для каждого нового соединения (см. модуль)
+        address = resolve_host(host, port or (443 if scheme == 'https' else 80))[0]
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            conn = PinnedHTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context)
+        else:
+            conn = PinnedHTTPConnection(host, port, timeout=self.timeout)
+        conn.address = address
+        return conn
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def post(self, url, body, headers):
+        """POST на url; возвращает код ответа"""
+        parts = parse_url(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        with self._lock:
+            conn = self._idle[key].pop() if self._idle[key] else None
+        reused = conn is not None
+        while True:
+            conn = conn or self._connect(*key)
+            try:
+                conn.request('POST', path, body, headers)
+                response = conn.getresponse()
+                response.read(MAX_RESPONSE_BYTES)
+            except (ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # Получатель закрыл простаивавшее соединение - один повтор на новом
+                conn, reused = None, False
+                continue
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close or not response.isclosed():
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status
+
+    def close(self):
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+        for conn in connections:
+            conn.close()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(get_setting('TIMEOUT'), get_setting('MAX_IDLE_CONNECTIONS'))
+    return _pool
+
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    global _pool
+    if setting == 'WEBHOOKS' and _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def backoff_delay(attempts):
+    """Экспоненциальная задержка повтора со случайным разбросом"""
+    base = get_setting('RETRY_BACKOFF') * 2 ** max(attempts - 1, 0)
+    return min(base, get_setting('RETRY_BACKOFF_MAX')) * random.uniform(0.8, 1.2)
+
+
+def _due(now):
+    return WebhookEvent.objects.filter(
+        status=WebhookEvent.PENDING, next_attempt_at__lte=now, endpoint__is_active=True,
+    ).order_by('next_attempt_at', 'id')
+
+
+def claim_due(limit, now=None):
+    """Арендовать до limit событий, время которых подошло; аренда - сдвиг next_attempt_at на LEASE_SECONDS"""
+    now = now or timezone.now()
+    lease_until = now + timedelta(seconds=get_setting('LEASE_SECONDS'))
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(
+                _due(now).select_for_update(skip_locked=True, of=('self',)).values_list('id', flat=True)[:limit]
+            )
+            WebhookEvent.objects.filter(id__in=ids).update(next_attempt_at=lease_until)
+        else:
+            # SQLite: повторная проверка условия в UPDATE не дает взять события другого воркера
+            ids = list(_due(now).values_list('id', flat=True)[:limit])
+            WebhookEvent.objects.filter(
+                id__in=ids, status=WebhookEvent.PENDING, next_attempt_at__lte=now,
+            ).update(next_attempt_at=lease_until)
+    if not ids:
+        return []
+    return list(
+        WebhookEvent.objects.filter(id__in=ids, next_attempt_at=lease_until).select_related('endpoint').order_by('id')
+    )
+
+
+def batch_body(events):
+    return json.dumps(
+        {
+            'events': [
+                {'id': event.pk, 'type': event.event, 'created_at': event.created_at, 'data': event.payload}
+                for event in events
+            ],
+        },
+        cls=DjangoJSONEncoder,
+        ensure_ascii=False,
+    ).encode()
+
+
+def send_batch(endpoint, events):
+    """Отправить пачку событий одного адреса; возвращает None или текст ошибки"""
+    body = batch_body(events)
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'marketplace-webhooks/1',
+        'X-Marketplace-Delivery': uuid.uuid4().hex,
+        'X-Marketplace-Timestamp': timestamp,
+        'X-Marketplace-Signature': signature(endpoint.secret, timestamp, body),
+    }
+    started = time.perf_counter()
+    try:
+        status = get_pool().post(endpoint.url, body, headers)
+    except (OSError, http.client.HTTPException, ValueError) as exc:
+        error = f'{type(exc).__name__}: {exc}'
+    else:
+        error = None if 200 <= status < 300 else f'HTTP {status}'
+    webhook_request_duration.observe(time.perf_counter() - started)
+    webhook_batches.inc(status='delivered' if error is None else 'failed')
+    return error
+
+
+def _retry(attempted, unsent, error, now):
+    """Отложить неудачную пачку (с учетом попытки) и неотправленные пачки того же адреса"""
+    max_attempts = get_setting('MAX_ATTEMPTS')
+    attempts = max(event.attempts for event in attempted) + 1
+    retry_at = now + timedelta(seconds=backoff_delay(attempts))
+    ids = [event.pk for event in attempted]
+    failed = WebhookEvent.objects.filter(id__in=ids, attempts__gte=max_attempts - 1).update(
+        status=WebhookEvent.FAILED, attempts=F('attempts') + 1, last_error=error,
+    )
+    WebhookEvent.objects.filter(id__in=ids, status=WebhookEvent.PENDING).update(
+        attempts=F('attempts') + 1, next_attempt_at=retry_at, last_error=error,
+    )
+    if unsent:
+        WebhookEvent.objects.filter(id__in=[event.pk for event in unsent]).update(next_attempt_at=retry_at)
+    return failed
+
+
+def deliver_due(limit=None):
+    """
+    Отправить все события, время которых подошло. Пачки одного адреса идут
+    по порядку id; после первой неудачи остальные пачки адреса откладываются
+    до его следующей попытки. Возвращает (доставлено, окончательно не доставлено).
+    """
+    batch_size = get_setting('BATCH_SIZE')
+    limit = limit or batch_size * 10
+    delivered = failed = 0
+    while True:
+        events = claim_due(limit)
+        by_endpoint = defaultdict(list)
+        for event in events:
+            by_endpoint[event.endpoint_id].append(event)
+        for endpoint_events in by_endpoint.values():
+            endpoint = endpoint_events[0].endpoint
+            for start in range(0, len(endpoint_events), batch_size):
+                batch = endpoint_events[start:start + batch_size]
+                error = send_batch(endpoint, batch)
+                if error is None:
+                    WebhookEvent.objects.filter(id__in=[event.pk for event in batch]).update(
+                        status=WebhookEvent.DELIVERED,
+                        attempts=F('attempts') + 1,
+                        delivered_at=timezone.now(),
+                        last_error='',
+                    )
+                    delivered += len(batch)
+                    continue
+                logger.warning('webhook %s (%s events) failed: %s', endpoint.url, len(batch), error)
+                failed += _retry(batch, endpoint_events[start + batch_size:], error, timezone.now())
+                break
+        if len(events) < limit:
+            return delivered, failed
+
+
+def next_attempt_at():
+    """Время ближайшей попытки среди ожидающих событий или None"""
+    return (
+        WebhookEvent.objects.filter(status=WebhookEvent.PENDING, endpoint__is_active=True)
+        .order_by('next_attempt_at')
+        .values_list('next_attempt_at', flat=True)
+        .first()
+    )
+
+
+def purge_delivered(older_than=None):
+    """Удалить доставленные события старше KEEP_DELIVERED_HOURS (недоставленные остаются для разбора)"""
+    older_than = older_than or timedelta(hours=get_setting('KEEP_DELIVERED_HOURS'))
+    deleted, _ = WebhookEvent.objects.filter(
+        status=WebhookEvent.DELIVERED, delivered_at__lt=timezone.now() - older_than,
+    ).delete()
+    return deleted